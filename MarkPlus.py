@@ -1,36 +1,89 @@
 # Python Version: 3.13
 # 入口，同时处理了一堆东西，比如QAction
 
+import multiprocessing
 import os
 import sys
 
-from PySide6.QtCore import Qt, QFile, QTextStream, QTimer, QUrl
-from PySide6.QtGui import (
-    QIcon, QPalette, QAction, QKeySequence, QDesktopServices, QTextDocument
-)
-from PySide6.QtPrintSupport import QPrinter, QPrintDialog
-from PySide6.QtWidgets import (
-    QApplication, QMainWindow, QWidget, QHBoxLayout, QVBoxLayout,
-    QSplitter, QScrollArea, QLabel, QFileDialog, QPushButton, QDialog, QFrame
-)
-
-from functions.DropFileRewrite import *
-from functions.Highlighter import *
-from functions.Renderer import *
+if __name__ == "__main__":
+    multiprocessing.freeze_support()  # 打包后批量渲染的进程池要用，子进程到这里就去干活了，不会往下导入界面
+
+    # 无界面批量渲染：MPlus render <源目录> <输出目录>，在导入Qt界面之前就分出去，CI上不需要图形库
+    # 按模块方式跑BatchRender：进程池spawn出来的子进程重新导入的是它，而不是这个带界面的文件
+    if len(sys.argv) > 1 and sys.argv[1] == "render":
+        import runpy
+        sys.argv = sys.argv[:1] + sys.argv[2:]
+        runpy.run_module("functions.BatchRender", run_name="__main__", alter_sys=True)
+
+from functions.StartupProfile import startupProfile
+
+# 重的东西（QtPrintSupport、markdown-it、pygments）不在这里导入：
+# 打印用到时才导，渲染器在窗口显示之后由渲染线程导入
+with startupProfile.phase("import.qt"):
+    from PySide6.QtCore import Qt, QThreadPool, QTimer, QUrl, Signal
+    from PySide6.QtGui import (
+        QColor, QIcon, QPalette, QAction, QActionGroup, QKeySequence, QDesktopServices
+    )
+    from PySide6.QtWidgets import (
+        QApplication, QMainWindow, QWidget, QHBoxLayout, QVBoxLayout,
+        QLabel, QFileDialog, QPushButton, QDialog, QFrame, QTabWidget, QMessageBox, QProgressDialog
+    )
+
+with startupProfile.phase("import.functions"):
+    from functions.AutoSave import AutoSaver
+    from functions.DocumentTab import DocumentTab
+    from functions.FileWatcher import FileWatcher
+    from functions.FindBar import FindBar
+    from functions.ImageLoader import THUMBNAIL_DIR, ImageLoader
+    from functions.OutlinePanel import OutlinePanel
+    from functions.PdfExport import DocumentExporter
+    from functions.PreviewStyle import PREVIEW_CSS
+    from functions.RenderBudget import LEVEL_FULL
+    from functions.RenderScheduler import *
+    from functions.SingleInstance import InstanceServer, enabledFromEnvironment, sendToRunningInstance
+    from functions.Tracer import tracer
 
 
 # noinspection PyAttributeOutsideInit
 class MarkdownPreviewer(QMainWindow):
+    previewDebounceMs = RenderScheduler.DEFAULT_DEBOUNCE_MS  # 输入停顿多久才刷新预览
+    highlightFinished = Signal()  # 后台高亮的大代码块好了，重新渲染一次把纯文本换掉
+    styleSheetReady = Signal(str)  # 渲染器建好了，带着和它输出配套的样式表
+    # 所有标签的预览文档 + 块缓存 + 高亮缓存加起来的上限，超了从最久没看的后台标签开始清
+    cacheBudgetBytes = 256 * 1024 * 1024
+    # 一次渲染超过这么久（毫秒）预览就开始降级，0是不降级；菜单里能改
+    renderBudgetMs = 200
+    renderBudgetChoices = (0, 50, 100, 200, 500, 1000)
+    watchFiles = True  # 打开的文件在外面被改了就自动载入改动
+    thumbnailDiskCache = False  # 缩小过的预览图存到~/.mplus/thumbnails，下次打开不用再解；默认只在内存里缓存
+
     def __init__(self, file_path=None):
         super().__init__()
-        self.currentFile = file_path  # Initialize with the provided file path
-        self.setupUi()
-        self.setupMenu()
+        self.previewStarted = False  # 窗口第一次显示之后才开始渲染预览
+        self.firstPreviewShown = False
+        self.activeTab = None
+        self.activationCount = 0
+        self.highlightCache = None  # 渲染器在渲染线程里建好之后才有
+        self.previewCss = PREVIEW_CSS  # 渲染器建好之前先用不含代码配色的基础样式，反正还没有内容
+        self.scrollSyncEnabled = True  # 编辑器和预览一起滚
+        with startupProfile.phase("window.setupUi"):
+            self.setupUi()
+        with startupProfile.phase("window.setupMenu"):
+            self.setupMenu()
+        self.setupStatusBar()
         self.setupAutoSave()
+        self.setupFileWatcher()
+        self.setupExporter()
+        # 预览图片的后台解码和缩略图缓存，所有标签共用
+        self.imageLoader = ImageLoader(THUMBNAIL_DIR if self.thumbnailDiskCache else None, self)
 
         # Load the file if one was provided
-        if file_path:
-            self.loadFile(file_path)
+        with startupProfile.phase("window.loadFile"):
+            tab = self.newTab()
+            if file_path:
+                tab.loadFile(file_path)
+            else:
+                tab.startJournal()
 
     def setupUi(self):
         self.setWindowTitle("MPlus")
@@ -49,108 +102,49 @@ class MarkdownPreviewer(QMainWindow):
         mainLayout = QHBoxLayout(mainWidget)
         mainLayout.setContentsMargins(0, 0, 0, 0)
 
-        self.splitter = QSplitter(Qt.Horizontal)
-        self.splitter.setStyleSheet("QSplitter::handle { background-color: #333337; }")
-        mainLayout.addWidget(self.splitter)
-
-        # 预览与编辑
-        self.setupMarkdownInput()
-        self.setupPreviewArea()
-
-        self.splitter.setSizes([self.width() // 2, self.width() // 2])
-
-        self.markdownInput.setPlaceholderText(
-            "导入，拖拽您的MarkDown文件到此处，或者直接开始创作！\n"
-        )
-
-    # noinspection PyAttributeOutsideInit
-    def setupMarkdownInput(self):
-        self.markdownInput = DragDropTextEdit(load_callback=self.loadFile)
-        self.markdownInput.setFont(QFont("Microsoft YaHei", 10))
-        self.markdownInput.setStyleSheet("""
-            QTextEdit {
-                font-size: 12px;
-                line-height: 1.5;
-                padding: 12px;
-                color: #ffffff;
-                background-color: #1e1e1e;
-                border: none;
-                selection-color: white;
-                selection-background-color: #094771;
-            }
-            QTextEdit:focus {
-                border: 1px solid #569cd6;
-            }
-            QScrollBar:vertical {
-                background: #1e1e1e;
-                width: 10px;
-                margin: 0px;
-            }
-            QScrollBar::handle:vertical {
-                background: #454545;
-                min-height: 20px;
-                border-radius: 5px;
-            }
-            QScrollBar::add-line:vertical, 
-            QScrollBar::sub-line:vertical {
-                height: 0px;
-                background: none;
-            }
-            QScrollBar:horizontal {
-                background: #1e1e1e;
-                height: 10px;
-                margin: 0px;
-            }
-            QScrollBar::handle:horizontal {
-                background: #454545;
-                min-width: 20px;
-                border-radius: 5px;
-            }
-            QScrollBar::add-line:horizontal, 
-            QScrollBar::sub-line:horizontal {
-                width: 0px;
-                background: none;
-            }
-        """)
-        self.markdownInput.textChanged.connect(self.updatePreview)
-        self.highlighter = MarkdownHighlighter(self.markdownInput.document())
-        self.splitter.addWidget(self.markdownInput)
-
-    def setupPreviewArea(self):
-        self.previewArea = QScrollArea()
-        self.previewArea.setStyleSheet("""
-            QScrollArea {
-                background-color: #1e1e1e;
+        # 预览渲染放到工作线程，输入先防抖；所有标签共用这一个渲染线程和一个渲染器
+        self.renderPool = QThreadPool(self)
+        self.renderPool.setMaxThreadCount(1)
+        self.highlightFinished.connect(self.onHighlightFinished)
+        self.styleSheetReady.connect(self.applyStyleSheet)
+
+        # 每个标签页是一对编辑器+预览，只开一个文档时标签栏藏起来，和原来一样
+        self.tabs = QTabWidget()
+        self.tabs.setDocumentMode(True)
+        self.tabs.setTabsClosable(True)
+        self.tabs.setMovable(True)
+        self.tabs.setTabBarAutoHide(True)
+        self.tabs.setStyleSheet("""
+            QTabBar::tab {
+                background-color: #2d2d2d;
+                color: #aaaaaa;
+                padding: 5px 12px;
                 border: none;
             }
-            QScrollBar:vertical {
-                background: #252526;
-                width: 10px;
-            }
-            QScrollBar::handle:vertical {
-                background: #454545;
-                min-height: 20px;
-            }
-        """)
-
-        self.previewLabel = QLabel()
-        self.previewLabel.setWordWrap(True)
-        self.previewLabel.setAlignment(Qt.AlignTop)
-        self.previewLabel.setTextInteractionFlags(Qt.TextSelectableByMouse)
-        self.previewLabel.setStyleSheet("""
-            QLabel {
-                font-family: "Microsoft YaHei", sans-serif;
-                font-size: 14px;
-                line-height: 1.6;
-                padding: 15px;
-                color: #ffffff;
+            QTabBar::tab:selected {
                 background-color: #1e1e1e;
+                color: white;
             }
         """)
-
-        self.previewArea.setWidget(self.previewLabel)
-        self.previewArea.setWidgetResizable(True)
-        self.splitter.addWidget(self.previewArea)
+        self.tabs.currentChanged.connect(self.onTabChanged)
+        self.tabs.tabCloseRequested.connect(self.closeTab)
+
+        # 大纲面板在左边，默认收起；只有显示着的时候才跟着渲染结果更新
+        self.outlinePanel = OutlinePanel()
+        self.outlinePanel.setFixedWidth(240)
+        self.outlinePanel.setVisible(False)
+        self.outlinePanel.headingActivated.connect(self.goToHeading)
+        mainLayout.addWidget(self.outlinePanel)
+
+        # 查找/替换栏在标签页下面，Ctrl+F打开，跟着当前标签的编辑器走
+        self.findBar = FindBar()
+        self.findBar.setVisible(False)
+        editorLayout = QVBoxLayout()
+        editorLayout.setContentsMargins(0, 0, 0, 0)
+        editorLayout.setSpacing(0)
+        editorLayout.addWidget(self.tabs)
+        editorLayout.addWidget(self.findBar)
+        mainLayout.addLayout(editorLayout)
 
     def setupMenu(self):
         menubar = self.menuBar()
@@ -176,6 +170,12 @@ class MarkdownPreviewer(QMainWindow):
         # 文件菜单
         fileMenu = menubar.addMenu("文件")
 
+        newAction = QAction("新建标签页", self)
+        newAction.setIcon(QIcon.fromTheme("document-new"))
+        newAction.setShortcut(QKeySequence("Ctrl+N"))
+        newAction.triggered.connect(self.newDocument)
+        fileMenu.addAction(newAction)
+
         openAction = QAction("打开文件", self)
         openAction.setIcon(QIcon.fromTheme("document-open"))
         openAction.setShortcut(QKeySequence("Ctrl+O"))
@@ -194,12 +194,30 @@ class MarkdownPreviewer(QMainWindow):
         exportAction.triggered.connect(self.exportFile)
         fileMenu.addAction(exportAction)
 
+        pdfAction = QAction("导出PDF", self)
+        pdfAction.setIcon(QIcon.fromTheme("x-office-document"))
+        pdfAction.setShortcut(QKeySequence("Ctrl+E"))
+        pdfAction.triggered.connect(self.exportPdf)
+        fileMenu.addAction(pdfAction)
+
         printAction = QAction("打印", self)
         printAction.setIcon(QIcon.fromTheme("document-print"))
         printAction.setShortcut(QKeySequence("Ctrl+P"))
         printAction.triggered.connect(self.printPreviewContent)
         fileMenu.addAction(printAction)
 
+        watchAction = QAction("监视外部修改", self)
+        watchAction.setCheckable(True)
+        watchAction.setChecked(self.watchFiles)
+        watchAction.toggled.connect(self.setWatchFiles)
+        fileMenu.addAction(watchAction)
+
+        closeTabAction = QAction("关闭标签页", self)
+        closeTabAction.setIcon(QIcon.fromTheme("window-close"))
+        closeTabAction.setShortcut(QKeySequence("Ctrl+W"))
+        closeTabAction.triggered.connect(lambda: self.closeTab(self.tabs.currentIndex()))
+        fileMenu.addAction(closeTabAction)
+
         exitAction = QAction("退出", self)
         exitAction.setIcon(QIcon.fromTheme("application-exit"))
         exitAction.setShortcut(QKeySequence("Ctrl+Q"))
@@ -211,39 +229,88 @@ class MarkdownPreviewer(QMainWindow):
         undoAction = QAction("撤销", self)
         undoAction.setIcon(QIcon.fromTheme("edit-undo"))
         undoAction.setShortcut(QKeySequence("Ctrl+Z"))
-        undoAction.triggered.connect(self.markdownInput.undo)
+        undoAction.triggered.connect(lambda: self.currentEditor().undo())
         editMenu.addAction(undoAction)
 
         redoAction = QAction("重做", self)
         redoAction.setIcon(QIcon.fromTheme("edit-redo"))
         redoAction.setShortcut(QKeySequence("Ctrl+Y"))
-        redoAction.triggered.connect(self.markdownInput.redo)
+        redoAction.triggered.connect(lambda: self.currentEditor().redo())
         editMenu.addAction(redoAction)
 
         cutAction = QAction("剪切", self)
         cutAction.setIcon(QIcon.fromTheme("edit-cut"))
         cutAction.setShortcut(QKeySequence("Ctrl+X"))
-        cutAction.triggered.connect(self.markdownInput.cut)
+        cutAction.triggered.connect(lambda: self.currentEditor().cut())
         editMenu.addAction(cutAction)
 
         copyAction = QAction("复制", self)
         copyAction.setIcon(QIcon.fromTheme("edit-copy"))
         copyAction.setShortcut(QKeySequence("Ctrl+C"))
-        copyAction.triggered.connect(self.markdownInput.copy)
+        copyAction.triggered.connect(lambda: self.currentEditor().copy())
         editMenu.addAction(copyAction)
 
         pasteAction = QAction("粘贴", self)
         pasteAction.setIcon(QIcon.fromTheme("edit-paste"))
         pasteAction.setShortcut(QKeySequence("Ctrl+V"))
-        pasteAction.triggered.connect(self.markdownInput.paste)
+        pasteAction.triggered.connect(lambda: self.currentEditor().paste())
         editMenu.addAction(pasteAction)
 
         selectAllAction = QAction("全选", self)
         selectAllAction.setIcon(QIcon.fromTheme("edit-select-all"))
         selectAllAction.setShortcut(QKeySequence("Ctrl+A"))
-        selectAllAction.triggered.connect(self.markdownInput.selectAll)
+        selectAllAction.triggered.connect(lambda: self.currentEditor().selectAll())
         editMenu.addAction(selectAllAction)
 
+        findAction = QAction("查找/替换", self)
+        findAction.setIcon(QIcon.fromTheme("edit-find"))
+        findAction.setShortcut(QKeySequence("Ctrl+F"))
+        findAction.triggered.connect(self.findBar.showBar)
+        editMenu.addAction(findAction)
+
+        findNextAction = QAction("查找下一个", self)
+        findNextAction.setShortcut(QKeySequence("F3"))
+        findNextAction.triggered.connect(self.findBar.findNext)
+        editMenu.addAction(findNextAction)
+
+        findPreviousAction = QAction("查找上一个", self)
+        findPreviousAction.setShortcut(QKeySequence("Shift+F3"))
+        findPreviousAction.triggered.connect(self.findBar.findPrevious)
+        editMenu.addAction(findPreviousAction)
+
+        scrollSyncAction = QAction("同步滚动", self)
+        scrollSyncAction.setCheckable(True)
+        scrollSyncAction.setChecked(self.scrollSyncEnabled)
+        scrollSyncAction.toggled.connect(self.setScrollSync)
+        editMenu.addAction(scrollSyncAction)
+
+        thumbnailCacheAction = QAction("缩略图磁盘缓存", self)
+        thumbnailCacheAction.setCheckable(True)
+        thumbnailCacheAction.setChecked(self.thumbnailDiskCache)
+        thumbnailCacheAction.toggled.connect(self.setThumbnailDiskCache)
+        editMenu.addAction(thumbnailCacheAction)
+
+        budgetMenu = editMenu.addMenu("渲染预算")
+        budgetGroup = QActionGroup(self)
+        for budgetMs in self.renderBudgetChoices:
+            budgetAction = QAction(f"{budgetMs} ms" if budgetMs else "不降级", self)
+            budgetAction.setCheckable(True)
+            budgetAction.setChecked(budgetMs == self.renderBudgetMs)
+            budgetAction.triggered.connect(lambda _checked, ms=budgetMs: self.setRenderBudget(ms))
+            budgetGroup.addAction(budgetAction)
+            budgetMenu.addAction(budgetAction)
+
+        self.outlineAction = QAction("大纲", self)
+        self.outlineAction.setCheckable(True)
+        self.outlineAction.setShortcut(QKeySequence("Ctrl+Shift+O"))
+        self.outlineAction.toggled.connect(self.setOutlineVisible)
+        editMenu.addAction(self.outlineAction)
+
+        goToSectionAction = QAction("转到章节", self)
+        goToSectionAction.setShortcut(QKeySequence("Ctrl+G"))
+        goToSectionAction.triggered.connect(self.showGoToSection)
+        editMenu.addAction(goToSectionAction)
+
         # 帮助菜单
         helpMenu = menubar.addMenu("帮助")
 
@@ -259,68 +326,323 @@ class MarkdownPreviewer(QMainWindow):
         aboutAction.triggered.connect(self.showAbout)
         helpMenu.addAction(aboutAction)
 
-    def setupAutoSave(self):  # 自动保存
+        # 调试菜单
+        debugMenu = menubar.addMenu("调试")
+
+        self.traceAction = QAction("性能追踪", self)
+        self.traceAction.setCheckable(True)
+        self.traceAction.setChecked(tracer.enabled)
+        self.traceAction.toggled.connect(self.setTracing)
+        debugMenu.addAction(self.traceAction)
+
+        exportTraceAction = QAction("导出追踪文件", self)
+        exportTraceAction.triggered.connect(self.exportTrace)
+        debugMenu.addAction(exportTraceAction)
+
+    def setupStatusBar(self):  # 状态栏只在打开性能追踪时显示渲染耗时，预览降级了也显示出来
+        statusBar = self.statusBar()
+        statusBar.setStyleSheet("QStatusBar { background-color: #252526; color: #aaaaaa; }")
+        self.qualityLabel = QLabel()
+        self.qualityLabel.setStyleSheet("color: #d7ba7d;")
+        statusBar.addPermanentWidget(self.qualityLabel)
+        self.qualityLabel.setVisible(False)
+        self.perfLabel = QLabel()
+        statusBar.addPermanentWidget(self.perfLabel)
+
+        self.perfTimer = QTimer(self)
+        self.perfTimer.setInterval(500)
+        self.perfTimer.timeout.connect(self.updatePerfLabel)
+        self.setTracing(tracer.enabled)
+
+    def setTracing(self, enabled):
+        tracer.setEnabled(enabled)
+        self.perfLabel.setVisible(enabled)
+        self.updateStatusBarVisible()
+        if enabled:
+            self.perfTimer.start()
+        else:
+            self.perfTimer.stop()
+
+    def updateStatusBarVisible(self):
+        self.statusBar().setVisible(tracer.enabled or not self.qualityLabel.isHidden())
+
+    def setRenderBudget(self, budgetMs):
+        self.renderBudgetMs = budgetMs
+        for tab in self.documentTabs():
+            tab.setRenderBudget(budgetMs)
+
+    def updateQualityLabel(self):  # 当前标签的预览降级了就在状态栏上标出来
+        tab = self.currentTab()
+        budget = tab.renderBudget if tab is not None else None
+        degraded = budget is not None and budget.level != LEVEL_FULL
+        if degraded:
+            self.qualityLabel.setText(f"预览已降级：{budget.levelName()}")
+            self.qualityLabel.setToolTip(
+                f"渲染超过了 {budget.budgetMs} ms 的预算，暂时降低预览质量；渲染变快后会自动恢复。导出和打印不受影响。"
+            )
+        self.qualityLabel.setVisible(degraded)
+        self.updateStatusBarVisible()
+
+    def onQualityChanged(self, tab):
+        if tab is self.currentTab():
+            self.updateQualityLabel()
+
+    def setScrollSync(self, enabled):
+        self.scrollSyncEnabled = enabled
+        for tab in self.documentTabs():
+            tab.scrollSync.enabled = enabled
+        if enabled and self.currentTab() is not None:
+            self.currentTab().scrollSync.syncPreview()
+
+    def setOutlineVisible(self, visible):
+        self.outlinePanel.setVisible(visible)
+        if visible:
+            self.refreshOutline()
+
+    def showGoToSection(self):
+        self.outlineAction.setChecked(True)
+        self.outlinePanel.focusSearch()
+
+    def refreshOutline(self):
+        tab = self.currentTab()
+        if tab is None or not self.outlinePanel.isVisible():
+            return
+        self.outlinePanel.setHeadings(tab.headings)
+        self.outlinePanel.setCurrentLine(tab.markdownInput.textCursor().blockNumber())
+
+    def onOutlineChanged(self, tab):
+        if tab is self.currentTab():
+            self.refreshOutline()
+
+    def onCursorMoved(self, tab):
+        if tab is self.currentTab() and self.outlinePanel.isVisible():
+            self.outlinePanel.setCurrentLine(tab.markdownInput.textCursor().blockNumber())
+
+    def goToHeading(self, line):
+        tab = self.currentTab()
+        if tab is not None:
+            tab.goToLine(line)
+
+    def updatePerfLabel(self):
+        parts = []
+        for name, label in (("preview.render", "渲染"), ("preview.patch", "刷新预览"), ("preview.latency", "延迟")):
+            recent = tracer.recent(name)
+            if recent:
+                parts.append(f"{label} {recent[0] * 1000:.1f} ms（平均 {recent[1] * 1000:.1f}）")
+        self.perfLabel.setText("  |  ".join(parts) or "等待渲染…")
+
+    def exportTrace(self):
+        filePath, _ = QFileDialog.getSaveFileName(
+            self, "导出追踪文件", "mplus-trace.json", "Chrome Trace (*.json);;所有文件 (*)"
+        )
+        if filePath:
+            tracer.dump(filePath)
+
+    def setupAutoSave(self):  # 自动保存，所有标签共用一个写盘线程
+        self.autoSaver = AutoSaver(self)
+        self.autoSaver.saved.connect(self.onAutoSaved)
+        self.autoSaver.failed.connect(self.onAutoSaveFailed)
+
         self.autoSaveTimer = QTimer(self)
         self.autoSaveTimer.setInterval(30000)
         self.autoSaveTimer.timeout.connect(self.autoSave)
         self.autoSaveTimer.start()
 
-    def updatePreview(self):
-        markdownText = self.markdownInput.toPlainText()
-        renderer = MarkdownRenderer()
-        html = renderer.renderMarkdown(markdownText)
-
-        css = """
-        <style>
-            body { font-family: "Microsoft YaHei", sans-serif; color: white; background-color: #1e1e1e; }
-            pre, code { font-family: Consolas, "Microsoft YaHei", monospace; background-color: #252525; }
-            pre { padding: 10px; border-radius: 3px; }
-            h1, h2, h3, h4, h5, h6 { font-family: "Microsoft YaHei", sans-serif; }
-            table { border-collapse: collapse; width: 100%; margin: 15px 0; border: 1px solid #454545; }
-            th, td { border: 1px solid #454545; padding: 8px 12px; text-align: left; }
-            th { background-color: #333337; font-weight: bold; }
-            tr:nth-child(even) { background-color: #252525; }
-            tr:hover { background-color: #2a2a2a; }
-            .codehilite { position: relative; margin: 1em 0; border-radius: 4px; overflow: hidden; }
-            .codehilite pre { margin: 0; padding: 1em; overflow-x: auto; }
-            blockquote { margin: 10px 0; padding: 12px 15px; background-color: rgba(50, 50, 50, 0.3); border-left: 4px solid #6a9955; }
-            blockquote.level-2, blockquote blockquote { margin-left: 20px; background-color: rgba(60, 60, 60, 0.3); border-left-color: #8a7578; }
-            blockquote.level-3, blockquote blockquote blockquote { margin-left: 40px; background-color: rgba(70, 70, 70, 0.3); border-left-color: #7a6568; }
-            blockquote.level-4 { margin-left: 60px; background-color: rgba(80, 80, 80, 0.3); border-left-color: #6a5558; }
-            blockquote.level-5 {
-            margin-left: 80px;
-            background-color: rgba(90, 90, 90, 0.3);
-            border-left-color: #5a4548;
-            }
-            blockquote.level-6 {
-            margin-left: 100px;
-            background-color: rgba(90, 90, 90, 0.3);
-            border-left-color: #4a4548;
-            }
-            blockquote.level-7 {
-            margin-left: 120px;
-            background-color: rgba(90, 90, 90, 0.3);
-            border-left-color: #3a4548;
-            }        
-            blockquote.level-8 {
-            margin-left: 140px;
-            background-color: rgba(90, 90, 90, 0.3);
-            border-left-color: #2a4548;
-            }        
-            blockquote.level-9 {
-            margin-left: 160px;
-            background-color: rgba(90, 90, 90, 0.3);
-            border-left-color: #1a4548;
-            }                 
-            blockquote.level-10 {
-            margin-left: 180px;
-            background-color: rgba(90, 90, 90, 0.3);
-            border-left-color: #0a4548;
-            }                        
-        </style>
-        """
+    def setupFileWatcher(self):  # 外部修改按行比出来只换改了的地方，所有标签共用一个监视器
+        self.fileWatcher = FileWatcher(self.autoSaver, self)
+        self.fileWatcher.setEnabled(self.watchFiles)
+        self.fileWatcher.fileChanged.connect(self.onFileChanged)
+        self.fileWatcher.reloadReady.connect(self.onReloadReady)
+
+    def setWatchFiles(self, enabled):
+        self.watchFiles = enabled
+        self.fileWatcher.setEnabled(enabled)
+
+    def setThumbnailDiskCache(self, enabled):  # 关掉只是不再读写，已经存下的缩略图留着
+        self.thumbnailDiskCache = enabled
+        self.imageLoader.setDiskDir(THUMBNAIL_DIR if enabled else None)
+
+    def onFileChanged(self, path):
+        for tab in self.documentTabs():
+            if tab.currentFile and os.path.abspath(tab.currentFile) == path:
+                tab.reloadFromDisk()
+
+    def onReloadReady(self, path, token, text, encoding, edits):
+        tab, revision = token
+        if tab in self.documentTabs():  # 比的途中标签被关了
+            tab.applyReload(path, revision, text, encoding, edits)
+
+    def setupExporter(self):  # PDF导出和打印都在后台线程里排版、分页
+        self.exporter = DocumentExporter(self)
+        self.exporter.progress.connect(self.onExportProgress)
+        self.exporter.finished.connect(self.onExportFinished)
+        self.exporter.failed.connect(self.onExportFailed)
+        self.exporter.cancelled.connect(self.closeExportProgress)
+        self.exportProgress = None
+        self.activePrinter = None  # 打印途中QPrinter得一直活着
+
+    def documentTabs(self):
+        return [self.tabs.widget(i) for i in range(self.tabs.count())]
+
+    def currentTab(self):
+        return self.tabs.currentWidget()
+
+    def currentEditor(self):
+        return self.currentTab().markdownInput
+
+    def newTab(self):
+        # 未命名的标签各占一个编号，恢复日志不会互相覆盖
+        usedSlots = {tab.untitledSlot for tab in self.documentTabs() if not tab.currentFile}
+        slot = 0
+        while slot in usedSlots:
+            slot += 1
+        tab = DocumentTab(
+            self.renderPool, self.autoSaver,
+            openCallback=self.openPath,
+            untitledSlot=slot,
+            debounceMs=self.previewDebounceMs,
+            css=self.previewCss,
+            imageLoader=self.imageLoader,
+            renderBudgetMs=self.renderBudgetMs,
+            fileWatcher=self.fileWatcher
+        )
+        tab.scrollSync.enabled = self.scrollSyncEnabled
+        tab.stateChanged.connect(lambda t=tab: self.updateTabTitle(t))
+        tab.outlineChanged.connect(lambda t=tab: self.onOutlineChanged(t))
+        tab.qualityChanged.connect(lambda t=tab: self.onQualityChanged(t))
+        tab.markdownInput.cursorPositionChanged.connect(lambda t=tab: self.onCursorMoved(t))
+        tab.previewApplied.connect(self.onPreviewApplied)
+        tab.setSizes([self.width() // 2, self.width() // 2])
+        self.tabs.addTab(tab, tab.displayName())
+        self.tabs.setCurrentWidget(tab)
+        return tab
+
+    def newDocument(self):
+        self.newTab().startJournal()
+
+    def closeTab(self, index):  # 没保存的修改留在恢复日志里，和直接关窗口一样
+        tab = self.tabs.widget(index)
+        if tab is None:
+            return
+        tab.shutdown()
+        if tab is self.activeTab:
+            self.activeTab = None
+        self.tabs.removeTab(index)
+        tab.deleteLater()
+        if not self.tabs.count():
+            self.newDocument()
+
+    def onTabChanged(self, _index):
+        tab = self.currentTab()
+        if tab is None:
+            return
+        self.updateWindowTitle()
+        self.refreshOutline()
+        self.updateQualityLabel()
+        self.findBar.setEditor(tab.markdownInput)
+        if self.previewStarted:
+            self.activateTab(tab)
+
+    def activateTab(self, tab):  # 切到前台：预览控件还在就不用动，被清掉的从块缓存重建
+        if self.activeTab is not None and self.activeTab is not tab:
+            self.activeTab.setActive(False)
+        self.activeTab = tab
+        self.activationCount += 1
+        tab.setActive(True, self.activationCount)
+        self.enforceCacheBudget()
+
+    def updateTabTitle(self, tab):
+        index = self.tabs.indexOf(tab)
+        if index < 0:
+            return
+        self.tabs.setTabText(index, tab.displayName())
+        self.tabs.setTabToolTip(index, tab.currentFile or "")
+        if tab is self.currentTab():
+            self.updateWindowTitle()
 
-        self.previewLabel.setText(css + html)
+    def enforceCacheBudget(self):
+        # 先清后台标签的预览文档（回来时拿块缓存重建，不用重新解析），还不够再清块缓存和它独占的高亮结果
+        tabs = self.documentTabs()
+        total = sum(tab.memoryBytes() for tab in tabs)
+        if self.highlightCache is not None:
+            total += self.highlightCache.stats()['bytes']
+        if total <= self.cacheBudgetBytes:
+            return
+        inactive = sorted((tab for tab in tabs if not tab.active), key=lambda tab: tab.lastActive)
+        for tab in inactive:
+            total -= tab.evictPreview()
+            if total <= self.cacheBudgetBytes:
+                return
+        for tab in inactive:
+            total -= tab.evictCache([other for other in tabs if other is not tab and not other.cacheEvicted])
+            if total <= self.cacheBudgetBytes:
+                return
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if not self.previewStarted:
+            # 先让窗口画出来，下一轮事件循环再让渲染线程去加载渲染器、出第一次预览
+            QTimer.singleShot(0, self.startPreview)
+
+    def startPreview(self):
+        if self.previewStarted:
+            return
+        self.previewStarted = True
+        startupProfile.mark("window.firstPaint")
+        # 渲染线程就一个，按顺序：建渲染器 -> 第一次渲染 -> 预热（不挡第一次预览）
+        self.renderPool.start(self.setupRenderer)
+        self.activateTab(self.currentTab())
+        self.renderPool.start(self.warmUpRenderer)
+
+    def setupRenderer(self):  # 跑在渲染线程里
+        with startupProfile.phase("renderer.import"):
+            from functions.Renderer import MarkdownRenderer
+        with startupProfile.phase("renderer.init"):
+            renderer = MarkdownRenderer.shared()
+        renderer.highlightReadyCallbacks.append(self.highlightFinished.emit)
+        self.highlightCache = renderer.highlightCache
+        with startupProfile.phase("renderer.styleSheet"):
+            css = renderer.styleSheet()
+        self.styleSheetReady.emit(css)  # 排在第一次渲染结果前面，预览先换好样式表再收内容
+
+    @staticmethod
+    def warmUpRenderer():  # 跑在渲染线程里
+        from functions.Renderer import MarkdownRenderer
+        with startupProfile.phase("renderer.warmUp"):
+            MarkdownRenderer.shared().warmUp()
+
+    def applyStyleSheet(self, css):  # 整个主题就这一份样式表，每个预览文档设一次
+        self.previewCss = css
+        for tab in self.documentTabs():
+            tab.previewBrowser.setPreviewStyleSheet(css)
+
+    def onHighlightFinished(self):
+        for tab in self.documentTabs():
+            tab.highlightFinished()
+
+    def onPreviewApplied(self):
+        if not self.firstPreviewShown:
+            self.firstPreviewShown = True
+            startupProfile.mark("preview.first")
+            if startupProfile.enabled:
+                QTimer.singleShot(0, self.finishStartupProfile)
+        self.enforceCacheBudget()
+
+    def finishStartupProfile(self):  # --profile-startup：第一次预览出来就输出报告并退出
+        totalMs = startupProfile.elapsedMs()
+        startupProfile.writeReport(totalMs)
+        self.close()
+        QApplication.exit(1 if startupProfile.overBudget(totalMs) else 0)
+
+    def closeEvent(self, event):
+        for tab in self.documentTabs():
+            tab.shutdown()
+        self.autoSaver.shutdown()
+        self.fileWatcher.shutdown()
+        self.exporter.shutdown()
+        self.findBar.searcher.shutdown()
+        self.imageLoader.shutdown()
+        super().closeEvent(event)
 
     def openFile(self):  # 打开文件
         filePath, _ = QFileDialog.getOpenFileName(
@@ -328,44 +650,25 @@ class MarkdownPreviewer(QMainWindow):
             "Markdown文件 (*.md *.markdown *.txt);;所有文件 (*)"
         )
         if filePath:
-            self.loadFile(filePath)
-
-    def loadFile(self, filePath):  # 加载文件，顺带和光标爆了
-        file = QFile(filePath)
-        if file.open(QFile.ReadOnly | QFile.Text):
-            stream = QTextStream(file)
-            content = stream.readAll()
-            file.close()
-
-            # 1. 保存当前分割器状态
-            splitter_sizes = self.splitter.sizes()
-
-            # 2. 移除旧的 QTextEdit
-            old_editor = self.markdownInput
-            old_editor.setParent(None)  # 从布局中移除
-            old_editor.deleteLater()  # 安全销毁
-
-            # 3. 创建新的 QTextEdit 并插入到 splitter 的左侧
-            self.markdownInput = DragDropTextEdit(load_callback=self.loadFile)
-            self.setupMarkdownInput()  # 重新应用样式和设置
-            self.splitter.insertWidget(0, self.markdownInput)  # 确保在左侧
-
-            # 4. 恢复内容
-            self.markdownInput.setPlainText(content)
-            self.currentFile = filePath
-            self.updateWindowTitle()
-
-            # 5. 恢复分割器比例
-            self.splitter.setSizes(splitter_sizes)
-
-            # 6. 强制聚焦并显示光标
-            self.markdownInput.setFocus()
-            cursor = self.markdownInput.textCursor()
-            self.markdownInput.setTextCursor(cursor)
+            self.openPath(filePath)
+
+    def openPath(self, filePath):  # 已经开着就切过去；当前是没动过的空标签就直接用，不然开新标签
+        filePath = os.path.abspath(filePath)
+        for tab in self.documentTabs():
+            if tab.currentFile and os.path.abspath(tab.currentFile) == filePath:
+                self.tabs.setCurrentWidget(tab)
+                return
+        tab = self.currentTab()
+        created = tab is None or not tab.isBlank()
+        if created:
+            tab = self.newTab()
+        if not tab.loadFile(filePath) and created:
+            self.closeTab(self.tabs.indexOf(tab))
 
     def saveFile(self):  # 保存文件
-        if self.currentFile:
-            self.saveToFile(self.currentFile)
+        tab = self.currentTab()
+        if tab.currentFile:
+            tab.saveToFile(tab.currentFile)
         else:
             self.exportFile()
 
@@ -375,25 +678,24 @@ class MarkdownPreviewer(QMainWindow):
             "Markdown文件 (*.md *.markdown);;文本文件 (*.txt);;所有文件 (*)"
         )
         if filePath:
-            self.saveToFile(filePath)
-            self.currentFile = filePath
-            self.updateWindowTitle()
+            self.currentTab().saveToFile(filePath)
 
-    def saveToFile(self, filePath):  # 保存到文件
-        file = QFile(filePath)
-        if file.open(QFile.WriteOnly | QFile.Text):
-            stream = QTextStream(file)
-            stream << self.markdownInput.toPlainText()
-            file.close()
-            self.currentFile = filePath
-            self.updateWindowTitle()
+    def autoSave(self):  # GUI线程只拷快照，写盘在工作线程
+        for tab in self.documentTabs():
+            tab.autoSave()
+
+    def onAutoSaved(self, path, token, encoding):
+        tab, segment, editCount = token
+        if tab in self.documentTabs():  # 保存途中标签被关了
+            tab.onAutoSaved(path, segment, editCount, encoding)
 
-    def autoSave(self):
-        if self.currentFile and self.markdownInput.document().isModified():
-            self.saveToFile(self.currentFile)
+    @staticmethod
+    def onAutoSaveFailed(path, _token, message):  # 日志没删，崩了照样能恢复
+        print(f'自动保存失败 {path}: {message}', file=sys.stderr)
 
     @staticmethod
     def getPrinter(): # 打印预览报废了，因为脑萎缩半天不知道怎么搞了
+        from PySide6.QtPrintSupport import QPrinter
         printer = QPrinter()
         # 获取默认打印机名称
         default_printer = printer.printerName()
@@ -403,6 +705,7 @@ class MarkdownPreviewer(QMainWindow):
         return default_printer, printer_names
 
     def printPreviewContent(self):
+        from PySide6.QtPrintSupport import QPrinter, QPrintDialog  # 打印栈很重，点打印时才加载
         printer = QPrinter(QPrinter.HighResolution)
         dialog = QPrintDialog(printer, self)
         dialog.setWindowTitle("打印 Markdown 内容")
@@ -415,17 +718,86 @@ class MarkdownPreviewer(QMainWindow):
         if dialog.exec() == QPrintDialog.Accepted:
             self._printHTML(printer)
 
-    def _printHTML(self, printer):
-        html = self.previewLabel.text()
-        doc = QTextDocument()
-        doc.setHtml(html)
-        doc.print_(printer)
+    def _printHTML(self, printer):  # 排版、分页都丢给导出线程，界面不卡
+        if self.exportProgress is not None:
+            return
+        tab = self.currentTab()
+        html = tab.exportHtml()
+        self.activePrinter = printer
+        self.exporter.printDocument(
+            printer, self.previewCss, html=html, markdownText=tab.markdownInput.toPlainText() if html is None else '',
+            baseDir=tab.baseDir()
+        )
+        self.showExportProgress("正在打印…")
+
+    def exportPdf(self):
+        if self.exportProgress is not None:  # 一次只导一个
+            return
+        tab = self.currentTab()
+        baseName = os.path.splitext(tab.displayName())[0] if tab.currentFile else "untitled"
+        filePath, _ = QFileDialog.getSaveFileName(
+            self, "导出PDF", os.path.join(os.path.dirname(tab.currentFile or ""), baseName + ".pdf"),
+            "PDF文件 (*.pdf);;所有文件 (*)"
+        )
+        if not filePath:
+            return
+        html = tab.exportHtml()
+        self.exporter.exportPdf(
+            filePath, self.previewCss, html=html,
+            markdownText=tab.markdownInput.toPlainText() if html is None else '',
+            title=tab.displayName(), baseDir=tab.baseDir()
+        )
+        self.showExportProgress("正在导出PDF…")
+
+    def showExportProgress(self, label):
+        dialog = QProgressDialog(label, "取消", 0, 0, self)  # 排版阶段不知道有几页，先显示忙碌
+        dialog.setWindowTitle("MPlus")
+        dialog.setWindowModality(Qt.WindowModal)
+        dialog.setMinimumDuration(400)  # 小文档一眨眼就完了，不闪对话框
+        dialog.setAutoClose(False)
+        dialog.setAutoReset(False)
+        dialog.canceled.connect(self.exporter.cancel)
+        self.exportProgress = dialog
+
+    def onExportProgress(self, done, total):
+        dialog = self.exportProgress
+        if dialog is not None:
+            dialog.setLabelText(f"第 {done}/{total} 页")
+            dialog.setMaximum(total)
+            dialog.setValue(done)  # 模态的进度框setValue里会转事件循环，之后self.exportProgress可能已经关掉了
+
+    def closeExportProgress(self):
+        if self.exportProgress is not None:
+            self.exportProgress.canceled.disconnect(self.exporter.cancel)
+            self.exportProgress.close()
+            self.exportProgress.deleteLater()
+            self.exportProgress = None
+        self.activePrinter = None
+
+    def onExportFinished(self, _target, _pageCount):
+        self.closeExportProgress()
+
+    def onExportFailed(self, message):
+        self.closeExportProgress()
+        QMessageBox.warning(self, "导出失败", message)
+
+    def openFromAnotherInstance(self, filePath=None):  # 单实例模式：别的启动把文件交过来了
+        if filePath and os.path.isfile(filePath):
+            self.openPath(filePath)
+        if self.isMinimized():
+            self.showNormal()
+        self.raise_()
+        self.activateWindow()
 
     def updateWindowTitle(self):  # 按所求更改标题为文件路径，测试
-        if self.currentFile:
-            baseName = os.path.basename(self.currentFile)
-            dirPath = os.path.dirname(self.currentFile)
-            self.setWindowTitle(f"MPlus | {dirPath}/{baseName}")
+        tab = self.currentTab()
+        if tab is not None and tab.currentFile:
+            baseName = os.path.basename(tab.currentFile)
+            dirPath = os.path.dirname(tab.currentFile)
+            title = f"MPlus | {dirPath}/{baseName}"
+            if tab.fileReader is not None:
+                title += f"（载入中 {tab.fileReader.progress():.0%}）"
+            self.setWindowTitle(title)
         else:
             self.setWindowTitle("MPlus")
 
@@ -525,8 +897,37 @@ class MarkdownPreviewer(QMainWindow):
 
 
 if __name__ == "__main__":
+    # 启动耗时：--profile-startup 打印各阶段耗时，第一次预览出来就退出；--startup-budget=毫秒 超了返回1
+    # 打包版没有控制台，用--profile-startup=路径 把报告写进文件
+    for arg in sys.argv[1:]:
+        if arg == "--profile-startup":
+            startupProfile.enabled = True
+        elif arg.startswith("--profile-startup="):
+            startupProfile.enabled = True
+            startupProfile.reportPath = arg.split("=", 1)[1]
+        elif arg.startswith("--startup-budget="):
+            startupProfile.budgetMs = float(arg.split("=", 1)[1])
+    singleInstance = "--single-instance" in sys.argv
+    sys.argv = [
+        arg for arg in sys.argv
+        if arg not in ("--profile-startup", "--single-instance")
+        and not arg.startswith(("--profile-startup=", "--startup-budget="))
+    ]
 
-    app = QApplication(sys.argv)
+    file_path = None
+    if len(sys.argv) > 1:
+        potential_file = sys.argv[1]
+        if os.path.isfile(potential_file):
+            file_path = os.path.abspath(potential_file)  # 窗口初始化会chdir，相对路径得先转掉
+
+    # 单实例：已经有MPlus在跑就把文件交给它，自己直接退出，不建QApplication也不建窗口
+    if singleInstance or enabledFromEnvironment():
+        singleInstance = True
+        if sendToRunningInstance([file_path] if file_path else []):
+            sys.exit(0)
+
+    with startupProfile.phase("app.create"):
+        app = QApplication(sys.argv)
 
     # 暗色主题
     darkPalette = QPalette()
@@ -538,13 +939,14 @@ if __name__ == "__main__":
     darkPalette.setColor(QPalette.ButtonText, Qt.white)
     QApplication.setPalette(darkPalette)
 
+    with startupProfile.phase("window.create"):
+        window = MarkdownPreviewer(file_path)
+    with startupProfile.phase("window.show"):
+        window.show()
 
-    file_path = None
-    if len(sys.argv) > 1:
-        potential_file = sys.argv[1]
-        if os.path.isfile(potential_file):
-            file_path = potential_file
-
-    window = MarkdownPreviewer(file_path)
-    window.show()
+    if singleInstance:
+        instanceServer = InstanceServer(app)
+        instanceServer.fileRequested.connect(window.openFromAnotherInstance)
+        instanceServer.activateRequested.connect(window.openFromAnotherInstance)
+        instanceServer.listen()
     sys.exit(app.exec())
@@ -0,0 +1,115 @@
+# 基准测试用的生成语料，固定随机种子，每次生成的内容都一样
+
+import random
+
+WORDS = (
+    "markdown preview render block quote table code list link image fence "
+    "编辑 预览 渲染 引用 表格 代码 列表 链接 性能 测试 文档 标题"
+).split()
+
+LANGS = ("python", "javascript", "c", "bash", "json", "text", "unknownlang")
+
+CODE_LINES = (
+    "def handler(event, context):",
+    "    result = compute(event['payload'], retries=3)  # TODO",
+    "for (int i = 0; i < n; ++i) { total += values[i]; }",
+    "const data = await fetch(`/api/items/${id}`).then(r => r.json());",
+    "echo \"$HOME\" | grep -E '^/root' && exit 0",
+    "{\"key\": [1, 2, 3], \"nested\": {\"ok\": true}}",
+    "2025-07-05 12:00:01 INFO worker-3 request done in 42ms",
+)
+
+
+def _sentence(rng, words=12):
+    parts = [rng.choice(WORDS) for _ in range(words)]
+    i = rng.randrange(len(parts))
+    parts[i] = rng.choice((f"**{parts[i]}**", f"*{parts[i]}*", f"`{parts[i]}`", f"[{parts[i]}](http://example.com/{i})"))
+    return " ".join(parts)
+
+
+def _paragraph(rng):
+    return "\n".join(_sentence(rng) for _ in range(rng.randint(1, 4))) + "\n"
+
+
+def _heading(rng):
+    return "#" * rng.randint(1, 4) + " " + _sentence(rng, 4) + "\n"
+
+
+def _list(rng):
+    marker = rng.choice(("-", "*", "1."))
+    return "".join(f"{marker} {_sentence(rng, 6)}\n" for _ in range(rng.randint(2, 6)))
+
+
+def _code(rng, lines=None):
+    lines = lines or rng.randint(3, 20)
+    body = "".join(rng.choice(CODE_LINES) + "\n" for _ in range(lines))
+    return f"```{rng.choice(LANGS)}\n{body}```\n"
+
+
+def _quote(rng):
+    out = []
+    for _ in range(rng.randint(2, 8)):
+        level = rng.randint(1, 4)
+        out.append(">" * level + " " + _sentence(rng, 8))
+    return "\n".join(out) + "\n"
+
+
+def _table(rng):
+    cols = rng.randint(3, 6)
+    rows = [" | ".join(rng.choice(WORDS) for _ in range(cols)) for _ in range(rng.randint(3, 15))]
+    header = " | ".join(f"col{i}" for i in range(cols))
+    return "\n".join([f"| {header} |", "|" + "---|" * cols] + [f"| {row} |" for row in rows]) + "\n"
+
+
+def _build(rng, size, makers):
+    chunks = []
+    total = 0
+    while total < size:
+        chunk = rng.choice(makers)(rng)
+        chunks.append(chunk)
+        chunks.append("\n")
+        total += len(chunk) + 1
+    return "".join(chunks)
+
+
+def mixed(size, seed=1):
+    rng = random.Random(seed)
+    return _build(rng, size, (_paragraph, _paragraph, _heading, _list, _code, _quote, _table))
+
+
+def codeHeavy(size, seed=2):
+    rng = random.Random(seed)
+    return _build(rng, size, (_code, _code, _code, lambda r: _code(r, 200), _paragraph))
+
+
+def quoteHeavy(size, seed=3):
+    rng = random.Random(seed)
+    return _build(rng, size, (_quote, _quote, _quote, _paragraph))
+
+
+def tableHeavy(size, seed=4):
+    rng = random.Random(seed)
+    return _build(rng, size, (_table, _table, _table, _paragraph))
+
+
+def unterminatedFences(size, seed=5):
+    # 一堆只开不关的围栏，夹着正文，模拟敲到一半的```
+    rng = random.Random(seed)
+    return _build(rng, size, (lambda r: f"```{r.choice(LANGS)}\n", _paragraph, _paragraph, lambda r: "``\n"))
+
+
+KB = 1024
+MB = 1024 * 1024
+
+CORPORA = {
+    "small": lambda: mixed(16 * KB),
+    "mixed-1mb": lambda: mixed(MB),
+    "mixed-10mb": lambda: mixed(10 * MB),
+    "code-1mb": lambda: codeHeavy(MB),
+    "quote-1mb": lambda: quoteHeavy(MB),
+    "table-1mb": lambda: tableHeavy(MB),
+    "unterminated-fences-1mb": lambda: unterminatedFences(MB),
+}
+
+# 默认不跑10MB，太慢；--all才带上
+DEFAULT_CORPORA = tuple(name for name in CORPORA if name != "mixed-10mb")
@@ -0,0 +1,201 @@
+# 渲染和编辑器高亮热路径的基准测试
+# 用法：
+#   python benchmarks/RenderBench.py                       跑默认语料，结果写到benchmarks/results/latest.json
+#   python benchmarks/RenderBench.py --save-baseline       顺便存成基线
+#   python benchmarks/RenderBench.py --baseline benchmarks/results/baseline.json --threshold 0.25
+#                                                          和基线比，有阶段变慢超过阈值就返回1
+# 编辑器高亮用offscreen平台跑，不弹窗口
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pygments import highlight
+
+from Corpora import CORPORA, DEFAULT_CORPORA
+from functions.Renderer import BlockCache, MarkdownRenderer
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# 比基线慢但绝对差值小于这个的不算退化，毫秒级的抖动没意义
+NOISE_FLOOR_SECONDS = 0.005
+
+
+def best(func, repeat):  # 取最快的一次，最不受机器抖动影响
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def editedCopy(text):  # 在中间插一个字符，模拟一次按键
+    middle = text.find("\n", len(text) // 2) + 1
+    return text[:middle] + "x" + text[middle:]
+
+
+def benchRenderer(text, repeat):
+    renderer = MarkdownRenderer()
+    renderer.deferHighlightChars = None
+    results = {}
+
+    def cold():
+        renderer.highlightCache.clear()
+        renderer.renderMarkdown(text, BlockCache())
+
+    results["renderMarkdown.cold"] = best(cold, repeat)
+
+    cache = BlockCache()
+    renderer.renderMarkdown(text, cache)
+    variants = [editedCopy(text), text]
+    state = {"i": 0}
+
+    def edit():
+        state["i"] ^= 1
+        renderer.renderMarkdown(variants[state["i"]], cache)
+
+    results["renderMarkdown.edit"] = best(edit, repeat)
+
+    lines = text.split("\n")
+    results["splitBlocks"] = best(lambda: renderer.parseSpans(lines, 0, len(lines)), repeat)
+
+    def mdRender():
+        renderer.highlightCache.clear()
+        renderer.md.render(text)
+
+    results["md.render"] = best(mdRender, repeat)
+
+    html = renderer.md.render(text)
+    results["postprocessHtml"] = best(lambda: renderer.postprocessHtml(html), repeat)
+
+    fences = []
+    for token in renderer.md.parse(text):
+        if token.type == "fence":
+            lexer = renderer.resolveLexer(token.info.split()[0] if token.info.strip() else "text")
+            if lexer is not None and len(token.content) <= renderer.maxHighlightChars:
+                fences.append((token.content, lexer))
+
+    def pygmentsAll():
+        for code, lexer in fences:
+            highlight(code, lexer, renderer.pygmentsFormatter)
+
+    results["pygments"] = best(pygmentsAll, repeat)
+    return results
+
+
+def benchHighlighter(text, repeat):
+    from PySide6.QtGui import QTextCursor
+    from PySide6.QtWidgets import QApplication, QTextEdit
+
+    from functions.Highlighter import MarkdownHighlighter
+
+    app = QApplication.instance() or QApplication([])
+    results = {}
+
+    def full():
+        editor = QTextEdit()
+        MarkdownHighlighter(editor.document())
+        app.processEvents()
+        editor.setPlainText(text)
+        editor.deleteLater()
+
+    results["highlighter.full"] = best(full, repeat)
+
+    editor = QTextEdit()
+    highlighter = MarkdownHighlighter(editor.document())
+    app.processEvents()
+    editor.setPlainText(text)
+    cursor = QTextCursor(editor.document())
+    cursor.setPosition(editor.document().characterCount() // 2)
+
+    def keystroke():
+        cursor.insertText("x")
+
+    results["highlighter.edit"] = best(keystroke, repeat)
+    del highlighter
+    editor.deleteLater()
+    app.processEvents()
+    return results
+
+
+def runSuite(names, repeat, withHighlighter=True):
+    results = {}
+    for name in names:
+        text = CORPORA[name]()
+        print(f"[{name}] {len(text) / 1024:.0f} KB", flush=True)
+        stages = benchRenderer(text, repeat)
+        if withHighlighter:
+            stages.update(benchHighlighter(text, repeat))
+        for stage, seconds in stages.items():
+            print(f"    {stage:<22} {seconds * 1000:9.1f} ms")
+        results[name] = stages
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for corpus, stages in results.items():
+        for stage, seconds in stages.items():
+            old = baseline.get(corpus, {}).get(stage)
+            if old is None:
+                continue
+            if seconds > old * (1 + threshold) and seconds - old > NOISE_FLOOR_SECONDS:
+                regressions.append((corpus, stage, old, seconds))
+    return regressions
+
+
+def writeJson(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MPlus渲染/高亮基准测试")
+    parser.add_argument("--corpus", action="append", choices=sorted(CORPORA), help="只跑指定语料，可以写多次")
+    parser.add_argument("--all", action="store_true", help="包括10MB的语料")
+    parser.add_argument("--repeat", type=int, default=3, help="每个阶段跑几次取最快（默认3）")
+    parser.add_argument("--no-highlighter", action="store_true", help="跳过编辑器高亮（不需要Qt）")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "latest.json"))
+    parser.add_argument("--baseline", help="基线JSON，和它比较")
+    parser.add_argument("--threshold", type=float, default=0.25, help="变慢超过这个比例算退化（默认0.25）")
+    parser.add_argument("--save-baseline", action="store_true", help="把结果另存为benchmarks/results/baseline.json")
+    args = parser.parse_args(argv)
+
+    names = args.corpus or (tuple(CORPORA) if args.all else DEFAULT_CORPORA)
+    results = runSuite(names, max(1, args.repeat), not args.no_highlighter)
+
+    data = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    writeJson(args.output, data)
+    if args.save_baseline:
+        writeJson(os.path.join(RESULTS_DIR, "baseline.json"), data)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+        regressions = compare(results, baseline, args.threshold)
+        for corpus, stage, old, new in regressions:
+            print(f"退化：[{corpus}] {stage} {old * 1000:.1f} ms -> {new * 1000:.1f} ms ({new / old - 1:+.0%})")
+        if regressions:
+            return 1
+        print(f"没有超过 {args.threshold:.0%} 的退化")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+# 代码高亮两种输出的对比：内联style（以前的做法） vs class + 主题样式表
+# 量的是预览真正要吃的东西：HTML有多大、Qt解析（QTextDocument.setHtml）要多久
+# 用法：python benchmarks/StyleBench.py [--corpus code-1mb] [--repeat 3]
+
+import argparse
+import os
+import sys
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Corpora import CORPORA
+from RenderBench import best
+from functions.PreviewStyle import stripStyleTag
+from functions.Renderer import MarkdownRenderer
+
+DEFAULT_STYLE_CORPORA = ("small", "mixed-1mb", "code-1mb")
+
+
+def benchStyles(text, repeat):
+    from PySide6.QtGui import QTextDocument
+    from PySide6.QtWidgets import QApplication
+
+    QApplication.instance() or QApplication([])
+    results = {}
+    for mode, inlineStyles in (("inline", True), ("classes", False)):
+        renderer = MarkdownRenderer(inlineStyles=inlineStyles)
+        renderer.deferHighlightChars = None
+        html = renderer.renderMarkdown(text)
+        css = stripStyleTag(renderer.styleSheet())
+
+        def setHtml():
+            document = QTextDocument()
+            document.setDefaultStyleSheet(css)
+            document.setHtml(html)
+
+        results[mode] = (len(html.encode("utf-8")), best(setHtml, repeat))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MPlus代码高亮输出方式对比")
+    parser.add_argument("--corpus", action="append", choices=sorted(CORPORA), help="只跑指定语料，可以写多次")
+    parser.add_argument("--repeat", type=int, default=3, help="每项跑几次取最快（默认3）")
+    args = parser.parse_args(argv)
+
+    print(f"{'语料':<12}{'输出':<8}{'HTML':>10}{'setHtml':>12}")
+    for name in args.corpus or DEFAULT_STYLE_CORPORA:
+        results = benchStyles(CORPORA[name](), max(1, args.repeat))
+        for mode, (size, seconds) in results.items():
+            print(f"{name:<14}{mode:<10}{size / 1024:8.0f} KB{seconds * 1000:9.1f} ms")
+        (oldSize, oldTime), (newSize, newTime) = results["inline"], results["classes"]
+        print(f"{'':<14}{'变化':<8}{newSize / oldSize - 1:+10.0%}{newTime / oldTime - 1:+12.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+# 自动保存 + 崩溃恢复日志
+# 自动保存：GUI线程只拷一份文本快照，算哈希、编码、写临时文件再rename都在工作线程里做，内容没变就不写
+# 恢复日志：两次保存之间的每次编辑都追加到日志（位置、删了几个字、插了什么），崩了之后拿磁盘上的文件重放一遍就回来了
+# 日志按段存：每次自动保存开一段新的，保存成功后把旧段删掉；保存失败旧段还在，照样能接着重放
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, QTimer, Signal
+from PySide6.QtGui import QTextCursor, QTextDocument
+
+from functions.Tracer import tracer
+
+RECOVERY_DIR = os.path.join(os.path.expanduser('~'), '.mplus', 'recovery')
+
+
+def contentHash(text):
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+
+
+def atomicWrite(path, text, encoding='utf-8'):  # 先写同目录的临时文件，fsync后rename，写到一半崩了原文件也还在
+    text = text.replace('\n', os.linesep)
+    try:
+        data = text.encode(encoding)
+    except (UnicodeEncodeError, LookupError):
+        encoding = 'utf-8'  # 原编码装不下新打的字，退回UTF-8，总比丢字强
+        data = text.encode(encoding, 'surrogatepass')
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmpPath = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, tmpPath)
+        os.replace(tmpPath, path)
+    except BaseException:
+        try:
+            os.remove(tmpPath)
+        except OSError:
+            pass
+        raise
+    return encoding
+
+
+class _SaveSignals(QObject):
+    saved = Signal(str, object, str)  # 路径, 调用方给的令牌, 实际用的编码
+    failed = Signal(str, object, str)  # 路径, 令牌, 错误信息
+
+
+class _SaveJob(QRunnable):
+    def __init__(self, saver, path, text, encoding, token):
+        super().__init__()
+        self.saver = saver
+        self.path = path
+        self.text = text
+        self.encoding = encoding
+        self.token = token
+
+    def run(self):
+        try:
+            with tracer.span("autosave.write", chars=len(self.text)) as span:
+                digest = contentHash(self.text)
+                if self.saver.lastHash(self.path) == digest:
+                    span.set(skipped=True)
+                    encoding = self.encoding
+                else:
+                    encoding = atomicWrite(self.path, self.text, self.encoding)
+                    self.saver.remember(self.path, digest=digest)
+        except Exception as e:
+            self.saver.signals.failed.emit(self.path, self.token, repr(e))
+            return
+        self.saver.signals.saved.emit(self.path, self.token, encoding)
+
+
+class AutoSaver(QObject):
+    saved = Signal(str, object, str)
+    failed = Signal(str, object, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # 一个线程就够，保证同一个文件的写入按顺序来
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.signals = _SaveSignals()
+        self.signals.saved.connect(self.saved)
+        self.signals.failed.connect(self.failed)
+        self._hashes = {}  # 路径 -> 上次写进去（或读出来）的内容哈希
+        self._lock = threading.Lock()
+
+    def lastHash(self, path):
+        with self._lock:
+            return self._hashes.get(os.path.abspath(path))
+
+    def remember(self, path, text=None, digest=None):  # 刚读进来/刚存过的内容，下次一样就不用写
+        if digest is None:
+            digest = contentHash(text)
+        with self._lock:
+            self._hashes[os.path.abspath(path)] = digest
+
+    def save(self, path, text, encoding='utf-8', token=None):  # text必须是快照，工作线程里不能再碰文档
+        self.pool.start(_SaveJob(self, path, text, encoding, token))
+
+    def saveNow(self, path, text, encoding='utf-8'):  # 手动保存：等排着的自动保存写完，再同步写，免得旧快照盖掉新内容
+        self.pool.waitForDone()
+        encoding = atomicWrite(path, text, encoding)
+        self.remember(path, text)
+        return encoding
+
+    def shutdown(self):
+        self.pool.waitForDone()
+
+
+class EditJournal(QObject):
+    flushIntervalMs = 500  # 编辑先攒着，这么久落一次盘；崩溃最多丢这么一小段
+
+    def __init__(self, parent=None, directory=RECOVERY_DIR):
+        super().__init__(parent)
+        self.directory = directory
+        self.document = None
+        self.key = None
+        self.path = None
+        self.segment = 0
+        self.file = None
+        self.buffer = []
+        self.editCount = 0  # 一共记了多少次编辑，判断保存期间有没有新改动
+        self.untitledName = 'untitled'  # 没有文件名时日志用的名字，多个未命名标签页各用各的
+
+        self.flushTimer = QTimer(self)
+        self.flushTimer.setSingleShot(True)
+        self.flushTimer.setInterval(self.flushIntervalMs)
+        self.flushTimer.timeout.connect(self.flush)
+
+    def keyFor(self, path):
+        name = os.path.abspath(path) if path else self.untitledName
+        return hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+
+    def attach(self, document):
+        self.document = document
+        document.contentsChange.connect(self.onContentsChange)
+
+    def segmentPaths(self, key):  # 按段号排好
+        paths = glob.glob(os.path.join(glob.escape(self.directory), f'{key}.*.journal'))
+        return sorted(paths, key=lambda p: int(p.rsplit('.', 2)[-2]))
+
+    def start(self, path, baseText):  # 换了文件或者刚存完：旧日志作废，从baseText开始重新记
+        self.stop()
+        self.key = self.keyFor(path)
+        for old in self.segmentPaths(self.key):
+            os.remove(old)
+        self.segment = 0
+        self.openSegment(path, baseText)
+
+    def openSegment(self, path, baseText):
+        os.makedirs(self.directory, exist_ok=True)
+        segmentPath = os.path.join(self.directory, f'{self.key}.{self.segment}.journal')
+        self.file = open(segmentPath, 'a', encoding='utf-8', newline='\n')
+        self.file.write(json.dumps({'path': path, 'base': contentHash(baseText)}, ensure_ascii=False) + '\n')
+        self.file.flush()
+        self.path = path
+
+    def onContentsChange(self, position, charsRemoved, charsAdded):
+        if self.file is None:
+            return
+        text = ''
+        if charsAdded:
+            cursor = QTextCursor(self.document)
+            cursor.setPosition(position)
+            cursor.setPosition(min(position + charsAdded, self.document.characterCount() - 1), QTextCursor.KeepAnchor)
+            text = cursor.selectedText().replace('\u2029', '\n')  # 段落分隔符换回换行
+        self.buffer.append(json.dumps([position, charsRemoved, text], ensure_ascii=False))
+        self.editCount += 1
+        if not self.flushTimer.isActive():
+            self.flushTimer.start()
+
+    def flush(self):
+        self.flushTimer.stop()
+        if self.file is None or not self.buffer:
+            return
+        try:
+            self.file.write('\n'.join(self.buffer) + '\n')
+            self.file.flush()
+        except OSError as e:
+            print(f'恢复日志写入失败：{e!r}', file=sys.stderr)
+        self.buffer = []
+
+    def checkpoint(self, text):  # 要保存text了：开新的一段，以text为底；返回段号，保存成功后交给commit
+        if self.file is None:
+            return None
+        self.flush()
+        self.file.close()
+        self.segment += 1
+        self.openSegment(self.path, text)
+        return self.segment
+
+    def commit(self, segment):  # 这一段的底已经落盘，之前的段都没用了
+        if segment is None or self.key is None:
+            return
+        for old in self.segmentPaths(self.key):
+            if int(old.rsplit('.', 2)[-2]) < segment:
+                os.remove(old)
+
+    def stop(self):  # 不再记录，日志留着（比如没保存就关了，下次还能恢复）
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.key = None
+
+    def discard(self):  # 内容都存好了，日志删掉
+        key = self.key
+        self.stop()
+        if key is not None:
+            for old in self.segmentPaths(key):
+                os.remove(old)
+
+    def recover(self, path, diskText):  # 磁盘内容 + 日志重放，返回恢复出来的文本；没东西可恢复返回None
+        segments = self.segmentPaths(self.keyFor(path))
+        base = contentHash(diskText)
+        for i, segmentPath in enumerate(segments):
+            with open(segmentPath, 'r', encoding='utf-8') as f:
+                header = f.readline()
+            try:
+                if json.loads(header).get('base') == base:
+                    break
+            except ValueError:
+                continue
+        else:
+            return None
+
+        document = QTextDocument()
+        document.setPlainText(diskText)
+        cursor = QTextCursor(document)
+        for segmentPath in segments[i:]:
+            with open(segmentPath, 'r', encoding='utf-8') as f:
+                lines = f.read().split('\n')[1:]
+            for line in lines:
+                try:
+                    position, charsRemoved, text = json.loads(line)
+                except ValueError:  # 最后一行可能只写了一半
+                    continue
+                end = document.characterCount() - 1
+                cursor.setPosition(min(position, end))
+                cursor.setPosition(min(position + charsRemoved, end), QTextCursor.KeepAnchor)
+                cursor.insertText(text)
+        recovered = document.toPlainText()
+        return None if recovered == diskText else recovered
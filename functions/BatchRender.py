@@ -0,0 +1,209 @@
+# 无界面批量渲染，给CI发布整棵文档树用
+# 不需要QApplication，用进程池把目录下的.md全部渲染成HTML，按内容哈希跳过没改过的文件
+# 用法：python MarkPlus.py render <源目录> <输出目录> [-j N] [--force] [--pdf]
+# --pdf 每个文件再出一份分页的PDF（每个进程起一个offscreen的QGuiApplication来排版）
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from functions.FileLoader import SNIFF_BYTES, detectEncoding
+from functions.PreviewStyle import themeStyleSheet
+from functions.Renderer import MarkdownRenderer
+
+MARKDOWN_SUFFIXES = ('.md', '.markdown')
+MANIFEST_NAME = '.mplus-manifest.json'
+MANIFEST_VERSION = 2  # 2：源文件按编辑器一样猜编码，以前按UTF-8解错的GBK文档要重新出
+
+HTML_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+{css}
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+_workerRenderer = None
+_workerPdf = False
+
+
+def _initWorker(pdf=False):
+    global _workerRenderer, _workerPdf
+    _workerRenderer = MarkdownRenderer()
+    _workerRenderer.deferHighlightChars = None  # 批量导出不需要先出占位，直接高亮
+    _workerPdf = pdf
+    if pdf:
+        from functions.PdfExport import ensureGuiApplication
+        ensureGuiApplication()
+
+
+def _renderOne(sourcePath, outputPath):
+    started = time.perf_counter()
+    with open(sourcePath, 'rb') as f:
+        raw = f.read()
+    text = str(raw, detectEncoding(raw[:SNIFF_BYTES]), 'replace')  # 和编辑器打开时一样猜编码，GBK的文档不会乱码
+    body = _workerRenderer.renderMarkdown(text)
+    title = os.path.splitext(os.path.basename(sourcePath))[0]
+    page = HTML_PAGE.format(title=title, css=_workerRenderer.styleSheet().strip(), body=body)
+
+    os.makedirs(os.path.dirname(outputPath), exist_ok=True)
+    tmpPath = outputPath + '.tmp'
+    with open(tmpPath, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(page)
+    os.replace(tmpPath, outputPath)
+    if _workerPdf:
+        from functions.PdfExport import writePdf
+        writePdf(body, _workerRenderer.styleSheet(), pdfPathFor(outputPath), title,
+                 baseDir=os.path.dirname(os.path.abspath(sourcePath)))
+    return len(raw), time.perf_counter() - started
+
+
+def rendererSignature():  # 样式或渲染器版本变了，清单里的哈希全部作废
+    digest = hashlib.sha256(themeStyleSheet().encode('utf-8'))
+    digest.update(str(MANIFEST_VERSION).encode('ascii'))
+    return digest.hexdigest()[:16]
+
+
+def fileHash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def findMarkdownFiles(sourceDir):
+    for root, dirs, files in os.walk(sourceDir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for name in sorted(files):
+            if name.lower().endswith(MARKDOWN_SUFFIXES):
+                yield os.path.relpath(os.path.join(root, name), sourceDir)
+
+
+def loadManifest(path, signature):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('signature') != signature:
+        return {}
+    return manifest.get('files', {})
+
+
+def saveManifest(path, signature, files):
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'w', encoding='utf-8') as f:
+        json.dump({'signature': signature, 'files': files}, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmpPath, path)
+
+
+def outputPathFor(relPath):
+    return os.path.splitext(relPath)[0] + '.html'
+
+
+def outputPaths(relPaths):  # 源文件 -> 输出路径；a.md和a.markdown会撞成同一个a.html，撞了的都保留原扩展名（a.md.html）
+    groups = {}
+    for relPath in relPaths:
+        groups.setdefault(os.path.normcase(outputPathFor(relPath)), []).append(relPath)
+    paths = {}
+    for group in groups.values():
+        if len(group) > 1:
+            print(f'输出文件名冲突，保留原扩展名：{", ".join(group)}', file=sys.stderr)
+        for relPath in group:
+            paths[relPath] = outputPathFor(relPath) if len(group) == 1 else relPath + '.html'
+    return paths
+
+
+def pdfPathFor(htmlPath):
+    return os.path.splitext(htmlPath)[0] + '.pdf'
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(prog='MPlus render', description='把目录下的Markdown批量渲染成HTML')
+    parser.add_argument('source', help='Markdown源目录')
+    parser.add_argument('output', help='HTML输出目录')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='进程数（默认CPU核数）')
+    parser.add_argument('--force', action='store_true', help='忽略清单，全部重新渲染')
+    parser.add_argument('--pdf', action='store_true', help='同时导出分页的PDF')
+    parser.add_argument('--manifest', help=f'清单文件路径（默认<输出目录>/{MANIFEST_NAME}）')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArgs(sys.argv[1:] if argv is None else argv)
+    sourceDir = os.path.abspath(args.source)
+    outputDir = os.path.abspath(args.output)
+    if not os.path.isdir(sourceDir):
+        print(f'源目录不存在：{sourceDir}', file=sys.stderr)
+        return 2
+    os.makedirs(outputDir, exist_ok=True)
+
+    manifestPath = args.manifest or os.path.join(outputDir, MANIFEST_NAME)
+    signature = rendererSignature()
+    oldFiles = {} if args.force else loadManifest(manifestPath, signature)
+
+    started = time.perf_counter()
+    newFiles = {}
+    todo = []
+    skipped = 0
+    outPaths = outputPaths(findMarkdownFiles(sourceDir))
+    for relPath, outRel in outPaths.items():
+        key = relPath.replace(os.sep, '/')
+        digest = fileHash(os.path.join(sourceDir, relPath))
+        old = oldFiles.get(key)
+        outputs = [outRel, pdfPathFor(outRel)] if args.pdf else [outRel]
+        if old and old.get('hash') == digest and all(os.path.exists(os.path.join(outputDir, p)) for p in outputs):
+            newFiles[key] = old
+            skipped += 1
+            continue
+        todo.append((key, relPath, outRel, digest))
+
+    rendered = failed = 0
+    bytesIn = 0
+    cpuSeconds = 0.0
+    if todo:
+        jobs = max(1, min(args.jobs, len(todo)))
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_initWorker, initargs=(args.pdf,)) as pool:
+            futures = {
+                pool.submit(_renderOne, os.path.join(sourceDir, relPath), os.path.join(outputDir, outRel)):
+                    (key, outRel, digest)
+                for key, relPath, outRel, digest in todo
+            }
+            for future in as_completed(futures):
+                key, outRel, digest = futures[future]
+                try:
+                    size, seconds = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f'渲染失败 {key}: {e!r}', file=sys.stderr)
+                    continue
+                rendered += 1
+                bytesIn += size
+                cpuSeconds += seconds
+                newFiles[key] = {'hash': digest, 'output': outRel.replace(os.sep, '/')}
+
+    saveManifest(manifestPath, signature, newFiles)
+
+    elapsed = time.perf_counter() - started
+    total = rendered + skipped + failed
+    print(
+        f'{total} 个文件：渲染 {rendered}，跳过(未改动) {skipped}，失败 {failed}\n'
+        f'耗时 {elapsed:.2f}s，渲染 {bytesIn / 1024 / 1024:.2f} MB，'
+        f'{rendered / elapsed if elapsed else 0:.1f} 文件/s，'
+        f'{bytesIn / 1024 / 1024 / elapsed if elapsed else 0:.2f} MB/s（累计渲染CPU时间 {cpuSeconds:.2f}s）'
+    )
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,27 @@
+# 一个文档的渲染缓存，从Renderer里拆出来：标签页建缓存时不用把markdown-it和pygments也拉进来
+
+class BlockCache:  # 内容哈希 -> 块HTML，外加上次切块的结果
+    def __init__(self):
+        self.entries = {}  # 每次渲染后只留下当前文档还在用的块
+        self.highlightKeys = {}  # 块哈希 -> 这块用到的代码高亮缓存key，清缓存时好知道哪些高亮结果是这个文档独占的
+        self.lines = None  # 上次渲染的源码行，用来和这次比出改动范围
+        self.blocks = []  # 上次的RenderedBlock列表
+        self.refDefs = []  # (行号, label, href, title)，按行号排好
+        self.refKey = ''
+
+    def clear(self):
+        self.entries.clear()
+        self.highlightKeys.clear()
+        self.lines = None
+        self.blocks = []
+        self.refDefs = []
+        self.refKey = ''
+
+    def usedHighlightKeys(self):
+        keys = set()
+        for blockKeys in self.highlightKeys.values():
+            keys.update(blockKeys)
+        return keys
+
+    def __len__(self):
+        return len(self.entries)
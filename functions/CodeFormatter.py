@@ -0,0 +1,29 @@
+# 代码高亮用的HtmlFormatter：输出class而不是内联style
+# pygments自己的class是按token类型分的（k、kd、n、p……），同色的相邻token也拆成好几个<span>，
+# Qt解析HTML时每个元素都要把样式表规则挨个匹配一遍，span多、规则多反而比内联style还慢；
+# 这里按"最终样式"分组，同样式的token用同一个class（hl0、hl1……），span数量和内联模式一样，规则也就十来条
+
+from pygments.formatters import HtmlFormatter
+
+
+class GroupedHtmlFormatter(HtmlFormatter):
+    def __init__(self, **options):
+        super().__init__(**options)
+        groups = {}  # 内联style -> class名
+        self.groupClasses = {}  # token类型 -> class名，没有样式的是''
+        for ttype, _ndef in self.style:
+            cssClass = self._get_css_inline_styles(ttype)
+            style = self.class2style[cssClass][0] if cssClass else ''  # 和内联模式一样，纯文本不包<span>
+            if style and style not in groups:
+                groups[style] = f'{self.classprefix}hl{len(groups)}'
+            self.groupClasses[ttype] = groups.get(style, '')
+        self.groupRules = [(name, style) for style, name in groups.items()]
+
+    def _get_css_classes(self, ttype):  # 覆盖pygments的内部方法，_format_lines靠它生成<span class=...>
+        while ttype not in self.groupClasses:
+            ttype = ttype.parent
+        return self.groupClasses[ttype]
+
+    def groupStyleDefs(self, selector=''):
+        prefix = selector + ' ' if selector else ''
+        return [f'{prefix}.{name} {{ {style.strip()} }}' for name, style in self.groupRules]
@@ -0,0 +1,546 @@
+# 标签页：一个标签一个文档，编辑器、预览、块缓存、文件状态、恢复日志都各管各的
+# 渲染器整个窗口共用一个，各标签的调度器共用一个单线程的线程池，渲染器还是只在一个线程里跑
+# 只有前台标签会渲染；切回来时预览控件还在就直接显示，被内存上限清掉的再从块缓存（或者源码）重建
+
+import os
+import sys
+from bisect import bisect_right
+from html import escape
+from operator import attrgetter
+
+from PySide6.QtCore import Qt, QTimer, Signal
+from PySide6.QtGui import QFont, QTextCursor
+from PySide6.QtWidgets import QMessageBox, QSplitter
+
+from functions.AutoSave import EditJournal
+from functions.BlockCache import BlockCache
+from functions.DropFileRewrite import DragDropTextEdit
+from functions.FileLoader import ChunkedReader
+from functions.Highlighter import LAZY_THRESHOLD_BYTES, MarkdownHighlighter
+from functions.PreviewStyle import PREVIEW_CSS
+from functions.PreviewWidget import IncrementalPreview
+from functions.RenderBudget import LEVEL_FULL, LEVEL_PLAIN_OFFSCREEN, RenderBudget
+from functions.RenderedBlock import RenderedBlock
+from functions.RenderScheduler import RenderScheduler
+from functions.ScrollSync import ScrollSync
+from functions.SourceMap import blockNumberAtY
+
+# 预览文档（QTextDocument的排版数据）每个字大概占多少内存，粗估，只用来算内存上限
+PREVIEW_BYTES_PER_CHAR = 64
+
+EDITOR_QSS = """
+    QTextEdit {
+        font-size: 12px;
+        line-height: 1.5;
+        padding: 12px;
+        color: #ffffff;
+        background-color: #1e1e1e;
+        border: none;
+        selection-color: white;
+        selection-background-color: #094771;
+    }
+    QTextEdit:focus {
+        border: 1px solid #569cd6;
+    }
+    QScrollBar:vertical {
+        background: #1e1e1e;
+        width: 10px;
+        margin: 0px;
+    }
+    QScrollBar::handle:vertical {
+        background: #454545;
+        min-height: 20px;
+        border-radius: 5px;
+    }
+    QScrollBar::add-line:vertical,
+    QScrollBar::sub-line:vertical {
+        height: 0px;
+        background: none;
+    }
+    QScrollBar:horizontal {
+        background: #1e1e1e;
+        height: 10px;
+        margin: 0px;
+    }
+    QScrollBar::handle:horizontal {
+        background: #454545;
+        min-width: 20px;
+        border-radius: 5px;
+    }
+    QScrollBar::add-line:horizontal,
+    QScrollBar::sub-line:horizontal {
+        width: 0px;
+        background: none;
+    }
+"""
+
+PREVIEW_QSS = """
+    QTextBrowser {
+        font-family: "Microsoft YaHei", sans-serif;
+        font-size: 14px;
+        padding: 15px;
+        color: #ffffff;
+        background-color: #1e1e1e;
+        border: none;
+    }
+    QScrollBar:vertical {
+        background: #252526;
+        width: 10px;
+    }
+    QScrollBar::handle:vertical {
+        background: #454545;
+        min-height: 20px;
+    }
+"""
+
+
+def renderWithCache(markdownText, cache, level=LEVEL_FULL, visibleRanges=()):  # 跑在渲染线程里，别碰任何控件
+    from functions.Renderer import MarkdownRenderer
+    return MarkdownRenderer.shared().renderBlocks(markdownText, cache, level, visibleRanges)
+
+
+# noinspection PyAttributeOutsideInit
+class DocumentTab(QSplitter):
+    stateChanged = Signal()  # 文件名、载入进度变了，窗口更新标题
+    previewApplied = Signal()  # 预览更新完了，窗口检查一下内存上限
+    outlineChanged = Signal()  # 标题列表变了，窗口刷新大纲面板
+    qualityChanged = Signal()  # 预览降级级别变了，窗口更新状态栏
+
+    firstChunkBytes = 128 * 1024  # 打开文件时先塞进编辑器的量，够第一屏用
+    loadChunkBytes = 512 * 1024  # 之后每轮事件循环再追加这么多
+    # 外部修改的几处离得近就合成一次改动：每多一次改动，排版要把后面的块都过一遍（和总行数成正比），
+    # 合成一次只是多高亮中间隔着的几行；隔的行数不到reloadMergeLines或总行数的1/reloadMergeRatio就合并
+    reloadMergeLines = 50
+    reloadMergeRatio = 40
+    reloadMaxSteps = 32  # 合并完还超过这么多段就整个合成一次
+    offscreenMarginLines = 200  # 屏幕外纯文本那一级，可见范围上下再多渲染这么多行，滚动时不至于马上看到纯文本
+
+    def __init__(self, renderPool, autoSaver, openCallback=None, untitledSlot=0,
+                 debounceMs=RenderScheduler.DEFAULT_DEBOUNCE_MS, css=PREVIEW_CSS, imageLoader=None,
+                 renderBudgetMs=None, fileWatcher=None, parent=None):
+        super().__init__(Qt.Horizontal, parent)
+        self.setStyleSheet("QSplitter::handle { background-color: #333337; }")
+        self.autoSaver = autoSaver  # 整个窗口共用一个，写盘线程只有一个
+        self.fileWatcher = fileWatcher  # 也是整个窗口共用，None就不监视外部修改
+        self.reloadAfterLoading = False  # 载入途中文件又被改了，载完再比一次
+        self.reloadDeclined = False  # 有没存的修改时问过不要外部修改，存盘/换文件之前不再问
+        self.askingReload = False
+        self.currentFile = None
+        self.currentEncoding = 'utf-8'
+        self.fileReader = None  # 正在分块载入的文件
+        self.loadTimer = QTimer(self)
+        self.loadTimer.setSingleShot(True)
+        self.loadTimer.setInterval(0)  # 每轮事件循环追加一块，中间界面照常响应
+        self.loadTimer.timeout.connect(self.loadNextChunk)
+
+        self.blockCache = BlockCache()
+        self.active = False  # 只有前台标签渲染
+        self.stale = True  # 文本改了但还没渲染过
+        self.previewEvicted = False  # 预览文档被清掉了，块缓存还在
+        self.cacheEvicted = False  # 块缓存也清掉了，回来得整篇重新渲染
+        self.cacheBytes = 0
+        self.lastActive = 0  # 最近一次切到前台的序号，清内存时先清最久没看的
+        self.headings = []  # [(行号, 级别, 源码文字)]，每次渲染从块上收集
+        self.renderBudget = RenderBudget(renderBudgetMs)  # 渲染超预算就降级预览质量
+        self.renderLevel = LEVEL_FULL  # 正在跑（或刚送回来）的那次渲染用的级别
+        self.visibleRanges = ()  # 同上，那次渲染时看得见的源码行范围
+
+        self.renderScheduler = RenderScheduler(
+            lambda text: renderWithCache(text, self.blockCache, self.renderLevel, self.visibleRanges),
+            self.renderSnapshot,
+            debounceMs=debounceMs,
+            parent=self,
+            pool=renderPool
+        )
+        self.renderScheduler.rendered.connect(self.applyPreview)
+        self.renderScheduler.renderFailed.connect(self.showRenderError)
+
+        self.markdownInput = DragDropTextEdit(load_callback=openCallback)
+        self.markdownInput.setFont(QFont("Microsoft YaHei", 10))
+        self.markdownInput.setStyleSheet(EDITOR_QSS)
+        self.markdownInput.setPlaceholderText(
+            "导入，拖拽您的MarkDown文件到此处，或者直接开始创作！\n"
+        )
+        self.markdownInput.textChanged.connect(self.updatePreview)
+        self.highlighter = MarkdownHighlighter(self.markdownInput.document())
+        self.highlighter.attachEditor(self.markdownInput)
+        self.addWidget(self.markdownInput)
+
+        # 文档型预览，只换改动的块，滚动位置和选区都留着
+        self.previewBrowser = IncrementalPreview(css=css)
+        self.previewBrowser.setStyleSheet(PREVIEW_QSS)
+        if imageLoader is not None:  # 图片缓存和解码线程整个窗口共用
+            self.previewBrowser.setImageLoader(imageLoader)
+        self.addWidget(self.previewBrowser)
+        self.scrollSync = ScrollSync(self.markdownInput, self.previewBrowser, self)
+        self.markdownInput.verticalScrollBar().valueChanged.connect(self.onViewportMoved)
+        self.previewBrowser.verticalScrollBar().valueChanged.connect(self.onViewportMoved)
+
+        # 两次自动保存之间的编辑记到恢复日志里
+        self.journal = EditJournal(self)
+        if untitledSlot:
+            self.journal.untitledName = f'untitled-{untitledSlot}'
+        self.journal.attach(self.markdownInput.document())
+        self.untitledSlot = untitledSlot
+
+    def displayName(self):
+        if self.currentFile:
+            return self.currentFile.replace('\\', '/').rsplit('/', 1)[-1]
+        return "未命名" if not self.untitledSlot else f"未命名 {self.untitledSlot + 1}"
+
+    def baseDir(self):  # 相对路径的图片按md文件所在目录找，预览、导出、打印都用它；未命名的是None
+        return os.path.dirname(os.path.abspath(self.currentFile)) if self.currentFile else None
+
+    def isBlank(self):  # 新建后还没动过的空标签，打开文件时直接用它
+        return (not self.currentFile and self.fileReader is None
+                and not self.markdownInput.document().isModified() and self.markdownInput.document().isEmpty())
+
+    def setActive(self, active, order=0):
+        self.active = active
+        if not active:
+            return
+        self.lastActive = order
+        if self.cacheEvicted or self.stale:
+            self.previewEvicted = False
+            self.renderScheduler.renderNow()
+        elif self.previewEvicted:  # 块缓存还在：直接拿上次渲染的块重建预览，不用重新解析
+            self.previewEvicted = False
+            self.previewBrowser.applyBlocks(self.blockCache.blocks)
+
+    def updatePreview(self):  # textChanged只负责排队，真正渲染在工作线程
+        self.stale = True
+        if self.active:
+            self.renderScheduler.schedule()
+
+    def renderSnapshot(self):  # 派发渲染时在GUI线程里取：文本，连同这次用的级别和可见范围
+        self.renderLevel = self.renderBudget.level
+        self.visibleRanges = self.visibleLineRanges() if self.renderLevel == LEVEL_PLAIN_OFFSCREEN else ()
+        return self.markdownInput.toPlainText()
+
+    def visibleLineRanges(self):  # 编辑器和预览各自看得见的源码行，上下各放宽一点
+        margin = self.offscreenMarginLines
+        editor = self.markdownInput
+        top = editor.verticalScrollBar().value()
+        first = blockNumberAtY(editor.document(), top, editor.textCursor().blockNumber())
+        last = blockNumberAtY(editor.document(), top + editor.viewport().height(), first)
+        ranges = [(max(0, first - margin), last + margin)]
+        preview = self.previewBrowser
+        if len(preview.sourceMap):
+            top = preview.verticalScrollBar().value()
+            first = int(self.scrollSync.previewLineAt(top))
+            last = int(self.scrollSync.previewLineAt(top + preview.viewport().height())) + 1
+            ranges.append((max(0, first - margin), last + margin))
+        return ranges
+
+    def onViewportMoved(self):  # 屏幕外纯文本那一级：滚到了还是纯文本的块，排一次渲染把它们换成正常的
+        if not self.active or self.renderBudget.level != LEVEL_PLAIN_OFFSCREEN or self.previewBrowser.patching:
+            return
+        blocks = self.blockCache.blocks
+        for first, last in self.visibleLineRanges():
+            index = bisect_right(blocks, last, key=attrgetter('startLine')) - 1
+            while index >= 0 and blocks[index].endLine > first:
+                if blocks[index].level == LEVEL_PLAIN_OFFSCREEN:
+                    self.renderScheduler.schedule()
+                    return
+                index -= 1
+
+    def setRenderBudget(self, budgetMs):
+        level = self.renderBudget.level
+        if self.renderBudget.setBudget(budgetMs):
+            self.onQualityChanged(level)
+
+    def onQualityChanged(self, oldLevel):
+        self.qualityChanged.emit()
+        if self.renderBudget.level < oldLevel and self.active:  # 升级了：降级时渲染的块趁现在换回来，不等下次按键
+            self.renderScheduler.schedule()
+
+    def highlightFinished(self):  # 后台高亮的大代码块好了：前台的马上重渲染，后台的等切回来
+        if any(block.pending for block in self.blockCache.blocks):
+            self.updatePreview()
+
+    def applyPreview(self, blocks):
+        if not self.active and self.cacheEvicted:  # 切走之后才回来的结果，缓存已经清了，不要了
+            return
+        self.stale = False
+        self.cacheEvicted = False
+        self.cacheBytes = sum(sys.getsizeof(block.html) for block in blocks)
+        if not self.previewEvicted:
+            self.previewBrowser.applyBlocks(blocks)
+        headings = [(block.startLine,) + block.heading for block in blocks if block.heading is not None]
+        if headings != self.headings:
+            self.headings = headings
+            self.outlineChanged.emit()
+        self.previewApplied.emit()
+        level = self.renderBudget.level
+        if self.renderBudget.record(self.renderScheduler.lastRenderSeconds, self.renderLevel):
+            self.onQualityChanged(level)
+
+    def reloadFromDisk(self):  # 文件在外面被改了：后台读出来和当前内容按行比，好了回到applyReload
+        if not self.currentFile or self.fileWatcher is None:
+            return
+        if self.fileReader is not None:
+            self.reloadAfterLoading = True
+            return
+        document = self.markdownInput.document()
+        self.fileWatcher.diff(self.currentFile, self.markdownInput.toPlainText(), (self, document.revision()))
+
+    def applyReload(self, path, revision, text, encoding, edits):
+        if not self.currentFile or os.path.abspath(self.currentFile) != path:  # 比的时候换了文件
+            return
+        document = self.markdownInput.document()
+        if document.revision() != revision or self.fileReader is not None:  # 比的时候又打了字，位置对不上，重新比
+            self.reloadFromDisk()
+            return
+        if document.isModified():
+            if self.reloadDeclined or self.askingReload:
+                return
+            self.askingReload = True
+            try:
+                answer = QMessageBox.question(
+                    self, "文件已在外部修改",
+                    f"{self.displayName()} 在外部被修改了，要载入新的内容吗？\n当前没保存的修改可以用撤销找回来。"
+                )
+            finally:
+                self.askingReload = False
+            if answer != QMessageBox.Yes:
+                self.reloadDeclined = True
+                return
+            if document.revision() != revision:
+                self.reloadFromDisk()
+                return
+        self.applyLineEdits(edits)
+        self.currentEncoding = encoding
+        document.setModified(False)
+        self.autoSaver.remember(self.currentFile, text)
+        self.journal.start(self.currentFile, text)  # 恢复日志从磁盘上的新内容重新记
+
+    def applyLineEdits(self, edits):  # [(起始行, 结束行, 新的行)]：从下往上换，整个一步撤销；视口顶上那一行不动
+        editor = self.markdownInput
+        document = editor.document()
+        layout = document.documentLayout()
+        scrollBar = editor.verticalScrollBar()
+        topLine = blockNumberAtY(document, scrollBar.value(), editor.textCursor().blockNumber())
+        offset = scrollBar.value() - layout.blockBoundingRect(document.findBlockByNumber(topLine)).top()
+        shift = sum(len(lines) - (end - start) for start, end, lines in edits if end <= topLine)
+
+        def position(line):
+            if line >= document.blockCount():
+                return document.characterCount() - 1
+            return document.findBlockByNumber(line).position()
+
+        mergeLines = max(self.reloadMergeLines, document.blockCount() // self.reloadMergeRatio)
+        clusters = []
+        for edit in edits:
+            if clusters and edit[0] - clusters[-1][-1][1] <= mergeLines:
+                clusters[-1].append(edit)
+            else:
+                clusters.append([edit])
+        if len(clusters) > self.reloadMaxSteps:
+            clusters = [edits]
+
+        cursor = QTextCursor(document)
+        for i, cluster in enumerate(reversed(clusters)):
+            # 每段各发一次contentsChange，高亮只重做改了的地方；撤销栈上并成一步
+            if i:
+                cursor.joinPreviousEditBlock()
+            else:
+                cursor.beginEditBlock()
+            for start, end, lines in reversed(cluster):
+                cursor.setPosition(position(start))
+                cursor.setPosition(position(end), QTextCursor.KeepAnchor)
+                cursor.insertText(''.join(lines))
+            cursor.endEditBlock()
+
+        if shift:
+            top = document.findBlockByNumber(max(0, min(topLine + shift, document.blockCount() - 1)))
+            scrollBar.setValue(round(layout.blockBoundingRect(top).top() + offset))
+
+    def exportHtml(self):  # 导出/打印用：预览是最新的就直接拼缓存里的块HTML；否则返回None，让导出线程自己渲染
+        blocks = self.blockCache.blocks
+        # 降级渲染的块也不要，导出总是完整质量
+        if self.stale or self.cacheEvicted or any(block.pending or block.level for block in blocks):
+            return None
+        return ''.join(block.html for block in blocks)
+
+    def goToLine(self, line):  # 大纲跳转：光标放到那一行并滚到顶上，预览跟着滚动同步走
+        editor = self.markdownInput
+        block = editor.document().findBlockByNumber(line)
+        if not block.isValid():
+            return
+        cursor = editor.textCursor()
+        cursor.setPosition(block.position())
+        editor.setTextCursor(cursor)
+        top = editor.document().documentLayout().blockBoundingRect(block).top()
+        editor.verticalScrollBar().setValue(round(top))
+        editor.setFocus()
+
+    def showRenderError(self, message):
+        html = f'<pre>渲染失败：{escape(message)}</pre>'
+        self.previewBrowser.applyBlocks([RenderedBlock('render-error', 0, 0, html)])
+
+    def previewBytes(self):
+        if self.previewEvicted:
+            return 0
+        return self.previewBrowser.document().characterCount() * PREVIEW_BYTES_PER_CHAR
+
+    def memoryBytes(self):
+        return self.previewBytes() + (0 if self.cacheEvicted else self.cacheBytes)
+
+    def evictPreview(self):  # 只清预览文档，块缓存留着；返回大概省下多少
+        freed = self.previewBytes()
+        if freed:
+            self.previewBrowser.clearBlocks()
+            self.previewEvicted = True
+        return freed
+
+    def evictCache(self, others):  # 块缓存和它独占的高亮结果也清掉，在渲染线程里清，不和正在跑的渲染抢
+        freed = self.evictPreview()
+        if self.cacheEvicted:
+            return freed
+        freed += self.cacheBytes
+        self.cacheEvicted = True
+        self.cacheBytes = 0
+        cache = self.blockCache
+        otherCaches = [tab.blockCache for tab in others]
+
+        def release():
+            from functions.Renderer import MarkdownRenderer
+            MarkdownRenderer.shared().releaseCache(cache, otherCaches)
+
+        self.renderScheduler.runInBackground(release)
+        return freed
+
+    def loadFile(self, filePath):  # 加载文件：编辑器不重建，先放第一块，剩下的分批追加
+        try:
+            reader = ChunkedReader(filePath)
+        except OSError:
+            return False
+        self.finishLoading(drain=False)
+        self.closeJournal()
+        self.fileReader = reader
+        self.setWatchedFile(filePath)
+        self.currentFile = filePath
+        self.reloadAfterLoading = False
+        self.reloadDeclined = False
+        self.previewBrowser.setBaseDir(self.baseDir())
+        self.currentEncoding = reader.encoding
+        if self.renderBudget.level != LEVEL_FULL:  # 换了文档，先按完整质量试
+            self.renderBudget.reset()
+            self.qualityChanged.emit()
+
+        # 载入期间只读，撤销栈也先关掉，不然追加的每一块都算一步撤销
+        self.markdownInput.document().setUndoRedoEnabled(False)
+        self.markdownInput.setReadOnly(True)
+        # 大文件只给视口附近上色，其它行空闲时再补，远处的不管
+        self.highlighter.setLazy(reader.size >= LAZY_THRESHOLD_BYTES)
+        self.markdownInput.setPlainText(reader.read(self.firstChunkBytes))
+        self.markdownInput.setFocus()
+        self.markdownInput.moveCursor(QTextCursor.Start)
+        self.stateChanged.emit()
+        self.loadTimer.start()
+        return True
+
+    def loadNextChunk(self):
+        reader = self.fileReader
+        if reader is None:
+            return
+        if not reader.atEnd():
+            cursor = QTextCursor(self.markdownInput.document())
+            cursor.movePosition(QTextCursor.End)
+            cursor.insertText(reader.read(self.loadChunkBytes))
+        if reader.atEnd():
+            self.finishLoading()
+        else:
+            self.stateChanged.emit()
+            self.loadTimer.start()
+
+    def finishLoading(self, drain=True):  # drain=False是被新打开的文件打断，剩下的不要了
+        reader = self.fileReader
+        if reader is None:
+            return
+        self.loadTimer.stop()
+        self.fileReader = None
+        if drain and not reader.atEnd():
+            cursor = QTextCursor(self.markdownInput.document())
+            cursor.movePosition(QTextCursor.End)
+            cursor.insertText(reader.readAll())
+        reader.close()
+        document = self.markdownInput.document()
+        document.setUndoRedoEnabled(True)
+        document.setModified(False)
+        self.markdownInput.setReadOnly(False)
+        self.stateChanged.emit()
+        if drain:
+            self.startJournal()
+            if self.reloadAfterLoading:
+                self.reloadAfterLoading = False
+                self.reloadFromDisk()
+
+    def saveToFile(self, filePath):  # 保存到文件，也是先写临时文件再替换
+        self.finishLoading()  # 还没载完就存的话先把剩下的读完，别把半个文件写回去
+        text = self.markdownInput.toPlainText()
+        try:
+            self.currentEncoding = self.autoSaver.saveNow(filePath, text, self.currentEncoding)
+        except OSError as e:
+            QMessageBox.warning(self, "保存失败", f"无法写入 {filePath}\n{e}")
+            return False
+        self.reloadDeclined = False
+        if filePath != self.currentFile or self.journal.key is None:
+            self.journal.discard()
+            self.setWatchedFile(filePath)
+            self.currentFile = filePath
+            self.previewBrowser.setBaseDir(self.baseDir())
+            self.journal.start(filePath, text)
+        else:
+            self.journal.commit(self.journal.checkpoint(text))
+        self.markdownInput.document().setModified(False)
+        self.stateChanged.emit()
+        return True
+
+    def setWatchedFile(self, filePath):  # 换文件时监视也跟着换
+        if self.fileWatcher is None or filePath == self.currentFile:
+            return
+        if self.currentFile:
+            self.fileWatcher.unwatch(self.currentFile)
+        if filePath:
+            self.fileWatcher.watch(filePath)
+
+    def autoSave(self):  # GUI线程只拷快照，写盘在工作线程
+        if self.fileReader is not None or not self.currentFile or not self.markdownInput.document().isModified():
+            return
+        text = self.markdownInput.toPlainText()
+        token = (self, self.journal.checkpoint(text), self.journal.editCount)
+        self.autoSaver.save(self.currentFile, text, self.currentEncoding, token)
+
+    def onAutoSaved(self, path, segment, editCount, encoding):
+        if path != self.currentFile:  # 保存途中换了文件
+            return
+        self.currentEncoding = encoding
+        self.journal.commit(segment)
+        if self.journal.editCount == editCount:  # 写盘期间没有新的编辑
+            self.markdownInput.document().setModified(False)
+
+    def startJournal(self):  # 载入完/新建时：有上次没保存的日志就问要不要恢复，然后从当前内容重新记
+        text = self.markdownInput.toPlainText()
+        if self.currentFile:
+            self.autoSaver.remember(self.currentFile, text)
+        recovered = self.journal.recover(self.currentFile, text)
+        self.journal.start(self.currentFile, text)
+        if recovered is not None and QMessageBox.question(
+                self, "恢复未保存的修改", f"{self.displayName()} 上次没有保存就关掉了，要恢复当时的修改吗？"
+        ) == QMessageBox.Yes:
+            cursor = QTextCursor(self.markdownInput.document())
+            cursor.select(QTextCursor.Document)
+            cursor.insertText(recovered)
+
+    def closeJournal(self):  # 都存好了就删日志，没存的留着下次恢复
+        if self.markdownInput.document().isModified():
+            self.journal.stop()
+        else:
+            self.journal.discard()
+
+    def shutdown(self):  # 关标签或者关窗口
+        self.finishLoading(drain=False)
+        self.closeJournal()
+        self.setWatchedFile(None)
+        self.renderScheduler.shutdown()
@@ -0,0 +1,90 @@
+# 打开文件用：猜编码、分块读、分块解码
+# 大文件不一次性读完解完，调用方每次取一块往编辑器里追加，第一屏马上就能出来
+# 不用mmap：读的途中文件被截短，访问映射会直接SIGBUS崩掉；Windows上映射着还会挡住别人写这个文件
+
+import codecs
+import os
+
+# 带BOM的文件用会自己处理BOM的编码名：解码时吃掉BOM（按它定大小端），保存时再写回去，存完还是带BOM的
+# utf-16/utf-32写的是本机字节序（小端），大端带BOM的文件存回去会变成小端带BOM，内容不变
+# UTF-32的BOM开头和UTF-16 LE一样，得先判断
+BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+FALLBACK_ENCODINGS = ('gb18030',)  # 不是UTF-8的中文文档多半是GBK，gb18030是它的超集
+SNIFF_BYTES = 64 * 1024
+
+
+def detectEncoding(head):  # 只看文件开头一段；返回的编码名保存时原样用
+    for bom, name in BOMS:
+        if head.startswith(bom):
+            return name
+    for name in ('utf-8',) + FALLBACK_ENCODINGS:
+        try:
+            # 开头这段可能正好截在多字节字符中间，用增量解码器不算错
+            codecs.getincrementaldecoder(name)().decode(head, final=False)
+        except UnicodeDecodeError:
+            continue
+        return name
+    return 'latin-1'  # 什么字节都能解，起码能打开
+
+
+def readText(path):  # 一次读完、解码，返回(文本, 编码)；监视到外部修改后在工作线程里重新读文件用
+    with open(path, 'rb') as f:
+        data = f.read()
+    encoding = detectEncoding(data[:SNIFF_BYTES])
+    text = str(data, encoding, 'replace')
+    return text.replace('\r\n', '\n').replace('\r', '\n'), encoding
+
+
+class ChunkedReader:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        # 只用来估进度和决定要不要懒高亮；读的途中文件变长变短，以实际读到文件尾为准
+        self.size = os.fstat(self.file.fileno()).st_size
+        head = self.file.read(SNIFF_BYTES)
+        self.encoding = detectEncoding(head)
+        self.position = 0
+        self.head = head  # 猜编码读出来的，还没解码
+        self.eof = len(head) < SNIFF_BYTES
+        self.decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+        self.carry = ''  # 块尾的\r先留着，可能和下一块开头的\n是一对
+
+    def atEnd(self):
+        return self.eof and not self.head and not self.carry
+
+    def progress(self):
+        return min(self.position / self.size, 1.0) if self.size else 1.0
+
+    def read(self, size=-1):  # 往后解码size字节（-1是读到底），换行统一成\n（和原来QFile.Text的效果一样）
+        chunk = self.head if size < 0 else self.head[:size]
+        self.head = self.head[len(chunk):]
+        if not self.eof and (size < 0 or len(chunk) < size):
+            want = -1 if size < 0 else size - len(chunk)
+            more = self.file.read(want)
+            self.eof = want < 0 or len(more) < want  # 读不满就是到文件尾了
+            chunk += more
+        self.position += len(chunk)
+        final = self.eof and not self.head
+        text = self.carry + self.decoder.decode(chunk, final=final)
+        self.carry = ''
+        if text.endswith('\r') and not final:
+            text, self.carry = text[:-1], '\r'
+        return text.replace('\r\n', '\n').replace('\r', '\n')
+
+    def readAll(self):
+        return self.read()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
+        return False
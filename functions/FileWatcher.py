@@ -0,0 +1,176 @@
+# 监视打开着的文件：生成器、git checkout在外面改了文件，按行比出改动，只把改了的几段换进编辑器
+# 不走loadFile整篇重建：光标、撤销历史、高亮和渲染的增量缓存都留着，重新载入本身也能一步撤销
+# 变动事件先防抖合并，一秒改几十次的文件也只隔一小会读一次；读文件、解码、比行都在工作线程里
+# 读文件是普通的一次性read，不走mmap：文件正被别人截短重写时读到一半也只是内容不全，下一次事件再读
+# 原子替换（写临时文件再rename）会让监视失效，每次事件后重新加上；文件暂时不在就隔一会再看
+
+import difflib
+import os
+import time
+
+from PySide6.QtCore import QFileSystemWatcher, QObject, QRunnable, QThreadPool, QTimer, Signal
+
+from functions.AutoSave import contentHash
+from functions.FileLoader import readText
+from functions.Tracer import tracer
+
+
+def splitLines(text):  # 按\n切，每行带着自己的换行；最后一行没有换行（可能是空串），和编辑器的QTextBlock一一对应
+    lines = text.split('\n')
+    return [line + '\n' for line in lines[:-1]] + lines[-1:]
+
+
+def lineDiff(oldText, newText):  # 返回[(起始行, 结束行, 新的行)]，旧文本[起始行, 结束行)换成新的行，按行号排好
+    oldLines, newLines = splitLines(oldText), splitLines(newText)
+    # 先去掉相同的头尾，一般只改了几处，SequenceMatcher只用看中间一段
+    limit = min(len(oldLines), len(newLines))
+    start = 0
+    while start < limit and oldLines[start] == newLines[start]:
+        start += 1
+    tail = 0
+    while tail < limit - start and oldLines[-1 - tail] == newLines[-1 - tail]:
+        tail += 1
+    oldMiddle = oldLines[start:len(oldLines) - tail]
+    newMiddle = newLines[start:len(newLines) - tail]
+    if not oldMiddle or not newMiddle:
+        return [(start, start + len(oldMiddle), newMiddle)] if oldMiddle or newMiddle else []
+    return [
+        (start + i1, start + i2, newMiddle[j1:j2])
+        for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, oldMiddle, newMiddle).get_opcodes()
+        if tag != 'equal'
+    ]
+
+
+class _ReloadSignals(QObject):
+    done = Signal(str, object, object, str, list)  # 路径, 令牌, 新文本（和已知内容一样或读不出是None）, 编码, 改动
+
+
+class _ReloadJob(QRunnable):
+    def __init__(self, saver, path, text, token, signals):
+        super().__init__()
+        self.saver = saver
+        self.path = path
+        self.text = text  # 编辑器内容的快照
+        self.token = token
+        self.signals = signals
+
+    def run(self):
+        newText, encoding, edits = None, '', []
+        try:
+            with tracer.span("watch.reload", chars=len(self.text)) as span:
+                text, encoding = readText(self.path)
+                # 和上次存的/读的一样：自己保存引起的事件，或者只是touch了一下，编辑器里没存的修改不能被冲掉
+                if text != self.text and contentHash(text) != self.saver.lastHash(self.path):
+                    newText = text
+                    edits = lineDiff(self.text, text)
+                span.set(hunks=len(edits))
+        except (OSError, ValueError):  # 读的时候文件又被删了/换了
+            newText = None
+        self.signals.done.emit(self.path, self.token, newText, encoding, edits)
+
+
+class FileWatcher(QObject):  # 整个窗口共用一个，路径都是绝对路径
+    fileChanged = Signal(str)  # 防抖之后才发，标签页收到了拿当前内容来比
+    reloadReady = Signal(str, object, str, str, list)  # 路径, 令牌, 新文本, 编码, 改动
+
+    debounceMs = 100  # 事件停了这么久才读
+    maxDelayMs = 500  # 一直在改也最多隔这么久读一次
+    missingRetryMs = 1000  # 文件暂时不在（checkout时先删后建），隔这么久再看
+
+    def __init__(self, autoSaver, parent=None):
+        super().__init__(parent)
+        self.autoSaver = autoSaver  # 拿上次存的/读的内容哈希，分辨是不是自己写的
+        self.enabled = True
+        self.paths = {}  # 路径 -> 有几个标签在看
+        self.pending = {}  # 路径 -> 这一轮第一次事件的时间
+        self.busy = set()  # 正在后台读的路径，一个路径同时只读一份
+        self.missing = set()
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self.onFileEvent)
+        self.flushTimer = QTimer(self)
+        self.flushTimer.setSingleShot(True)
+        self.flushTimer.timeout.connect(self.flush)
+        self.missingTimer = QTimer(self)
+        self.missingTimer.setInterval(self.missingRetryMs)
+        self.missingTimer.timeout.connect(self.checkMissing)
+
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.signals = _ReloadSignals()
+        self.signals.done.connect(self.onDone)
+
+    def setEnabled(self, enabled):  # 关掉期间的变动不追了，重新打开时也不补
+        self.enabled = enabled
+        self.pending.clear()
+        self.flushTimer.stop()
+
+    def watch(self, path):
+        path = os.path.abspath(path)
+        self.paths[path] = self.paths.get(path, 0) + 1
+        if path not in self.watcher.files() and not self.watcher.addPath(path):
+            self.markMissing(path)
+
+    def unwatch(self, path):
+        path = os.path.abspath(path)
+        count = self.paths.get(path, 0) - 1
+        if count > 0:
+            self.paths[path] = count
+            return
+        self.paths.pop(path, None)
+        self.pending.pop(path, None)
+        self.missing.discard(path)
+        if path in self.watcher.files():
+            self.watcher.removePath(path)
+
+    def onFileEvent(self, path):
+        if path not in self.paths or not self.enabled:
+            return
+        self.pending.setdefault(path, time.monotonic())
+        self.scheduleFlush()
+
+    def scheduleFlush(self):  # 每来一次事件重新计时，但不超过这一轮第一次事件后maxDelayMs
+        if not self.pending:
+            return
+        waited = (time.monotonic() - min(self.pending.values())) * 1000
+        self.flushTimer.start(max(0, min(self.debounceMs, round(self.maxDelayMs - waited))))
+
+    def flush(self):
+        for path in list(self.pending):
+            if path in self.busy:  # 上一次还没读完，读完再说
+                continue
+            del self.pending[path]
+            if path not in self.watcher.files() and not self.watcher.addPath(path):
+                self.markMissing(path)
+                continue
+            self.fileChanged.emit(path)
+
+    def markMissing(self, path):
+        self.missing.add(path)
+        if not self.missingTimer.isActive():
+            self.missingTimer.start()
+
+    def checkMissing(self):  # 文件回来了就重新监视，当成改了一次
+        for path in list(self.missing):
+            if os.path.exists(path) and self.watcher.addPath(path):
+                self.missing.discard(path)
+                self.onFileEvent(path)
+        if not self.missing:
+            self.missingTimer.stop()
+
+    def diff(self, path, text, token):  # text是编辑器内容的快照，改动按它算
+        path = os.path.abspath(path)
+        self.busy.add(path)
+        self.pool.start(_ReloadJob(self.autoSaver, path, text, token, self.signals))
+
+    def onDone(self, path, token, text, encoding, edits):
+        self.busy.discard(path)
+        if text is not None and path in self.paths:
+            self.reloadReady.emit(path, token, text, encoding, edits)
+        self.scheduleFlush()  # 读的时候又有事件进来
+
+    def shutdown(self):
+        self.flushTimer.stop()
+        self.missingTimer.stop()
+        self.pending.clear()
+        self.pool.waitForDone()
@@ -0,0 +1,351 @@
+# 查找/替换栏，挂在标签页下面，跟着当前标签的编辑器走
+# 查找在TextSearcher的后台线程里跑，结果分批回来；匹配位置存两个有序列表，上一个/下一个、算可见范围都是二分
+# 高亮只画视口里那几块的匹配（ExtraSelection），滚动时重算，几十万处匹配也不会拖慢编辑器
+# 编辑器内容一改，旧结果作废，防抖后在新快照上重新找
+
+import re
+from bisect import bisect_left, bisect_right
+
+from PySide6.QtCore import QObject, Qt, QTimer
+from PySide6.QtGui import QColor, QTextCharFormat, QTextCursor
+from PySide6.QtWidgets import (
+    QApplication, QCheckBox, QHBoxLayout, QLabel, QLineEdit, QPushButton, QTextEdit, QWidget
+)
+
+from functions.FindReplace import QtPositions, TextSearcher, compilePattern, expandReplacement
+from functions.SourceMap import blockNumberAtY
+
+FIND_BAR_QSS = """
+    QWidget {
+        background-color: #252526;
+        color: #cccccc;
+    }
+    QLineEdit {
+        background-color: #1e1e1e;
+        color: #ffffff;
+        border: 1px solid #3c3c3c;
+        padding: 3px;
+    }
+    QPushButton {
+        background-color: #333337;
+        border: none;
+        padding: 4px 8px;
+    }
+    QPushButton:hover {
+        background-color: #3e3e42;
+    }
+"""
+
+MAX_DECORATIONS = 2000  # 视口里一次最多标这么多处（一屏全是匹配时也就几百）
+
+
+class FindBar(QWidget):
+    searchDelayMs = 150  # 输入查找词/改文档之后停这么久才重新找
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setStyleSheet(FIND_BAR_QSS)
+        self.editor = None
+        self.connections = []
+        self.pattern = None
+        self.generation = 0
+        self.revision = -1  # 快照时文档的revision，全部替换前核对
+        self.starts = []  # 匹配的开始位置（Qt下标），有序
+        self.ends = []
+        self.currentIndex = -1
+        self.searching = False
+        self.limited = False
+        self.patternError = ''
+
+        self.matchFormat = QTextCharFormat()
+        self.matchFormat.setBackground(QColor("#613214"))
+        self.currentFormat = QTextCharFormat()
+        self.currentFormat.setBackground(QColor("#a8671f"))
+
+        self.searcher = TextSearcher(self)
+        self.searcher.matchesFound.connect(self.onMatchesFound)
+        self.searcher.searchFinished.connect(self.onSearchFinished)
+        self.searcher.replaceReady.connect(self.onReplaceReady)
+
+        self.searchTimer = QTimer(self)
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.setInterval(self.searchDelayMs)
+        self.searchTimer.timeout.connect(self.startSearch)
+
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(6, 4, 6, 4)
+        self.findInput = QLineEdit()
+        self.findInput.setPlaceholderText("查找")
+        self.findInput.textChanged.connect(self.scheduleSearch)
+        self.findInput.returnPressed.connect(self.onReturnPressed)
+        layout.addWidget(self.findInput, 2)
+        self.replaceInput = QLineEdit()
+        self.replaceInput.setPlaceholderText("替换为")
+        self.replaceInput.returnPressed.connect(self.replaceCurrent)
+        layout.addWidget(self.replaceInput, 2)
+        self.regexBox = QCheckBox("正则")
+        self.regexBox.toggled.connect(self.startSearch)
+        layout.addWidget(self.regexBox)
+        self.caseBox = QCheckBox("区分大小写")
+        self.caseBox.toggled.connect(self.startSearch)
+        layout.addWidget(self.caseBox)
+        for text, slot in (("上一个", self.findPrevious), ("下一个", self.findNext),
+                           ("替换", self.replaceCurrent), ("全部替换", self.replaceAll), ("×", self.closeBar)):
+            button = QPushButton(text)
+            button.setFocusPolicy(Qt.NoFocus)
+            button.clicked.connect(slot)
+            layout.addWidget(button)
+        self.countLabel = QLabel()
+        # 定宽：字数一变整条栏重新布局，编辑器跟着改大小，大文档会整篇重排
+        self.countLabel.setFixedWidth(110)
+        self.countLabel.setAlignment(Qt.AlignCenter)
+        layout.insertWidget(4, self.countLabel)
+
+    def setEditor(self, editor):  # 切标签页时换编辑器，旧编辑器上的标记清掉
+        if editor is self.editor:
+            return
+        for connection in self.connections:
+            try:
+                QObject.disconnect(connection)
+            except RuntimeError:  # 标签页已经关了
+                pass
+        self.connections = []
+        if self.editor is not None:
+            try:
+                self.editor.setExtraSelections([])
+            except RuntimeError:
+                pass
+        self.editor = editor
+        self.clearMatches()
+        if editor is None:
+            return
+        self.connections = [
+            editor.document().contentsChanged.connect(self.onDocumentChanged),
+            editor.verticalScrollBar().valueChanged.connect(self.refreshDecorations),
+        ]
+        if self.isVisible():
+            self.startSearch()
+
+    def showBar(self):
+        if self.editor is not None:
+            selected = self.editor.textCursor().selectedText()
+            if selected and '\u2029' not in selected:  # 选中了一行以内的文字就拿来当查找词
+                self.findInput.setText(selected)
+        self.show()
+        self.findInput.setFocus(Qt.ShortcutFocusReason)
+        self.findInput.selectAll()
+        self.startSearch()
+
+    def closeBar(self):
+        self.hide()
+        self.searchTimer.stop()
+        self.searcher.cancel()
+        self.clearMatches()
+        if self.editor is not None:
+            self.editor.setFocus()
+
+    def keyPressEvent(self, event):
+        if event.key() == Qt.Key_Escape:
+            self.closeBar()
+            return
+        super().keyPressEvent(event)
+
+    def scheduleSearch(self):
+        self.searchTimer.start()
+
+    def onDocumentChanged(self):
+        if self.isVisible() and self.findInput.text():
+            self.searchTimer.start()
+
+    def clearMatches(self):
+        self.starts = []
+        self.ends = []
+        self.currentIndex = -1
+        self.limited = False
+        self.refreshDecorations()
+        self.updateCountLabel()
+
+    def currentPattern(self):  # 正则写错了在计数那里提示，返回None
+        self.patternError = ''
+        query = self.findInput.text()
+        if not query:
+            return None
+        try:
+            return compilePattern(query, self.regexBox.isChecked(), self.caseBox.isChecked())
+        except re.error as e:
+            self.patternError = e.msg
+            return None
+
+    def startSearch(self):
+        self.searchTimer.stop()
+        self.searcher.cancel()
+        self.searching = False
+        if self.editor is None or not self.isVisible():
+            self.clearMatches()
+            return
+        self.pattern = self.currentPattern()
+        if self.pattern is None:
+            self.clearMatches()
+            return
+        # 旧的标记先留着（ExtraSelection的光标会跟着编辑挪），新结果回来再换，免得每次输入都闪一下
+        self.starts = []
+        self.ends = []
+        self.currentIndex = -1
+        self.limited = False
+        self.revision = self.editor.document().revision()
+        self.generation = self.searcher.search(self.editor.toPlainText(), self.pattern)
+        self.searching = True
+        self.updateCountLabel()
+
+    def onMatchesFound(self, generation, batch):
+        if generation != self.generation:
+            return
+        firstNew = len(self.starts)
+        self.starts.extend(start for start, _end in batch)
+        self.ends.extend(end for _start, end in batch)
+        if self.currentIndex < 0:
+            self.currentIndex = self.matchAfter(self.editor.textCursor().selectionStart(), firstNew)
+        self.refreshDecorations()
+        self.updateCountLabel()
+
+    def onSearchFinished(self, generation, _count, limited):
+        if generation != self.generation:
+            return
+        self.searching = False
+        self.limited = limited
+        if not self.starts:
+            self.refreshDecorations()
+        self.updateCountLabel()
+
+    def matchAfter(self, position, lowest=0):  # 光标之后的第一处，没有返回-1（等下一批）
+        index = bisect_left(self.starts, position, lowest)
+        return index if index < len(self.starts) else -1
+
+    def updateCountLabel(self):
+        total = len(self.starts)
+        self.countLabel.setToolTip(self.patternError)
+        if self.patternError:
+            text = "正则有误"
+        elif self.searching and not total:
+            text = "查找中…"
+        elif not total:
+            text = "无结果" if self.findInput.text() else ""
+        else:
+            suffix = "+" if self.limited or self.searching else ""
+            current = self.currentIndex + 1 if self.currentIndex >= 0 else "?"
+            text = f"{current}/{total}{suffix}"
+        self.countLabel.setText(text)
+
+    def onReturnPressed(self):
+        if QApplication.keyboardModifiers() & Qt.ShiftModifier:
+            self.findPrevious()
+        else:
+            self.findNext()
+
+    def findNext(self):
+        if not self.starts:
+            return
+        index = self.matchAfter(self.editor.textCursor().selectionEnd())
+        self.selectMatch(index if index >= 0 else 0)
+
+    def findPrevious(self):
+        if not self.starts:
+            return
+        index = bisect_left(self.starts, self.editor.textCursor().selectionStart()) - 1
+        self.selectMatch(index if index >= 0 else len(self.starts) - 1)
+
+    def selectMatch(self, index):
+        cursor = self.editor.textCursor()
+        cursor.setPosition(self.starts[index])
+        cursor.setPosition(self.ends[index], QTextCursor.KeepAnchor)
+        self.currentIndex = index
+        self.editor.setTextCursor(cursor)  # 会滚过去，预览跟着滚动同步走
+        self.refreshDecorations()
+        self.updateCountLabel()
+
+    def refreshDecorations(self):  # 只给视口里的块标匹配
+        editor = self.editor
+        if editor is None:
+            return
+        if not self.starts or not self.isVisible():
+            editor.setExtraSelections([])
+            return
+        document = editor.document()
+        top = editor.verticalScrollBar().value()
+        hint = editor.textCursor().blockNumber()  # 光标一般在视口里，从它附近找，大文件不用整篇排版
+        firstNumber = blockNumberAtY(document, top, hint)
+        firstBlock = document.findBlockByNumber(firstNumber)
+        lastBlock = document.findBlockByNumber(blockNumberAtY(document, top + editor.viewport().height(), firstNumber))
+        first = bisect_right(self.ends, firstBlock.position())
+        last = min(bisect_left(self.starts, lastBlock.position() + lastBlock.length()), first + MAX_DECORATIONS)
+        selections = []
+        for index in range(first, last):
+            selection = QTextEdit.ExtraSelection()
+            selection.cursor = QTextCursor(document)
+            selection.cursor.setPosition(self.starts[index])
+            selection.cursor.setPosition(self.ends[index], QTextCursor.KeepAnchor)
+            selection.format = self.currentFormat if index == self.currentIndex else self.matchFormat
+            selections.append(selection)
+        editor.setExtraSelections(selections)
+
+    def replaceCurrent(self):
+        if self.editor is None or self.pattern is None:
+            return
+        cursor = self.editor.textCursor()
+        index = self.currentIndex
+        if (not cursor.hasSelection() or index < 0
+                or (cursor.selectionStart(), cursor.selectionEnd()) != (self.starts[index], self.ends[index])):
+            self.findNext()  # 还没选中匹配：先跳到下一处，再按一次才替换
+            return
+        # 在整篇文本上从这处的开头重新匹配，不能只拿选中的文字：前后断言、^/$、\b都要看匹配外面的字符
+        text = self.editor.toPlainText()
+        positions = QtPositions(text)
+        match = self.pattern.match(text, positions.toPython(self.starts[index]))
+        if match is None or positions(match.end()) != self.ends[index]:
+            self.findNext()
+            return
+        replacement = expandReplacement(match, self.replaceInput.text(), self.regexBox.isChecked())
+        delta = len(replacement.encode('utf-16-le')) // 2 - (self.ends[index] - self.starts[index])
+        cursor.insertText(replacement)
+        # 重新查找之前先把后面的位置挪好，连按替换不用等后台
+        self.starts = self.starts[:index] + [start + delta for start in self.starts[index + 1:]]
+        self.ends = self.ends[:index] + [end + delta for end in self.ends[index + 1:]]
+        self.currentIndex = -1
+        if self.starts:
+            self.selectMatch(index if index < len(self.starts) else 0)
+        else:
+            self.refreshDecorations()
+            self.updateCountLabel()
+
+    def replaceAll(self):
+        if self.editor is None:
+            return
+        self.searchTimer.stop()
+        self.pattern = self.currentPattern()
+        if self.pattern is None:
+            self.updateCountLabel()
+            return
+        self.revision = self.editor.document().revision()
+        self.generation = self.searcher.prepareReplace(
+            self.editor.toPlainText(), self.pattern, self.replaceInput.text(), self.regexBox.isChecked()
+        )
+        self.searching = False
+        self.countLabel.setText("替换中…")
+
+    def onReplaceReady(self, generation, edits):
+        if generation != self.generation or self.editor is None:
+            return
+        if self.editor.document().revision() != self.revision:  # 算的时候文档又改了，位置对不上
+            self.countLabel.setText("文档已改动")
+            return
+        if edits:
+            # 一个编辑块：撤销一步回去，contentsChange/textChanged只发一次，高亮和渲染各走一遍
+            cursor = QTextCursor(self.editor.document())
+            cursor.beginEditBlock()
+            for start, end, replacement in reversed(edits):
+                cursor.setPosition(start)
+                cursor.setPosition(end, QTextCursor.KeepAnchor)
+                cursor.insertText(replacement)
+            cursor.endEditBlock()
+        self.startSearch()
+        self.countLabel.setText(f"已替换 {len(edits)} 处")
@@ -0,0 +1,138 @@
+# 查找/替换的后台部分：在文本快照上跑正则，匹配位置分批发回GUI线程
+# 位置一律换算成Qt的UTF-16下标（emoji之类的星际字符在Python里算1个、Qt里算2个），GUI那边直接拿去设光标
+# 全部替换也在后台算好每处的替换文字，GUI线程只在一个编辑块里改，撤销一步回去，高亮和渲染各只触发一次
+
+import re
+import threading
+from bisect import bisect_left
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+
+from functions.Highlighter import ASTRAL
+from functions.Tracer import tracer
+
+MATCH_BATCH = 2000  # 攒够这么多处发一次
+MATCH_LIMIT = 200000  # 再多就不找了，界面上显示"N+"
+
+
+def compilePattern(query, regex=False, caseSensitive=False):  # 正则写错了抛re.error，调用方显示出来
+    flags = re.MULTILINE
+    if not caseSensitive:
+        flags |= re.IGNORECASE
+    return re.compile(query if regex else re.escape(query), flags)
+
+
+class QtPositions:  # Python下标 -> Qt下标，没有星际字符时原样返回
+    def __init__(self, text):
+        self.astral = [m.start() for m in ASTRAL.finditer(text)] if not text.isascii() else []
+        self.qtAstral = [index + i for i, index in enumerate(self.astral)]  # 星际字符在Qt里的下标
+
+    def __call__(self, index):
+        if not self.astral:
+            return index
+        return index + bisect_left(self.astral, index)
+
+    def toPython(self, qtIndex):  # 反过来：Qt下标 -> Python下标
+        if not self.astral:
+            return qtIndex
+        return qtIndex - bisect_left(self.qtAstral, qtIndex)
+
+
+def expandReplacement(match, template, regex):
+    return match.expand(template) if regex else template
+
+
+class _SearchSignals(QObject):
+    matchesFound = Signal(int, list)  # 第几次查找, [(开始, 结束)]
+    searchFinished = Signal(int, int, bool)  # 第几次查找, 一共几处, 是否到了上限
+    replaceReady = Signal(int, list)  # 第几次查找, [(开始, 结束, 替换文字)]，按位置排好
+
+
+class _SearchJob(QRunnable):
+    def __init__(self, generation, text, pattern, signals, cancelEvent, template=None, regex=False):
+        super().__init__()
+        self.generation = generation
+        self.text = text
+        self.pattern = pattern
+        self.signals = signals
+        self.cancelEvent = cancelEvent
+        self.template = template  # None是查找，否则是全部替换
+        self.regex = regex
+
+    def run(self):
+        with tracer.span("find.search", chars=len(self.text), replace=self.template is not None):
+            if self.template is None:
+                self.search()
+            else:
+                self.prepareReplace()
+
+    def search(self):
+        toQt = QtPositions(self.text)
+        batch = []
+        count = 0
+        for match in self.pattern.finditer(self.text):
+            start, end = match.span()
+            if start == end:  # 空匹配（^、a*之类）没东西可标，跳过
+                continue
+            batch.append((toQt(start), toQt(end)))
+            count += 1
+            if len(batch) >= MATCH_BATCH or count >= MATCH_LIMIT:
+                if self.cancelEvent.is_set():
+                    return
+                self.signals.matchesFound.emit(self.generation, batch)
+                batch = []
+                if count >= MATCH_LIMIT:
+                    break
+        if self.cancelEvent.is_set():
+            return
+        if batch:
+            self.signals.matchesFound.emit(self.generation, batch)
+        self.signals.searchFinished.emit(self.generation, count, count >= MATCH_LIMIT)
+
+    def prepareReplace(self):  # 和re.sub一样，空匹配也替换（正则^可以给每行加前缀）
+        toQt = QtPositions(self.text)
+        edits = []
+        for i, match in enumerate(self.pattern.finditer(self.text)):
+            if i % 4096 == 0 and self.cancelEvent.is_set():
+                return
+            start, end = match.span()
+            edits.append((toQt(start), toQt(end), expandReplacement(match, self.template, self.regex)))
+        if not self.cancelEvent.is_set():
+            self.signals.replaceReady.emit(self.generation, edits)
+
+
+class TextSearcher(QObject):
+    matchesFound = Signal(int, list)
+    searchFinished = Signal(int, int, bool)
+    replaceReady = Signal(int, list)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.signals = _SearchSignals()
+        self.signals.matchesFound.connect(self.matchesFound)
+        self.signals.searchFinished.connect(self.searchFinished)
+        self.signals.replaceReady.connect(self.replaceReady)
+        self.generation = 0  # 每次新查找加一，旧查找晚到的结果按这个丢掉
+        self.cancelEvent = threading.Event()
+
+    def search(self, text, pattern):
+        return self.start(text, pattern)
+
+    def prepareReplace(self, text, pattern, template, regex):
+        return self.start(text, pattern, template, regex)
+
+    def start(self, text, pattern, template=None, regex=False):
+        self.cancel()
+        self.generation += 1
+        self.cancelEvent = threading.Event()
+        self.pool.start(_SearchJob(self.generation, text, pattern, self.signals, self.cancelEvent, template, regex))
+        return self.generation
+
+    def cancel(self):
+        self.cancelEvent.set()
+
+    def shutdown(self):
+        self.cancel()
+        self.pool.waitForDone()
@@ -0,0 +1,88 @@
+# 代码高亮结果的LRU缓存
+# 大段代码/日志在两次按键之间基本不变，没必要每次都让pygments重新跑一遍
+
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+
+class HighlightCache:
+    DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+    def __init__(self, maxBytes=DEFAULT_MAX_BYTES):
+        self.maxBytes = maxBytes
+        self._entries = OrderedDict()  # key -> (html, 占用字节)
+        self._bytes = 0
+        self._lock = threading.Lock()  # 渲染线程和后台高亮线程都会碰
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def makeKey(lang, code, formatterKey):  # (语言, 代码哈希, formatter参数)
+        digest = hashlib.blake2b(code.encode('utf-8'), digest_size=16).digest()
+        return lang, digest, formatterKey
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, html):
+        size = sys.getsizeof(html)
+        if size > self.maxBytes:  # 一条就超预算的不存，存了也会马上被挤掉
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (html, size)
+            self._bytes += size
+            self._evict()
+
+    def discard(self, keys):  # 某个文档不要了，它独占的高亮结果先扔，不用等LRU慢慢挤
+        with self._lock:
+            for key in keys:
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self._bytes -= entry[1]
+
+    def setMaxBytes(self, maxBytes):
+        with self._lock:
+            self.maxBytes = maxBytes
+            self._evict()
+
+    def _evict(self):
+        while self._bytes > self.maxBytes and self._entries:
+            _key, (_html, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'maxBytes': self.maxBytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def __len__(self):
+        return len(self._entries)
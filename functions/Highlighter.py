@@ -1,19 +1,192 @@
-# MD语法高亮，存在很多神奇的bug，暂时修不了
+# MD语法高亮
+# 每行只扫一遍：行首结构（标题/引用/列表）先判断，行内的东西用一个合并的正则一次扫完
+# 围栏代码和HTML块要跨行，靠setCurrentBlockState记状态，状态没变Qt就不会继续往下重刷
+# 大文件用懒模式：视口附近的行才真正上色，其它行只算跨行状态，记进待上色的集合；
+# 滚动时先补视口里的，空闲时再从视口往外一片一片地补，离得太远的就不管了
+# 补色不走rehighlightBlock：编辑器排过版以后每改一行的格式Qt都要把整篇重排一遍（10MB要两三百毫秒），
+# 所以一片里的行直接设到QTextLayout上，最后整片只标一次脏
 
-from PySide6.QtCore import QRegularExpression
+import re
+
+from PySide6.QtCore import QEvent, QTimer
 from PySide6.QtGui import (
-    QFont, QTextCharFormat, QSyntaxHighlighter, QColor
+    QFont, QTextCharFormat, QTextLayout, QSyntaxHighlighter, QColor
 )
 
+from functions.SourceMap import blockNumberAtY
+
+# 块状态：低8位是种类，围栏代码再把围栏长度塞到高位
+STATE_NORMAL = 0
+STATE_HTML_BLOCK = 1  # HTML块，到空行结束
+STATE_HTML_COMMENT = 2  # <!-- ... -->，到-->结束
+STATE_FENCE_BACKTICK = 3
+STATE_FENCE_TILDE = 4
+
+LAZY_THRESHOLD_BYTES = 2 * 1024 * 1024  # 文件超过这么大就用懒模式
+
+FENCE_OPEN = re.compile(r' {0,3}(`{3,}|~{3,})(.*)$')
+HEADING = re.compile(r' {0,3}#{1,6}(?:\s|$)')
+BLOCKQUOTE = re.compile(r' {0,3}>')
+LIST_MARKER = re.compile(r'\s*(?:[*+-]|\d+[.)])\s')
+HTML_BLOCK_START = re.compile(
+    r' {0,3}</?(?:address|article|aside|blockquote|center|details|dialog|div|dl|fieldset|figure|footer|form|'
+    r'h[1-6]|header|hr|iframe|li|main|nav|ol|p|pre|section|summary|table|tbody|td|tfoot|th|thead|tr|ul)'
+    r'(?:\s|/?>|$)',
+    re.IGNORECASE
+)
+ASTRAL = re.compile('[\U00010000-\U0010FFFF]')
+
+# 行内元素合并成一个正则，靠前的分支优先（行内代码里的东西不再被当成强调）
+INLINE = re.compile(
+    r'(?P<inlineCode>`[^`]+`)'
+    r'|(?P<image>!\[[^\]]+\]\([^)]+\))'
+    r'|(?P<link>\[[^\]]+\]\([^)]+\))'
+    r'|(?P<emphasis>\*\*[^*]+\*\*|__[^_]+__)'
+    r'|(?P<italic>\*[^*]+\*|(?<!\w)_[^_]+_(?!\w))'
+    r'|(?P<html><[^>]+>)'
+)
+
+
+def formatRanges(spans):
+    # formatLine的结果转成QTextLayout.FormatRange；和setFormat一样后面的整个盖掉前面的，不是叠加
+    if len(spans) <= 1:
+        runs = [(start, length, fmt) for start, length, fmt in spans if length > 0]
+    else:  # 有重叠的按字符摊开再合并成段，一行就几十个字符
+        owners = [None] * max(start + length for start, length, _fmt in spans)
+        for start, length, fmt in spans:
+            owners[start:start + length] = [fmt] * length
+        runs = []
+        index = 0
+        while index < len(owners):
+            fmt = owners[index]
+            end = index + 1
+            while end < len(owners) and owners[end] is fmt:
+                end += 1
+            if fmt is not None:
+                runs.append((index, end - index, fmt))
+            index = end
+    ranges = []
+    for start, length, fmt in runs:
+        formatRange = QTextLayout.FormatRange()
+        formatRange.start = start
+        formatRange.length = length
+        formatRange.format = fmt
+        ranges.append(formatRange)
+    return ranges
+
 
 class MarkdownHighlighter(QSyntaxHighlighter):
+    viewportMargin = 100  # 视口上下各多带这么多行，一起上色，小幅滚动不会看到没上色的行
+    idleRadius = 5000  # 空闲时只补视口上下这么多行以内的
+    idleSlice = 1000  # 每轮空闲补这么多行，补完一片回事件循环；一片只重排一次，片太小反而慢
 
     def __init__(self, document):
         super().__init__(document)
-        self.highlightingRules = []
-        self.initHighlightRules()
+        self.formats = {}
+        self.initFormats()
+
+        self.lazy = False
+        self.editor = None
+        self.formatRange = (0, -1)  # 懒模式下直接上色的行号范围（视口加边距）
+        # 只算了状态、还没上色的行，存QTextBlock.fragmentIndex()（块在就不变）
+        # 不能塞进块状态里：状态一变Qt就会接着往下重刷，补一行色会把后面已经上好色的行冲掉
+        self.pendingBlocks = set()
+        self.idleTimer = QTimer(self)
+        self.idleTimer.setSingleShot(True)
+        self.idleTimer.setInterval(0)
+        self.idleTimer.timeout.connect(self.highlightIdleSlice)
+        self.viewportTimer = QTimer(self)
+        self.viewportTimer.setSingleShot(True)
+        self.viewportTimer.setInterval(0)
+        self.viewportTimer.timeout.connect(self.highlightViewport)
+
+    def attachEditor(self, editor):  # 懒模式要知道视口在哪
+        self.editor = editor
+        editor.verticalScrollBar().valueChanged.connect(self.onScrolled)
+        editor.viewport().installEventFilter(self)
+
+    def onScrolled(self, _value):  # 连着滚几下只补一次
+        if self.lazy:
+            self.viewportTimer.start()
+
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Resize and self.lazy:
+            self.viewportTimer.start()
+        return False
+
+    def setLazy(self, lazy):  # 在setPlainText之前调，按文件大小决定；新文本整篇都会重刷，旧的待上色记录作废
+        self.idleTimer.stop()
+        self.viewportTimer.stop()
+        self.pendingBlocks.clear()
+        self.lazy = lazy
+        if lazy:  # 新文件从头显示，先按开头一屏算；滚动条不一定会动，载入后主动补一次
+            self.formatRange = (0, self.viewportMargin * 2)
+            self.viewportTimer.start()
+
+    def updateFormatRange(self):
+        editor = self.editor
+        document = self.document()
+        if editor is None or document is None:
+            return
+        top = editor.verticalScrollBar().value()
+        first = blockNumberAtY(document, top, self.formatRange[0] + self.viewportMargin)
+        last = blockNumberAtY(document, top + editor.viewport().height(), first)
+        self.formatRange = (first - self.viewportMargin, last + self.viewportMargin)
+
+    def highlightViewport(self):  # 视口附近还没上色的行马上补，再让空闲时接着往外补
+        if not self.lazy:
+            return
+        self.updateFormatRange()
+        first, last = self.formatRange
+        document = self.document()
+        pending = self.pendingBlocks
+        blocks = []
+        block = document.findBlockByNumber(max(0, first))
+        number = max(0, first)
+        while block.isValid() and number <= last and pending:
+            if block.fragmentIndex() in pending:
+                blocks.append(block)
+            block = block.next()
+            number += 1
+        self.formatBlocks(blocks)
+        if pending:
+            self.idleTimer.start()
 
-    def initHighlightRules(self):
+    def highlightIdleSlice(self):  # 从视口往下、再往上找待上色的行，一次最多idleSlice行
+        if not self.lazy:
+            return
+        first, last = self.formatRange
+        document = self.document()
+        pending = self.pendingBlocks
+        blocks = []
+        ranges = ((max(0, last + 1), min(document.blockCount(), last + 1 + self.idleRadius), 1),
+                  (max(0, first - 1), max(-1, first - 1 - self.idleRadius), -1))
+        for start, stop, step in ranges:
+            block = document.findBlockByNumber(start)
+            number = start
+            while len(blocks) < self.idleSlice and block.isValid() and number != stop:
+                if block.fragmentIndex() in pending:
+                    blocks.append(block)
+                block = block.next() if step > 0 else block.previous()
+                number += step
+        self.formatBlocks(blocks)
+        if len(blocks) >= self.idleSlice:  # 这一片用完了额度，可能还有没补的，下一轮接着来
+            self.idleTimer.start()
+
+    def formatBlocks(self, blocks):  # 给待上色的行补格式，跨行状态上次已经算好存在块里了
+        if not blocks:
+            return
+        pending = self.pendingBlocks
+        start = end = blocks[0].position()
+        for block in blocks:
+            spans, _state = self.formatLine(block.text(), block.previous().userState())
+            block.layout().setFormats(formatRanges(spans))
+            pending.discard(block.fragmentIndex())
+            start = min(start, block.position())
+            end = max(end, block.position() + block.length())
+        self.document().markContentsDirty(start, end - start)
+
+    def initFormats(self):
         # 颜色配置
         colors = {
             'heading': QColor("#569cd6"),
@@ -28,108 +201,136 @@ class MarkdownHighlighter(QSyntaxHighlighter):
             'html': QColor("#d7ba7d")
         }
 
-        # 标题规则
         headerFormat = QTextCharFormat()
         headerFormat.setForeground(colors['heading'])
         headerFormat.setFontWeight(QFont.Bold)
-        for level in range(1, 7):
-            pattern = QRegularExpression(f"^#{{{level}}}\\s.*")
-            self.highlightingRules.append((pattern, headerFormat))
+        self.formats['heading'] = headerFormat
 
-        # 引用规则 - 修改后的版本
         blockquoteFormat = QTextCharFormat()
         blockquoteFormat.setForeground(colors['quote'])
-        # 修改正则表达式以匹配任意数量的>符号
-        self.highlightingRules.append((
-            QRegularExpression("^>+\\s.*"),  # 匹配1个或多个>开头的行
-            blockquoteFormat
-        ))
+        self.formats['blockquote'] = blockquoteFormat
 
-        # 代码块
         codeBlockFormat = QTextCharFormat()
         codeBlockFormat.setForeground(colors['codeText'])
         codeBlockFormat.setBackground(colors['codeBg'])
-        self.highlightingRules.append((
-            QRegularExpression("```[\\s\\S]*?```|~~~[\\s\\S]*?~~~"),
-            codeBlockFormat
-        ))
+        self.formats['codeBlock'] = codeBlockFormat
 
-        # 行内代码
         inlineCodeFormat = QTextCharFormat()
         inlineCodeFormat.setForeground(colors['codeText'])
         inlineCodeFormat.setBackground(colors['codeBg'])
-        self.highlightingRules.append((
-            QRegularExpression("`[^`]+`"),
-            inlineCodeFormat
-        ))
+        self.formats['inlineCode'] = inlineCodeFormat
 
-        # 强调文本
         emphasisFormat = QTextCharFormat()
         emphasisFormat.setFontWeight(QFont.Bold)
         emphasisFormat.setForeground(colors['emphasis'])
-        self.highlightingRules.append((
-            QRegularExpression("\\*\\*[^\\*]+\\*\\*|__[^_]+__"),
-            emphasisFormat
-        ))
+        self.formats['emphasis'] = emphasisFormat
 
-        # 斜体文本
         italicFormat = QTextCharFormat()
         italicFormat.setFontItalic(True)
         italicFormat.setForeground(colors['italic'])
-        self.highlightingRules.append((
-            QRegularExpression("\\*[^\\*]+\\*|_[^_]+_"),
-            italicFormat
-        ))
+        self.formats['italic'] = italicFormat
 
-        # 链接
         linkFormat = QTextCharFormat()
         linkFormat.setForeground(colors['link'])
         linkFormat.setFontUnderline(True)
-        self.highlightingRules.append((
-            QRegularExpression("\\[[^\\]]+\\]\\([^\\)]+\\)"),
-            linkFormat
-        ))
+        self.formats['link'] = linkFormat
 
-        # 图片
         imageFormat = QTextCharFormat()
         imageFormat.setForeground(colors['image'])
-        self.highlightingRules.append((
-            QRegularExpression("!\\[[^\\]]+\\]\\([^\\)]+\\)"),
-            imageFormat
-        ))
+        self.formats['image'] = imageFormat
 
-        # 列表
         listFormat = QTextCharFormat()
         listFormat.setForeground(colors['list'])
-        self.highlightingRules.append((
-            QRegularExpression("^[\\*\\+-]\\s|^\\d+\\.\\s"),
-            listFormat
-        ))
-
-        # 引用
-        blockquoteFormat = QTextCharFormat()
-        blockquoteFormat.setForeground(colors['quote'])
-        self.highlightingRules.append((
-            QRegularExpression("^>\\s.*"),
-            blockquoteFormat
-        ))
+        self.formats['list'] = listFormat
 
-        # HTML标签
         htmlFormat = QTextCharFormat()
         htmlFormat.setForeground(colors['html'])
-        self.highlightingRules.append((
-            QRegularExpression("<[^>]+>"),
-            htmlFormat
-        ))
-
-    def highlightBlock(self, text): #高亮文本块
-        for pattern, fmt in self.highlightingRules:
-            matchIterator = pattern.globalMatch(text)
-            while matchIterator.hasNext():
-                match = matchIterator.next()
-                self.setFormat(
-                    match.capturedStart(),
-                    match.capturedLength(),
-                    fmt
-                )
-# 从头到尾我也不知道我写了多大的一坨语法分析器
+        self.formats['html'] = htmlFormat
+
+    def highlightBlock(self, text):  # 高亮文本块
+        previousState = self.previousBlockState()
+        if self.lazy:
+            block = self.currentBlock()
+            if not self.shouldFormat(block.blockNumber()):
+                # 只算跨行状态，下一行（围栏、HTML块）照样对；等滚到附近再上色
+                _spans, state = self.formatLine(text, previousState, stateOnly=True)
+                self.setCurrentBlockState(state)
+                self.pendingBlocks.add(block.fragmentIndex())
+                return
+            self.pendingBlocks.discard(block.fragmentIndex())
+        spans, state = self.formatLine(text, previousState)
+        for start, length, fmt in spans:
+            self.setFormat(start, length, fmt)
+        self.setCurrentBlockState(state)
+
+    def shouldFormat(self, number):
+        first, last = self.formatRange
+        return first <= number <= last
+
+    def formatLine(self, text, previousState, stateOnly=False):
+        # 算一行的格式，返回([(起点, 长度, 格式)], 行尾状态)，位置按UTF-16算（和Qt一致）
+        # stateOnly只要行尾状态，普通行的行内正则就不跑了
+        if previousState < 0:
+            previousState = STATE_NORMAL
+        kind = previousState & 0xff
+        length = self.qtLength(text)
+
+        # 围栏代码里面：整行都是代码，直到遇到同种且不短于开头的围栏
+        if kind in (STATE_FENCE_BACKTICK, STATE_FENCE_TILDE):
+            fenceLength = previousState >> 8
+            fenceChar = '`' if kind == STATE_FENCE_BACKTICK else '~'
+            stripped = text.strip()
+            if len(stripped) >= fenceLength and stripped == fenceChar * len(stripped) and len(text) - len(text.lstrip(' ')) < 4:
+                previousState = STATE_NORMAL
+            return [(0, length, self.formats['codeBlock'])], previousState
+
+        if kind == STATE_HTML_COMMENT:
+            end = text.find('-->')
+            if end < 0:
+                return [(0, length, self.formats['html'])], STATE_HTML_COMMENT
+            return [(0, self.qtLength(text[:end + 3]), self.formats['html'])], STATE_NORMAL
+
+        if kind == STATE_HTML_BLOCK:
+            if not text.strip():
+                return [], STATE_NORMAL
+            return [(0, length, self.formats['html'])], STATE_HTML_BLOCK
+
+        fence = FENCE_OPEN.match(text)
+        if fence and not (fence.group(1)[0] == '`' and '`' in fence.group(2)):
+            marker = fence.group(1)
+            kind = STATE_FENCE_BACKTICK if marker[0] == '`' else STATE_FENCE_TILDE
+            return [(0, length, self.formats['codeBlock'])], kind | (len(marker) << 8)
+
+        stripped = text.lstrip(' ')
+        if stripped.startswith('<!--') and '-->' not in stripped[4:]:
+            return [(0, length, self.formats['html'])], STATE_HTML_COMMENT
+        if HTML_BLOCK_START.match(text):
+            return [(0, length, self.formats['html'])], STATE_HTML_BLOCK
+
+        if stateOnly:
+            return [], STATE_NORMAL
+        spans = []
+        # 行首结构，整行先上色，行内格式再盖上去
+        if HEADING.match(text):
+            spans.append((0, length, self.formats['heading']))
+        elif BLOCKQUOTE.match(text):
+            spans.append((0, length, self.formats['blockquote']))
+        else:
+            marker = LIST_MARKER.match(text)
+            if marker:
+                spans.append((0, marker.end(), self.formats['list']))
+
+        astral = ASTRAL.search(text) is not None
+        for match in INLINE.finditer(text):
+            start, end = match.span()
+            if astral:  # 有emoji之类的，Python下标和Qt的UTF-16下标对不上，得换算
+                start, end = self.qtLength(text[:start]), self.qtLength(text[:end])
+            spans.append((start, end - start, self.formats[match.lastgroup]))
+
+        return spans, STATE_NORMAL
+
+    @staticmethod
+    def qtLength(text):
+        if text.isascii():
+            return len(text)
+        return len(text) + len(ASTRAL.findall(text))
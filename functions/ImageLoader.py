@@ -0,0 +1,215 @@
+# 预览里的本地图片：后台线程解码并缩到预览宽度，解好的缩略图放内存LRU，可选再落一份到磁盘
+# Qt富文本自己加载图片是在GUI线程里按原尺寸解码的，截图多的文档每次重排都要解几十MB的PNG；
+# 这里GUI线程只读文件头拿尺寸，先给一张一样大的占位图把位置占住，真图解好了直接换上，版面不会跳
+# 磁盘缓存按 路径+修改时间+文件大小+缩放尺寸 取名，原图改了自然就对不上；总大小超了从最老的删
+
+import hashlib
+import os
+from collections import OrderedDict
+
+from PySide6.QtCore import QObject, QRunnable, QSize, QThreadPool, Qt, Signal
+from PySide6.QtGui import QColor, QImage, QImageIOHandler, QImageReader
+
+from functions.Tracer import tracer
+
+THUMBNAIL_DIR = os.path.join(os.path.expanduser('~'), '.mplus', 'thumbnails')
+PLACEHOLDER_COLOR = QColor('#2d2d2d')
+WIDTH_STEP = 32  # 预览宽度按这个取整，拖一下分隔条不至于每个像素都重新解一遍
+
+
+class ThumbnailCache:  # 解好的缩略图，按占用字节做LRU；只在GUI线程里用
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, maxBytes=DEFAULT_MAX_BYTES):
+        self.maxBytes = maxBytes
+        self._entries = OrderedDict()  # key -> QImage
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        image = self._entries.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return image
+
+    def put(self, key, image):
+        size = image.sizeInBytes()
+        if size > self.maxBytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.sizeInBytes()
+        self._entries[key] = image
+        self._bytes += size
+        while self._bytes > self.maxBytes and self._entries:
+            _key, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.sizeInBytes()
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+def placeholderImage(size, ratio):  # 单色1位图，几千像素高也就几百KB
+    image = QImage(size, QImage.Format_Mono)
+    image.setColorTable([PLACEHOLDER_COLOR.rgb(), PLACEHOLDER_COLOR.rgb()])
+    image.fill(0)
+    image.setDevicePixelRatio(ratio)
+    return image
+
+
+def pruneDiskCache(directory, maxBytes):  # 按修改时间从老到新删，删到总大小不超
+    try:
+        entries = []
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith('.png'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError:
+        return
+    total = sum(size for _mtime, size, _path in entries)
+    for _mtime, size, path in sorted(entries):
+        if total <= maxBytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+class _ImageSignals(QObject):
+    loaded = Signal(object, QImage)  # key, 缩略图（解不出来是空图）
+
+
+class _ThumbnailJob(QRunnable):
+    def __init__(self, key, path, size, ratio, diskDir, signals):
+        super().__init__()
+        self.key = key
+        self.path = path
+        self.size = size  # 要解成的像素尺寸
+        self.ratio = ratio
+        self.diskDir = diskDir  # None就不读写磁盘缓存
+        self.signals = signals
+
+    def run(self):
+        with tracer.span("image.decode", width=self.size.width(), height=self.size.height()):
+            diskPath = self.diskPath()
+            image = QImage(diskPath) if diskPath and os.path.exists(diskPath) else QImage()
+            if image.isNull():
+                image = self.decode()
+                if diskPath and not image.isNull():
+                    self.writeDisk(image, diskPath)
+        image.setDevicePixelRatio(self.ratio)
+        self.signals.loaded.emit(self.key, image)
+
+    def diskPath(self):
+        if not self.diskDir:
+            return None
+        digest = hashlib.blake2b(repr(self.key).encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.diskDir, digest + '.png')
+
+    def decode(self):
+        reader = QImageReader(self.path)
+        reader.setAutoTransform(True)  # 手机照片按EXIF转正
+        rotated = bool(reader.transformation() & QImageIOHandler.TransformationRotate90)
+        if not rotated:  # JPEG解码时就能按比例缩，省得先解出原图
+            reader.setScaledSize(self.size)
+        image = reader.read()
+        if not image.isNull() and image.size() != self.size:
+            image = image.scaled(self.size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        return image
+
+    @staticmethod
+    def writeDisk(image, diskPath):  # 先写临时文件再rename，写一半崩了也不会留下坏图
+        tempPath = diskPath + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(diskPath), exist_ok=True)
+            if image.save(tempPath, 'PNG'):
+                os.replace(tempPath, diskPath)
+        except OSError:
+            pass
+
+
+class ImageLoader(QObject):  # 整个窗口共用一个：内存缓存和解码线程所有标签页一起用
+    imageLoaded = Signal(object, QImage)
+
+    diskCacheMaxBytes = 256 * 1024 * 1024
+
+    def __init__(self, diskDir=None, parent=None):
+        super().__init__(parent)
+        self.diskDir = None  # None就不落盘
+        self.cache = ThumbnailCache()
+        self.loading = set()  # 已经排上队的key，同一张图多处引用只解一次
+        self.headers = {}  # (路径, 修改时间, 文件大小) -> 原图尺寸，读不出的是无效尺寸，也记着免得反复读
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(2)
+        self.signals = _ImageSignals()
+        self.signals.loaded.connect(self.onLoaded)
+        self.setDiskDir(diskDir)
+
+    def setDiskDir(self, diskDir):  # 开关磁盘缓存；打开时先在后台删掉超出上限的旧缩略图
+        if diskDir and diskDir != self.diskDir:
+            self.pool.start(lambda: pruneDiskCache(diskDir, self.diskCacheMaxBytes))
+        self.diskDir = diskDir
+
+    def request(self, path, maxWidth, ratio=1.0):
+        # 返回(key, 图, 是否已经是真图)；文件不在或读不出尺寸返回None，让Qt按原来的办法处理
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        header = self.imageSize(path, (path, stat.st_mtime_ns, stat.st_size))
+        if header is None:
+            return None
+        width = max(WIDTH_STEP, maxWidth - maxWidth % WIDTH_STEP)
+        if header.width() > width:  # 比预览宽的缩到预览宽，窄的不放大
+            logical = QSize(width, max(1, round(header.height() * width / header.width())))
+        else:
+            logical = header
+        pixels = QSize(min(header.width(), round(logical.width() * ratio)),
+                       min(header.height(), round(logical.height() * ratio)))
+        key = (path, stat.st_mtime_ns, stat.st_size, pixels.width(), pixels.height())
+        # 真图和占位图的显示尺寸都是 像素/比例，两边一样，换图时不用重新排版
+        displayRatio = pixels.width() / logical.width()
+        image = self.cache.get(key)
+        if image is not None:
+            return key, image, True
+        if key not in self.loading:
+            self.loading.add(key)
+            diskDir = self.diskDir if pixels != header else None  # 没缩的图解原图也不慢，不落盘
+            self.pool.start(_ThumbnailJob(key, path, pixels, displayRatio, diskDir, self.signals))
+        return key, placeholderImage(pixels, displayRatio), False
+
+    def imageSize(self, path, headerKey):  # 只读文件头；EXIF要转90度的宽高对调
+        size = self.headers.get(headerKey)
+        if size is None:
+            reader = QImageReader(path)
+            reader.setAutoTransform(True)
+            size = reader.size()
+            if size.isValid() and reader.transformation() & QImageIOHandler.TransformationRotate90:
+                size.transpose()
+            if len(self.headers) > 4096:
+                self.headers.clear()
+            self.headers[headerKey] = size
+        if not size.isValid() or size.isEmpty():
+            return None
+        return size
+
+    def onLoaded(self, key, image):
+        self.loading.discard(key)
+        if not image.isNull():
+            self.cache.put(key, image)
+        self.imageLoaded.emit(key, image)
+
+    def shutdown(self):
+        self.pool.clear()
+        self.pool.waitForDone()
@@ -0,0 +1,149 @@
+# 大纲面板：标题列表 + "转到章节"搜索框
+# 标题来自渲染器的块（RenderedBlock.heading），沿用的块不会重新解析；这里和上一次的列表比首尾，只换中间变了的几项
+# 行号单独存一份列表，前面插删几行时只改数字不动控件；光标所在章节用二分查
+
+import re
+from bisect import bisect_right
+
+from PySide6.QtCore import Qt, Signal
+from PySide6.QtWidgets import QLineEdit, QListWidget, QListWidgetItem, QVBoxLayout, QWidget
+
+OUTLINE_QSS = """
+    QLineEdit {
+        background-color: #1e1e1e;
+        color: #ffffff;
+        border: 1px solid #3c3c3c;
+        padding: 4px;
+    }
+    QListWidget {
+        background-color: #252526;
+        color: #cccccc;
+        border: none;
+    }
+    QListWidget::item:selected {
+        background-color: #37373d;
+        color: #ffffff;
+    }
+"""
+
+# 标题里的行内标记去掉再显示：链接留文字，强调/代码的符号去掉
+LINK_PATTERN = re.compile(r'!?\[([^\]]*)\]\([^)]*\)')
+MARK_PATTERN = re.compile(r'[*_`~]+')
+
+
+def plainHeading(text):
+    return MARK_PATTERN.sub('', LINK_PATTERN.sub(r'\1', text)).strip()
+
+
+class OutlinePanel(QWidget):
+    headingActivated = Signal(int)  # 源码行号
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setStyleSheet(OUTLINE_QSS)
+        self.headings = []  # [(行号, 级别, 源码文字)]
+        self.lines = []  # 每项的行号，二分用
+        self.searchTexts = []  # 每项小写过的显示文字，过滤用
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(2)
+        self.searchInput = QLineEdit()
+        self.searchInput.setPlaceholderText("转到章节…")
+        self.searchInput.setClearButtonEnabled(True)
+        self.searchInput.textChanged.connect(self.applyFilter)
+        self.searchInput.returnPressed.connect(self.activateFirstMatch)
+        layout.addWidget(self.searchInput)
+        self.listWidget = QListWidget()
+        self.listWidget.setUniformItemSizes(True)  # 几百上千项时滚动、过滤都不用逐项量高度
+        self.listWidget.itemActivated.connect(self.onItemActivated)
+        self.listWidget.itemClicked.connect(self.onItemActivated)
+        layout.addWidget(self.listWidget)
+
+    def setHeadings(self, headings):
+        oldKeys = [(level, text) for _line, level, text in self.headings]
+        newKeys = [(level, text) for _line, level, text in headings]
+        self.headings = headings
+        self.lines = [line for line, _level, _text in headings]
+        if oldKeys == newKeys:
+            return
+
+        limit = min(len(oldKeys), len(newKeys))
+        start = 0
+        while start < limit and oldKeys[start] == newKeys[start]:
+            start += 1
+        tail = 0
+        while tail < limit - start and oldKeys[-1 - tail] == newKeys[-1 - tail]:
+            tail += 1
+
+        listWidget = self.listWidget
+        listWidget.setUpdatesEnabled(False)
+        try:
+            for _ in range(len(oldKeys) - tail - start):
+                listWidget.takeItem(start)
+            texts = []
+            for row in range(start, len(newKeys) - tail):
+                level, text = newKeys[row]
+                display = plainHeading(text) or text
+                item = QListWidgetItem("    " * (level - 1) + display)
+                item.setToolTip(display)
+                listWidget.insertItem(row, item)
+                texts.append(display.lower())
+            self.searchTexts[start:len(oldKeys) - tail] = texts
+            query = self.searchInput.text().strip().lower()
+            if query:
+                for row in range(start, len(newKeys) - tail):
+                    listWidget.item(row).setHidden(query not in self.searchTexts[row])
+        finally:
+            listWidget.setUpdatesEnabled(True)
+
+    def applyFilter(self, text):
+        query = text.strip().lower()
+        listWidget = self.listWidget
+        listWidget.setUpdatesEnabled(False)
+        try:
+            for row, searchText in enumerate(self.searchTexts):
+                listWidget.item(row).setHidden(bool(query) and query not in searchText)
+        finally:
+            listWidget.setUpdatesEnabled(True)
+        for row in range(listWidget.count()):  # 选中第一个匹配的，回车就跳过去
+            if not listWidget.item(row).isHidden():
+                listWidget.setCurrentRow(row)
+                break
+
+    def activateFirstMatch(self):
+        item = self.listWidget.currentItem()
+        if item is None or item.isHidden():
+            return
+        self.onItemActivated(item)
+
+    def onItemActivated(self, item):
+        row = self.listWidget.row(item)
+        if 0 <= row < len(self.lines):
+            self.headingActivated.emit(self.lines[row])
+
+    def setCurrentLine(self, line):  # 光标在哪个章节里就选中哪个标题
+        row = bisect_right(self.lines, line) - 1
+        if row < 0 or row >= self.listWidget.count() or self.listWidget.item(row).isHidden():
+            return
+        if self.listWidget.currentRow() != row:
+            self.listWidget.setCurrentRow(row)
+
+    def focusSearch(self):
+        self.searchInput.setFocus(Qt.ShortcutFocusReason)
+        self.searchInput.selectAll()
+
+    def keyPressEvent(self, event):  # 搜索框里上下键挪列表的选中项
+        if event.key() in (Qt.Key_Up, Qt.Key_Down) and self.searchInput.hasFocus():
+            self.moveSelection(-1 if event.key() == Qt.Key_Up else 1)
+            return
+        super().keyPressEvent(event)
+
+    def moveSelection(self, step):
+        listWidget = self.listWidget
+        row = listWidget.currentRow() + step
+        while 0 <= row < listWidget.count():
+            if not listWidget.item(row).isHidden():
+                listWidget.setCurrentRow(row)
+                return
+            row += step
@@ -0,0 +1,191 @@
+# PDF导出和分页打印
+# 排版（setHtml）和逐页绘制都在工作线程里做，GUI线程只管进度条和取消；预览是最新的就直接拼渲染器缓存里的块HTML，不再渲染一遍
+# 样式表就是预览用的那份主题样式表，导出来和预览看到的一样
+# 同步的writePdf不依赖窗口，批量渲染 MPlus render ... --pdf 也用它
+
+import os
+import threading
+
+from PySide6.QtCore import QMarginsF, QObject, QRectF, QRunnable, QSizeF, QThreadPool, QUrl, Signal
+from PySide6.QtGui import QGuiApplication, QPageLayout, QPageSize, QPainter, QPdfWriter, QTextDocument
+
+from functions.PreviewStyle import stripStyleTag
+from functions.Tracer import tracer
+
+PAGE_MARGIN_MM = 15
+LAYOUT_DPI = 96  # 按屏幕的96dpi排版，样式表里的px才和预览一致，画的时候再整体放大到设备分辨率
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def ensureGuiApplication():  # 无界面导出也得有QGuiApplication，字体和排版靠它
+    app = QGuiApplication.instance()
+    if app is None:
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        app = QGuiApplication([])
+    return app
+
+
+def renderForExport(markdownText):  # 预览不是最新的（或者还有没高亮完的代码块）：在导出线程里用单独的渲染器渲一遍
+    from functions.Renderer import MarkdownRenderer
+    renderer = MarkdownRenderer()  # 不用共享的那个，它只能在渲染线程里用
+    renderer.deferHighlightChars = None
+    return renderer.renderMarkdown(markdownText)
+
+
+def buildDocument(html, css, baseDir=None):  # baseDir是md文件所在目录，相对路径的图片和预览一样按它找
+    document = QTextDocument()
+    document.setUndoRedoEnabled(False)
+    if baseDir:
+        document.setBaseUrl(QUrl.fromLocalFile(os.path.join(baseDir, '')))
+    document.setDefaultStyleSheet(stripStyleTag(css))
+    with tracer.span("export.layout", chars=len(html)):
+        document.setHtml(html)
+    return document
+
+
+def layoutDocument(document, cancelled=None):
+    # 逐块排版：pageCount()一口气排完整篇时一直攥着GIL，GUI线程里的Python代码全得等它（大文档一两秒）；
+    # 一块一块排，每次调用之间GIL就能让出去，顺便还能及时响应取消
+    layout = document.documentLayout()
+    block = document.begin()
+    count = 0
+    with tracer.span("export.paginate", blocks=document.blockCount()):
+        while block.isValid():
+            layout.blockBoundingRect(block)
+            block = block.next()
+            count += 1
+            if count % 256 == 0 and cancelled is not None and cancelled():
+                raise ExportCancelled()
+
+
+def paintDocument(document, device, progress=None, cancelled=None):  # 分页画到PDF/打印机上，返回页数
+    scale = device.logicalDpiY() / LAYOUT_DPI
+    paintRect = device.pageLayout().paintRectPixels(device.logicalDpiY())
+    pageWidth = paintRect.width() / scale
+    pageHeight = paintRect.height() / scale
+    document.setPageSize(QSizeF(pageWidth, pageHeight))  # 设了页高，排版时会把跨页的行挪到下一页
+    layoutDocument(document, cancelled)
+    pageCount = document.pageCount()
+
+    painter = QPainter()
+    if not painter.begin(device):
+        raise OSError('无法写入打印设备')
+    try:
+        painter.scale(scale, scale)
+        for page in range(pageCount):
+            if cancelled is not None and cancelled():
+                raise ExportCancelled()
+            if page:
+                device.newPage()
+            with tracer.span("export.page", page=page):
+                painter.save()
+                painter.translate(0, -page * pageHeight)
+                document.drawContents(painter, QRectF(0, page * pageHeight, pageWidth, pageHeight))
+                painter.restore()
+            if progress is not None:
+                progress(page + 1, pageCount)
+    finally:
+        painter.end()
+    return pageCount
+
+
+def writePdf(html, css, path, title='', progress=None, cancelled=None, baseDir=None):  # 先写临时文件，取消或出错不留半个PDF
+    document = buildDocument(html, css, baseDir)
+    if cancelled is not None and cancelled():
+        raise ExportCancelled()
+    tmpPath = path + '.tmp'
+    writer = QPdfWriter(tmpPath)
+    writer.setPageSize(QPageSize(QPageSize.A4))
+    writer.setPageMargins(QMarginsF(PAGE_MARGIN_MM, PAGE_MARGIN_MM, PAGE_MARGIN_MM, PAGE_MARGIN_MM),
+                          QPageLayout.Millimeter)
+    writer.setTitle(title)
+    writer.setCreator('MPlus')
+    try:
+        pageCount = paintDocument(document, writer, progress, cancelled)
+    except BaseException:
+        del writer
+        try:
+            os.remove(tmpPath)
+        except OSError:
+            pass
+        raise
+    del writer  # 文件句柄跟着QPdfWriter走，先放掉再rename
+    os.replace(tmpPath, path)
+    return pageCount
+
+
+class _ExportSignals(QObject):
+    progress = Signal(int, int)  # 画完几页, 一共几页
+    finished = Signal(str, int)  # 输出到哪（PDF路径或打印机名）, 页数
+    failed = Signal(str)
+    cancelled = Signal()
+
+
+class _ExportJob(QRunnable):
+    def __init__(self, work, signals, cancelEvent):
+        super().__init__()
+        self.work = work
+        self.signals = signals
+        self.cancelEvent = cancelEvent
+
+    def run(self):
+        try:
+            with tracer.span("export.total"):
+                target, pageCount = self.work(self.signals.progress.emit, self.cancelEvent.is_set)
+        except ExportCancelled:
+            self.signals.cancelled.emit()
+            return
+        except Exception as e:
+            self.signals.failed.emit(repr(e))
+            return
+        self.signals.finished.emit(target, pageCount)
+
+
+class DocumentExporter(QObject):
+    progress = Signal(int, int)
+    finished = Signal(str, int)
+    failed = Signal(str)
+    cancelled = Signal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)  # 一次只导一个
+        self.signals = _ExportSignals()
+        self.signals.progress.connect(self.progress)
+        self.signals.finished.connect(self.finished)
+        self.signals.failed.connect(self.failed)
+        self.signals.cancelled.connect(self.cancelled)
+        self.cancelEvent = threading.Event()
+
+    @staticmethod
+    def resolveHtml(html, markdownText):
+        return html if html is not None else renderForExport(markdownText)
+
+    def exportPdf(self, path, css, html=None, markdownText='', title='', baseDir=None):  # html为None时在导出线程里渲染markdownText
+        def work(progress, cancelled):
+            source = self.resolveHtml(html, markdownText)
+            return path, writePdf(source, css, path, title, progress, cancelled, baseDir)
+
+        self.start(work)
+
+    def printDocument(self, printer, css, html=None, markdownText='', baseDir=None):  # printer在对话框里配好，之后只在导出线程里用
+        def work(progress, cancelled):
+            document = buildDocument(self.resolveHtml(html, markdownText), css, baseDir)
+            return printer.printerName() or printer.outputFileName(), paintDocument(document, printer, progress, cancelled)
+
+        self.start(work)
+
+    def start(self, work):
+        self.cancelEvent = threading.Event()
+        self.pool.start(_ExportJob(work, self.signals, self.cancelEvent))
+
+    def cancel(self):  # 画完当前这一页就停
+        self.cancelEvent.set()
+
+    def shutdown(self):
+        self.cancel()
+        self.pool.waitForDone()
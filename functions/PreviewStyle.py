@@ -0,0 +1,81 @@
+# 预览/导出共用的样式
+# 单独放一个模块，界面启动时拿样式不用把markdown-it和pygments也拉进来
+# 代码高亮默认输出class（<span class="hl3">），颜色规则按主题生成一份样式表，预览文档设一次、导出也用这一份，
+# 不再每个token都带一串内联style；怎么分的class见CodeFormatter
+
+PREVIEW_CSS = """
+        <style>
+            body { font-family: "Microsoft YaHei", sans-serif; color: white; background-color: #1e1e1e; }
+            pre, code { font-family: Consolas, "Microsoft YaHei", monospace; background-color: #252525; }
+            pre { padding: 10px; border-radius: 3px; }
+            h1, h2, h3, h4, h5, h6 { font-family: "Microsoft YaHei", sans-serif; }
+            table { border-collapse: collapse; width: 100%; margin: 15px 0; border: 1px solid #454545; }
+            th, td { border: 1px solid #454545; padding: 8px 12px; text-align: left; }
+            th { background-color: #333337; font-weight: bold; }
+            tr:nth-child(even) { background-color: #252525; }
+            tr:hover { background-color: #2a2a2a; }
+            .codehilite { position: relative; margin: 1em 0; border-radius: 4px; overflow: hidden; }
+            .codehilite pre { margin: 0; padding: 1em; overflow-x: auto; }
+            blockquote { margin: 10px 0; padding: 12px 15px; background-color: rgba(50, 50, 50, 0.3); border-left: 4px solid #6a9955; }
+            blockquote.level-2, blockquote blockquote { margin-left: 20px; background-color: rgba(60, 60, 60, 0.3); border-left-color: #8a7578; }
+            blockquote.level-3, blockquote blockquote blockquote { margin-left: 40px; background-color: rgba(70, 70, 70, 0.3); border-left-color: #7a6568; }
+            blockquote.level-4 { margin-left: 60px; background-color: rgba(80, 80, 80, 0.3); border-left-color: #6a5558; }
+            blockquote.level-5 {
+            margin-left: 80px;
+            background-color: rgba(90, 90, 90, 0.3);
+            border-left-color: #5a4548;
+            }
+            blockquote.level-6 {
+            margin-left: 100px;
+            background-color: rgba(90, 90, 90, 0.3);
+            border-left-color: #4a4548;
+            }
+            blockquote.level-7 {
+            margin-left: 120px;
+            background-color: rgba(90, 90, 90, 0.3);
+            border-left-color: #3a4548;
+            }        
+            blockquote.level-8 {
+            margin-left: 140px;
+            background-color: rgba(90, 90, 90, 0.3);
+            border-left-color: #2a4548;
+            }        
+            blockquote.level-9 {
+            margin-left: 160px;
+            background-color: rgba(90, 90, 90, 0.3);
+            border-left-color: #1a4548;
+            }                 
+            blockquote.level-10 {
+            margin-left: 180px;
+            background-color: rgba(90, 90, 90, 0.3);
+            border-left-color: #0a4548;
+            }                        
+        </style>
+        """
+
+DEFAULT_THEME = "monokai"
+CODE_CSS_CLASS = "codehilite"
+CODE_PRE_STYLES = "margin: 0; padding: 0;"
+CODE_PRE_STYLES_CLASSES = CODE_PRE_STYLES + " line-height: 125%;"  # 内联模式pygments会自己补上行高
+
+_themeSheets = {}  # 主题名 -> 完整样式表，每个主题只生成一次
+
+
+def stripStyleTag(css):  # QTextDocument.setDefaultStyleSheet要的是不带<style>的纯CSS
+    return css.replace('<style>', '').replace('</style>', '')
+
+
+def themeStyleSheet(theme=DEFAULT_THEME):  # PREVIEW_CSS + 这个主题的代码高亮规则（引用块层级的规则在PREVIEW_CSS里）
+    sheet = _themeSheets.get(theme)
+    if sheet is None:
+        from functions.CodeFormatter import GroupedHtmlFormatter  # 要拉pygments，只在渲染线程/批量渲染里调用
+        formatter = GroupedHtmlFormatter(style=theme, cssclass=CODE_CSS_CLASS)
+        selector = "." + CODE_CSS_CLASS
+        # 和内联模式的效果对齐：背景只给代码块，不要pygments那条全局的pre规则和行号的规则（行高写在CODE_PRE_STYLES里）
+        # token规则不带.codehilite前缀：Qt匹配后代选择器很慢，hlN这种名字也不会和别的class撞
+        rules = [f"{selector} {{ background: {formatter.style.background_color} }}"]
+        rules += formatter.groupStyleDefs()
+        base = PREVIEW_CSS.rstrip().removesuffix("</style>").rstrip()
+        sheet = base + "\n            " + "\n            ".join(rules) + "\n        </style>\n        "
+        _themeSheets[theme] = sheet
+    return sheet
@@ -0,0 +1,214 @@
+# 预览控件，替掉原来的QLabel.setText
+# 渲染器给的是一块一块的HTML，这里记着每块的哈希和占了文档里几个QTextBlock
+# 更新时只把变了的那几块用光标删掉重插，其它的不动，滚动位置和选区也就不会被重置
+# 每块占了哪几个QTextBlock、对应源码哪几行记在SourceMap里，滚动同步拿它二分查找
+# 本地图片交给ImageLoader在后台解码缩小，排版时先拿同样大小的占位图，解好了换上只重绘不重排
+
+import os
+
+from PySide6.QtCore import QTimer, QUrl, Signal
+from PySide6.QtGui import QTextBlockFormat, QTextCharFormat, QTextCursor, QTextDocument, QTextDocumentFragment
+from PySide6.QtWidgets import QTextBrowser
+
+from functions.PreviewStyle import PREVIEW_CSS, stripStyleTag
+from functions.SourceMap import SourceMap
+from functions.Tracer import tracer
+
+
+class IncrementalPreview(QTextBrowser):
+    patched = Signal()  # 换完一轮块，滚动同步要重新对齐
+
+    maxBlocksPerStep = 200
+
+    def __init__(self, parent=None, css=PREVIEW_CSS):
+        super().__init__(parent)
+        self.setOpenExternalLinks(True)
+        self.document().setUndoRedoEnabled(False)  # 只读预览要撤销栈没用，还白占内存
+
+        self.blockKeys = []  # 每个渲染块的(哈希, 是否占位)
+        self.sourceMap = SourceMap()  # 每个渲染块在文档里占几个QTextBlock、对应源码哪几行
+        self.targetBlocks = []
+        self.patching = False  # 补丁引起的滚动条变化，滚动同步不当成用户滚动
+        self.imageLoader = None
+        self.waitingImages = {}  # 图片key -> [占位中的资源URL]
+
+        self.patchTimer = QTimer(self)
+        self.patchTimer.setSingleShot(True)
+        self.patchTimer.setInterval(0)
+        self.patchTimer.timeout.connect(self.patchStep)
+        # 单块HTML先在草稿文档里解析好，再整段拷过去，格式和setHtml整篇时一致
+        self.scratch = QTextDocument(self)
+        self.setPreviewStyleSheet(css)
+
+    def setPreviewStyleSheet(self, css):
+        css = stripStyleTag(css)
+        self.document().setDefaultStyleSheet(css)
+        self.scratch.setDefaultStyleSheet(css)
+        self.clearBlocks()  # 样式变了旧块的格式都作废，全部重插
+        self.applyBlocks(self.targetBlocks)
+
+    def clearBlocks(self):
+        self.patchTimer.stop()
+        self.document().clear()
+        self.blockKeys = []
+        self.sourceMap.clear()
+        self.waitingImages.clear()  # 文档清了资源也跟着清，再插回来时会重新要
+
+    def setImageLoader(self, loader):
+        self.imageLoader = loader
+        loader.imageLoaded.connect(self.onImageLoaded)
+
+    def setBaseDir(self, directory):  # 相对路径的图片按md文件所在目录找
+        self.document().setBaseUrl(QUrl.fromLocalFile(os.path.join(directory, '')))
+
+    def imageWidth(self):
+        return int(self.viewport().width() - 2 * self.document().documentMargin())
+
+    def loadResource(self, resourceType, name):  # Qt排版时来要图片：本地图片给缓存里的缩略图或占位图
+        loader = self.imageLoader
+        if loader is None or resourceType != QTextDocument.ImageResource or not name.isLocalFile():
+            return super().loadResource(resourceType, name)
+        result = loader.request(name.toLocalFile(), self.imageWidth(), self.devicePixelRatioF())
+        if result is None:
+            return super().loadResource(resourceType, name)
+        key, image, ready = result
+        if not ready:
+            self.waitingImages.setdefault(key, []).append(name)
+        return image
+
+    def onImageLoaded(self, key, image):  # 尺寸和占位图一样，登记成资源重绘一下就行
+        urls = self.waitingImages.pop(key, None)
+        if not urls or image.isNull():
+            return
+        document = self.document()
+        for url in urls:
+            document.addResource(QTextDocument.ImageResource, url, image)
+        self.viewport().update()
+
+    def html(self):  # 打印、导出用，整篇重新拼
+        return self.document().toHtml()
+
+    def applyBlocks(self, blocks):
+        self.targetBlocks = blocks
+        self.patchTimer.stop()
+        self.patchStep()
+
+    def patchStep(self):
+        blocks = self.targetBlocks
+        newKeys = [(block.key, block.pending) for block in blocks]
+        oldKeys = self.blockKeys
+        if newKeys == oldKeys:
+            self.sourceMap.setLines(blocks)
+            return
+
+        # 首尾相同的块不动，中间的[start, oldEnd)换成新的[start, newEnd)
+        limit = min(len(oldKeys), len(newKeys))
+        start = 0
+        while start < limit and oldKeys[start] == newKeys[start]:
+            start += 1
+        tail = 0
+        while tail < limit - start and oldKeys[-1 - tail] == newKeys[-1 - tail]:
+            tail += 1
+        oldEnd = len(oldKeys) - tail
+        newEnd = len(newKeys) - tail
+
+        # 纯插入/纯删除时带上一个邻居一起换，这样永远是"非空换非空"，光标操作只有一种
+        if (start == oldEnd or start == newEnd) and oldKeys and newKeys:
+            if start > 0:
+                start -= 1
+            else:
+                oldEnd += 1
+                newEnd += 1
+        # 一次最多插这么多块，剩下的下一轮事件循环再接着换（刚打开大文件时不至于卡死）
+        newEnd = min(newEnd, start + self.maxBlocksPerStep)
+
+        scrollBar = self.verticalScrollBar()
+        scrollValue = scrollBar.value()
+        self.patching = True
+        try:
+            with tracer.span("preview.patch", blocks=newEnd - start, total=len(newKeys)):
+                if not newKeys:
+                    self.clearBlocks()
+                elif not oldKeys:
+                    self.document().clear()
+                    spans = self.insertBlocks(QTextCursor(self.document()), blocks[:newEnd])
+                    self.sourceMap.clear()
+                    self.sourceMap.replace(0, 0, blocks[:newEnd], spans)
+                else:
+                    self.replaceBlocks(start, oldEnd, blocks[start:newEnd])
+            self.blockKeys = oldKeys[:start] + newKeys[start:newEnd] + oldKeys[oldEnd:]
+            scrollBar.setValue(scrollValue)
+        finally:
+            self.patching = False
+        if self.blockKeys != newKeys:
+            self.patchTimer.start()
+        else:  # 没动的块行号也可能整体挪了，全换完再统一对一遍
+            self.sourceMap.setLines(blocks)
+        self.patched.emit()
+
+    def replaceBlocks(self, start, oldEnd, blocks):
+        doc = self.document()
+        first = self.sourceMap.offsets[start]
+        last = self.sourceMap.offsets[oldEnd] - 1
+
+        cursor = QTextCursor(doc)
+        cursor.beginEditBlock()
+        # 删到最后一个QTextBlock的末尾（不含换块符），剩下一个空块当插入点
+        firstBlock = doc.findBlockByNumber(first)
+        endBlock = doc.findBlockByNumber(last)
+        joined = self.startsWithTable(firstBlock)
+        if joined:  # 表格直接接在上一块后面，得从上一块末尾删起，把表格整个框进去
+            previous = firstBlock.previous()
+            cursor.setPosition(previous.position() + previous.length() - 1)
+        else:
+            cursor.setPosition(firstBlock.position())
+        cursor.setPosition(endBlock.position() + endBlock.length() - 1, QTextCursor.KeepAnchor)
+        cursor.removeSelectedText()
+        if joined:
+            cursor.insertBlock(QTextBlockFormat(), QTextCharFormat())
+        spans = self.insertBlocks(cursor, blocks)
+        cursor.endEditBlock()
+        self.sourceMap.replace(start, oldEnd, blocks, spans)
+
+    @staticmethod
+    def startsWithTable(block):
+        table = QTextCursor(block).currentTable()
+        return table is not None and block.position() == table.firstPosition() and block.blockNumber() > 0
+
+    def insertBlocks(self, cursor, blocks):  # 光标在一个空块上，依次插入，返回每块占的QTextBlock数
+        spans = []
+        for i, block in enumerate(blocks):
+            if i:
+                cursor.insertBlock(QTextBlockFormat(), QTextCharFormat())
+            else:  # 删剩下的空块还带着原来的格式，列表归属setBlockFormat清不掉，要单独摘
+                textList = cursor.currentList()
+                if textList is not None:
+                    textList.remove(cursor.block())
+                cursor.setBlockFormat(QTextBlockFormat())
+                cursor.setCharFormat(QTextCharFormat())
+            firstNumber = cursor.blockNumber()
+            self.insertFragment(cursor, block.html)
+            spans.append(cursor.blockNumber() - firstNumber + 1)
+        return spans
+
+    def insertFragment(self, cursor, html):
+        self.scratch.setHtml(html.rstrip('\n'))
+        head = self.scratch.begin()
+        start = cursor.position()
+        cursor.insertFragment(QTextDocumentFragment(self.scratch))
+
+        # 片段的第一块会并进光标所在的空块，块格式（边距、标题级别）得手动补上；
+        # 以列表开头的片段Qt会另起一块，把留下的空块删掉；
+        # 以表格开头的片段前面会多一个空块，并回上一块，和整篇setHtml的结果对齐
+        fixer = QTextCursor(cursor.document())
+        fixer.setPosition(start)
+        if not fixer.block().text() and head.text():
+            fixer.deleteChar()
+        else:
+            fmt = head.blockFormat()
+            fmt.setObjectIndex(fixer.blockFormat().objectIndex())  # 列表编号是草稿文档里的，不能带过来
+            fixer.setBlockFormat(fmt)
+            if start and not head.text() and self.scratch.rootFrame().childFrames():
+                fmt = fixer.block().previous().blockFormat()
+                fixer.deletePreviousChar()
+                fixer.setBlockFormat(fmt)
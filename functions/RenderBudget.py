@@ -0,0 +1,81 @@
+# 渲染预算：一次渲染的耗时超了预算，预览就一级级降质量换速度；连续好几次都很快了再一级级升回去
+# 降级只影响之后新渲染的块，已经渲染好的块照样沿用；升级时比当前级别差的块才重新渲染
+# 不依赖markdown-it，窗口和标签页导入它很轻
+
+LEVEL_FULL = 0
+LEVEL_NO_HIGHLIGHT = 1  # 代码块不过pygments，直接出纯文本
+LEVEL_PLAIN_OFFSCREEN = 2  # 再把屏幕外的块直接出源码纯文本，滚到了再渲染
+# 不设关typographer的一级：commonmark预设没开replacements/smartquotes，关了输出也一样，省不下时间
+
+LEVEL_NAMES = ("完整", "无代码高亮", "屏幕外纯文本")
+
+
+class RenderBudget:  # 每个标签页一个，只在GUI线程里用
+    overLimit = 2  # 连续超预算几次才降一级，偶尔卡一下不算
+    restoreRatio = 0.3  # 耗时低于预算的这个比例才算扛得住
+    restoreSamples = 5  # 连续扛得住几次升一级
+    maxRestoreSamples = 80  # 升上去马上又降下来的话，下次要等的次数翻倍，到这里封顶
+
+    def __init__(self, budgetMs=None):
+        self.budgetMs = budgetMs  # None或0就是不降级
+        self.reset()
+
+    def reset(self):  # 换了文档从完整质量重新来
+        self.level = LEVEL_FULL
+        self.over = 0
+        self.under = 0
+        self.needUnder = self.restoreSamples
+        self.held = None  # 刚升级之后撑了几次没超预算，None是没在观察
+        self.settling = False  # 换级别后的第一次渲染要重渲染一批块，耗时不算数
+
+    def setBudget(self, budgetMs):  # 返回级别变没变
+        self.budgetMs = budgetMs
+        if budgetMs:
+            return False
+        changed = self.level != LEVEL_FULL
+        self.reset()
+        return changed
+
+    def record(self, seconds, renderedLevel):  # 一次渲染的耗时，返回级别变没变
+        if not self.budgetMs or renderedLevel != self.level:  # 换级别前派发的渲染也不算
+            return False
+        if self.settling:
+            self.settling = False
+            return False
+
+        ms = seconds * 1000
+        if ms > self.budgetMs:
+            self.under = 0
+            self.over += 1
+            if self.over >= self.overLimit and self.level < LEVEL_PLAIN_OFFSCREEN:
+                if self.held is not None:  # 升上去没撑住
+                    self.needUnder = min(self.needUnder * 2, self.maxRestoreSamples)
+                    self.held = None
+                self.setLevel(self.level + 1)
+                return True
+            return False
+
+        self.over = 0
+        if self.held is not None:
+            self.held += 1
+            if self.held >= self.restoreSamples:  # 撑住了，下次升级照常等
+                self.held = None
+                self.needUnder = self.restoreSamples
+        if ms >= self.budgetMs * self.restoreRatio:
+            self.under = 0
+            return False
+        self.under += 1
+        if self.under >= self.needUnder and self.level > LEVEL_FULL:
+            self.setLevel(self.level - 1)
+            self.held = 0
+            return True
+        return False
+
+    def setLevel(self, level):
+        self.level = level
+        self.over = 0
+        self.under = 0
+        self.settling = True
+
+    def levelName(self):
+        return LEVEL_NAMES[self.level]
@@ -0,0 +1,127 @@
+# 预览渲染调度器
+# 连续输入先防抖合并成一次，渲染丢到工作线程里跑，过期的结果直接扔掉，不让GUI线程等渲染
+
+import time
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, QTimer, Signal
+
+from functions.Tracer import tracer
+
+
+class _RenderSignals(QObject):
+    finished = Signal(int, object, float)  # 第几次, 结果, 渲染耗时（秒）
+    failed = Signal(int, str)
+
+
+class _RenderJob(QRunnable):
+    def __init__(self, renderFunc, text, generation, signals):
+        super().__init__()
+        self.renderFunc = renderFunc
+        self.text = text
+        self.generation = generation
+        self.signals = signals
+
+    def run(self):
+        started = time.perf_counter()  # 不管开没开追踪都要量，降级要用
+        try:
+            with tracer.span("preview.render", chars=len(self.text)):
+                result = self.renderFunc(self.text)
+        except Exception as e:  # 渲染炸了也要把忙碌状态还回去
+            self.signals.failed.emit(self.generation, repr(e))
+            return
+        self.signals.finished.emit(self.generation, result, time.perf_counter() - started)
+
+
+class RenderScheduler(QObject):
+    rendered = Signal(object)  # renderFunc的返回值原样带过来
+    renderFailed = Signal(str)
+
+    DEFAULT_DEBOUNCE_MS = 150
+
+    def __init__(self, renderFunc, textProvider, debounceMs=DEFAULT_DEBOUNCE_MS, parent=None, pool=None):
+        super().__init__(parent)
+        self.renderFunc = renderFunc
+        self.textProvider = textProvider
+
+        # 只开一个线程：渲染器不是线程安全的，而且同一时间也只需要一次渲染
+        # 多个标签页各有一个调度器，共用同一个单线程的pool，渲染器照样只在一个线程里跑
+        if pool is None:
+            pool = QThreadPool(self)
+            pool.setMaxThreadCount(1)
+        self.pool = pool
+
+        self.signals = _RenderSignals()
+        self.signals.finished.connect(self._onFinished)
+        self.signals.failed.connect(self._onFailed)
+
+        self.debounceTimer = QTimer(self)
+        self.debounceTimer.setSingleShot(True)
+        self.debounceTimer.setInterval(debounceMs)
+        self.debounceTimer.timeout.connect(self._dispatch)
+
+        self._generation = 0  # 每次派发+1，回来的结果对不上就是过期的
+        self._busy = False
+        self._pending = False  # 渲染途中又有新编辑
+        self._burstStarted = None  # 这一轮编辑里第一次按键的时间，算端到端延迟用
+        self.lastRenderSeconds = 0.0  # 最近一次送出去的结果在工作线程里渲染了多久
+
+    def setDebounceInterval(self, ms):
+        self.debounceTimer.setInterval(max(0, int(ms)))
+
+    def debounceInterval(self):
+        return self.debounceTimer.interval()
+
+    def schedule(self):  # 每次按键只重启计时器，文本等真正派发时再取
+        if self._burstStarted is None:
+            self._burstStarted = time.perf_counter()
+        self.debounceTimer.start()
+
+    def renderNow(self):
+        self.debounceTimer.stop()
+        self._dispatch()
+
+    def runInBackground(self, func):  # 和渲染排同一个线程，不会和渲染抢渲染器
+        self.pool.start(func)
+
+    def _dispatch(self):
+        if self._busy:
+            # 正在渲染的那次结果反正会过期，等它回来再派发最新的
+            self._pending = True
+            self._generation += 1
+            return
+
+        self._pending = False
+        self._generation += 1
+        self._busy = True
+        with tracer.span("preview.snapshot"):
+            text = self.textProvider()
+        self.pool.start(_RenderJob(self.renderFunc, text, self._generation, self.signals))
+
+    def _onFinished(self, generation, result, seconds):
+        if self._settle(generation):
+            self.lastRenderSeconds = seconds
+            self.rendered.emit(result)  # 同线程直连，返回时预览已经更新完了
+            self._recordLatency()
+
+    def _onFailed(self, generation, message):
+        if self._settle(generation):
+            self.renderFailed.emit(message)
+            self._recordLatency()
+
+    def _settle(self, generation):  # 结果回来了：有排队的就接着派发，过期的扔掉
+        self._busy = False
+        if self._pending:
+            self._dispatch()
+            return False
+        return generation == self._generation
+
+    def _recordLatency(self):
+        if self._burstStarted is not None:
+            tracer.record("preview.latency", self._burstStarted, time.perf_counter() - self._burstStarted)
+            self._burstStarted = None
+
+    def shutdown(self):
+        self.debounceTimer.stop()
+        self._pending = False
+        self._generation += 1
+        self.pool.waitForDone()
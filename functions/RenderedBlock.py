@@ -0,0 +1,15 @@
+# 渲染结果的最小单位，渲染器产出、预览控件消费
+# 不依赖markdown-it，预览控件那边导入它很轻
+
+
+class RenderedBlock:  # 一个顶层块：源码行范围 + 渲染好的HTML
+    __slots__ = ("key", "startLine", "endLine", "html", "pending", "heading", "level")
+
+    def __init__(self, key, startLine, endLine, html, pending=False, heading=None, level=0):
+        self.key = key
+        self.startLine = startLine
+        self.endLine = endLine
+        self.html = html
+        self.pending = pending  # 里面有还在后台高亮的代码块，下次渲染不能沿用
+        self.heading = heading  # 顶层标题块是(级别, 标题源码文字)，其它块None
+        self.level = level  # 按哪一级降级渲染的（见RenderBudget），0是完整的
@@ -1,135 +1,502 @@
 # 渲染MD内容，右侧那玩意
-# 本质上还是QLabel套HTML渲染的，毕竟css可以直接用
+# 本质上还是套HTML渲染的，毕竟css可以直接用；预览控件按块增量更新，见PreviewWidget
 
+import hashlib
 import re
+import threading
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
 
 from markdown_it import MarkdownIt
+from markdown_it.common.utils import escapeHtml, unescapeAll
+from markdown_it.token import Token
 from pygments import highlight
 from pygments.formatters import HtmlFormatter
 from pygments.lexers import get_lexer_by_name
+from pygments.util import ClassNotFound
 # pygments：代码高亮这一块👍
 
+from functions.BlockCache import BlockCache
+from functions.CodeFormatter import GroupedHtmlFormatter
+from functions.HighlightCache import HighlightCache
+from functions.PreviewStyle import (
+    CODE_CSS_CLASS, CODE_PRE_STYLES, CODE_PRE_STYLES_CLASSES, DEFAULT_THEME, PREVIEW_CSS, themeStyleSheet
+)
+from functions.RenderBudget import LEVEL_FULL, LEVEL_NO_HIGHLIGHT, LEVEL_PLAIN_OFFSCREEN
+from functions.RenderedBlock import RenderedBlock
+from functions.Tracer import tracer
+
+# 启动预热用的样例，尽量把常用的规则和词法分析器都走一遍
+WARMUP_SAMPLE = """# MPlus
+
+> 引用 **加粗** *斜体* ~~删除线~~ `code`
+
+- [链接](https://example.com)
+
+| a | b |
+|---|---|
+| 1 | 2 |
+
+```python
+print("hello")
+```
+"""
+
 # noinspection RegExpRedundantEscape,PyBroadException
 class MarkdownRenderer:
-    def __init__(self):
+    _shared = None
+    _sharedLock = threading.Lock()
+
+    # 语言名 -> lexer，不认识的语言记成None，进程内所有渲染器共用
+    _lexerCache = {}
+
+    # 超过这个长度的代码块不做语法高亮，给病态输入兜底
+    maxHighlightChars = 256_000
+    # 超过这个长度的代码块先出纯文本<pre>，高亮丢到后台，好了再换上；None表示不推迟
+    deferHighlightChars = 8_000
+
+    @classmethod
+    def shared(cls):  # 整个进程共用一个渲染器，别每次按键都new
+        if cls._shared is None:
+            with cls._sharedLock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    # inlineStyles=True是以前的输出：每个token带内联style，HTML自带颜色，不需要样式表
+    def __init__(self, highlightCacheBytes=HighlightCache.DEFAULT_MAX_BYTES, theme=DEFAULT_THEME, inlineStyles=False):
         self.md = MarkdownIt(
             "commonmark",
             {
                 "html": True,
                 "linkify": True,
                 "typographer": True,
-                "highlight": self.highlightCode,
             }
         ).enable("table").enable("strikethrough")
+        # 围栏代码直接交给markdown-it的fence规则，每块只过一次pygments
+        # 不用add_render_rule：它对传进去的函数调__get__，3.11/3.12上会把绑定方法重新绑到RendererHTML上
+        self.md.renderer.rules["fence"] = self.renderFence
+        # 引用块的层级和level-N样式在同一次解析里直接改token，不再回头重渲染
+        self.md.core.ruler.after("block", "blockquote_levels", self.blockquoteLevels)
+
+        # 只跑块级解析用来切块，拿token的map(源码行号)，不做行内解析，便宜得多
+        self.blockSplitter = MarkdownIt("commonmark").enable("table").enable("strikethrough")
+        self.blockSplitter.core.ruler.enableOnly(["normalize", "block"])
+        self.blockCache = BlockCache()
+        self.lastRenderedCount = 0  # 上次渲染真正重新渲染了几个块
 
-        self.pygmentsFormatter = HtmlFormatter(
-            style="monokai",
-            noclasses=True,
-            cssclass="codehilite",
-            prestyles="margin: 0; padding: 0;"
+        self.theme = theme
+        self.inlineStyles = inlineStyles
+        formatterClass = HtmlFormatter if inlineStyles else GroupedHtmlFormatter
+        preStyles = CODE_PRE_STYLES if inlineStyles else CODE_PRE_STYLES_CLASSES
+        self.pygmentsFormatter = formatterClass(
+            style=theme,
+            noclasses=inlineStyles,
+            cssclass=CODE_CSS_CLASS,
+            prestyles=preStyles
         )
+        # formatter参数也算进高亮缓存的key，换了样式旧结果自动作废
+        self.formatterKey = (theme, inlineStyles, CODE_CSS_CLASS, preStyles)
+
+        self.highlightCache = HighlightCache(highlightCacheBytes)
+        self.highlightReadyCallbacks = []  # 后台高亮完成后调用（在后台线程里！）
+        self._usedHighlightKeys = None  # 正在渲染的那一块用到的高亮key，记进BlockCache
+        self._highlightExecutor = None
+        self._pendingHighlights = set()
+        self._pendingLock = threading.Lock()
+
+    def styleSheet(self):  # 预览文档和导出用的样式表，和这个渲染器的输出配套
+        return PREVIEW_CSS if self.inlineStyles else themeStyleSheet(self.theme)
+
+    def warmUp(self):  # 把parser、formatter和常用lexer先跑热
+        for lang in ("python", "text"):
+            self.resolveLexer(lang)
+        self.renderMarkdown(WARMUP_SAMPLE)
+
+    @classmethod
+    def resolveLexer(cls, lang):
+        key = (lang or "text").lower()
+        try:
+            return cls._lexerCache[key]
+        except KeyError:
+            pass
+        try:
+            lexer = get_lexer_by_name(key, stripall=True)
+        except ClassNotFound:
+            lexer = None
+        cls._lexerCache[key] = lexer
+        return lexer
+
+    def renderFence(self, tokens, idx, _options, env):
+        token = tokens[idx]
+        info = unescapeAll(token.info).strip() if token.info else ''
+        lang = info.split(maxsplit=1)[0] if info else ''
+        code = token.content
+
+        if env.get('degrade', LEVEL_FULL) >= LEVEL_NO_HIGHLIGHT:  # 渲染超预算降级了，不过pygments
+            if self.resolveLexer(lang or "text") is not None and len(code) <= self.maxHighlightChars:
+                env['highlightSkipped'] = True
+            return self.plainCode(code, lang or "text")
+
+        if self.deferHighlightChars is not None and len(code) > self.deferHighlightChars:
+            lexer = self.resolveLexer(lang or "text")
+            if lexer is not None and len(code) <= self.maxHighlightChars:
+                key = HighlightCache.makeKey(lang or "text", code, self.formatterKey)
+                self.noteHighlightKey(key)
+                html = self.highlightCache.get(key)
+                if html is not None:
+                    return html
+                self.highlightInBackground(key, code, lexer)
+                env['pendingHighlight'] = True
+                return self.plainCode(code, lang or "text")
+
+        return self.highlightCode(code, lang, None)
 
     def highlightCode(self, code, lang, _attrs):
         if not lang:
             lang = "text"
+        lexer = self.resolveLexer(lang)
+        if lexer is None or len(code) > self.maxHighlightChars:
+            return self.plainCode(code, lang)
+
+        key = HighlightCache.makeKey(lang, code, self.formatterKey)
+        self.noteHighlightKey(key)
+        html = self.highlightCache.get(key)
+        if html is not None:
+            return html
         try:
-            lexer = get_lexer_by_name(lang, stripall=True)
-            return highlight(code, lexer, self.pygmentsFormatter)
+            with tracer.span("render.pygments", lang=lang, chars=len(code)):
+                html = highlight(code, lexer, self.pygmentsFormatter)
         except:
-            return f'<pre><code class="{lang}">{code}</code></pre>'
-
-    def renderMarkdown(self, markdownText):
-        processedText = self.preprocessSpecialStructures(markdownText)
-        html = self.md.render(processedText)
-        return self.postprocessHtml(html)
-
-    def preprocessSpecialStructures(self, text):
-        text = self.preprocessCodeBlocks(text)
-        text = self.preprocessBlockquotes(text)
-        return text
-
-    def preprocessCodeBlocks(self, text):
-        def replaceCodeBlock(match):
-            lang = match.group(1) or "text"
-            code = match.group(2)
-
-            if '```' in code or '~~~' in code:
-                return match.group(0)
-
-            try:
-                lexer = get_lexer_by_name(lang, stripall=True)
-                return highlight(code, lexer, self.pygmentsFormatter)
-            except:
-                return f'<pre><code class="{lang}">{code}</code></pre>'
-
-        text = re.sub(
-            r'```([a-zA-Z0-9+-]*)\n((?:.(?!```$))*?.?)```',
-            replaceCodeBlock,
-            text,
-            flags=re.DOTALL
-        )
+            return self.plainCode(code, lang)
+        self.highlightCache.put(key, html)
+        return html
 
-        text = re.sub(
-            r'~~~([a-zA-Z0-9+-]*)\n((?:.(?!~~~$))*?.?)~~~',
-            replaceCodeBlock,
-            text,
-            flags=re.DOTALL
-        )
+    def noteHighlightKey(self, key):
+        if self._usedHighlightKeys is not None:
+            self._usedHighlightKeys.append(key)
+
+    def releaseCache(self, cache, others=()):  # 标签页被清出内存：块缓存清空，只有它自己用到的高亮结果也一起扔
+        keep = set()
+        for other in others:
+            keep.update(other.usedHighlightKeys())
+        self.highlightCache.discard(cache.usedHighlightKeys() - keep)
+        cache.clear()
+
+    def highlightInBackground(self, key, code, lexer):
+        with self._pendingLock:
+            if key in self._pendingHighlights:
+                return
+            self._pendingHighlights.add(key)
+            if self._highlightExecutor is None:
+                self._highlightExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mplus-highlight")
+        self._highlightExecutor.submit(self._highlightJob, key, code, lexer)
 
-        return text
+    def _highlightJob(self, key, code, lexer):
+        try:
+            with tracer.span("render.pygments.background", lang=key[0], chars=len(code)):
+                html = highlight(code, lexer, self.pygmentsFormatter)
+        except Exception:
+            html = self.plainCode(code, key[0])
+        self.highlightCache.put(key, html)
+        with self._pendingLock:
+            self._pendingHighlights.discard(key)
+        for callback in list(self.highlightReadyCallbacks):
+            callback()
 
     @staticmethod
-    def preprocessBlockquotes(text): # 这个也是一坨，直接硬算引用块缩进
+    def plainCode(code, lang):
+        return f'<pre><code class="{escapeHtml(lang)}">{escapeHtml(code)}</code></pre>\n'
+
+    def renderMarkdown(self, markdownText, cache=None):
+        return ''.join(block.html for block in self.renderBlocks(markdownText, cache))
+
+    def renderBlocks(self, markdownText, cache=None, level=LEVEL_FULL, visibleRanges=()):
+        # level是降级级别（见RenderBudget），visibleRanges是看得见的源码行范围[(首行, 末行)]，只有屏幕外纯文本那一级用
+        with tracer.span("render.blocks", chars=len(markdownText), level=level) as span:
+            blocks = self._renderBlocks(markdownText, cache, level, visibleRanges)
+            span.set(blocks=len(blocks), rendered=self.lastRenderedCount)
+        return blocks
+
+    def _renderBlocks(self, markdownText, cache, level=LEVEL_FULL, visibleRanges=()):
+        # 按顶层块切开，每块按内容哈希缓存，只有新增/改动的块才真正渲染
+        if cache is None:
+            cache = self.blockCache
+        text = markdownText.replace('\r\n', '\n').replace('\r', '\n')
         lines = text.split('\n')
-        processed_lines = []
-        current_block = []
-        current_level = 0
-
-        for line in lines:
-            stripped = line.lstrip()
-            if not stripped:
-                # 空行结束当前引用块
-                if current_block:
-                    processed_lines.append(f'[BLOCKQUOTE level={current_level}]{"\n".join(current_block)}[/BLOCKQUOTE]')
-                    current_block = []
-                processed_lines.append('')
-                continue
 
-            if stripped.startswith('>'):
-                # 计算引用级别
-                level = 0
-                content = line
-                while content.startswith('>'):
-                    level += 1
-                    content = content[1:].lstrip()
-
-                # 新块或级别变化时刷新
-                if current_block and level != current_level:
-                    processed_lines.append(f'[BLOCKQUOTE level={current_level}]{"\n".join(current_block)}[/BLOCKQUOTE]')
-                    current_block = []
-
-                current_level = level
-                current_block.append(content)
+        with tracer.span("render.split", lines=len(lines)):
+            spans, refDefs, headings = self.splitBlocks(lines, cache)
+
+        # 引用式链接的定义会影响别的块，把它们也算进哈希；同名的以先出现的为准
+        references = {}
+        for _line, label, href, title in refDefs:
+            if label not in references:
+                references[label] = {'href': href, 'title': title}
+        refKey = repr(sorted((k, v['href'], v['title']) for k, v in references.items())) if references else ''
+        refsChanged = refKey != cache.refKey
+
+        oldEntries = cache.entries
+        oldHighlightKeys = cache.highlightKeys
+        newEntries = {}
+        newHighlightKeys = {}
+        blocks = []
+        renderedCount = 0
+        for startLine, endLine, oldBlock in spans:
+            pending = False
+            wanted = self.wantedLevel(level, startLine, endLine, visibleRanges)
+            # 标题信息跟着块走：沿用的块直接带过来，只有重新切出来的块才从这次的token里取
+            heading = oldBlock.heading if oldBlock is not None else headings.get(startLine)
+            # 降级后旧块照样沿用（质量只会更好）；升级了，比要求差的块才重新渲染
+            if oldBlock is not None and not refsChanged and not oldBlock.pending and oldBlock.level <= wanted:
+                key, html, blockLevel = oldBlock.key, oldBlock.html, oldBlock.level
             else:
-                # 非引用行，刷新当前块
-                if current_block:
-                    processed_lines.append(f'[BLOCKQUOTE level={current_level}]{"\n".join(current_block)}[/BLOCKQUOTE]')
-                    current_block = []
-                processed_lines.append(line)
+                source = '\n'.join(lines[startLine:endLine]) + '\n'
+                html = None
+                for blockLevel in range(wanted + 1):  # 缓存里有更好的就用更好的
+                    key = self.blockKey(source, refKey, blockLevel)
+                    html = newEntries.get(key)
+                    if html is None:
+                        html = oldEntries.get(key)
+                    if html is not None:
+                        break
+                if html is None:
+                    usedKeys = None
+                    if wanted == LEVEL_PLAIN_OFFSCREEN:
+                        html, blockLevel = self.plainBlock(source), LEVEL_PLAIN_OFFSCREEN
+                    else:
+                        self._usedHighlightKeys = []
+                        try:
+                            html, pending, blockLevel = self.renderSource(source, references, wanted)
+                        finally:
+                            usedKeys, self._usedHighlightKeys = self._usedHighlightKeys, None
+                    key = self.blockKey(source, refKey, blockLevel)
+                    if usedKeys:
+                        newHighlightKeys[key] = tuple(usedKeys)
+                    renderedCount += 1
+            if not pending:  # 占位的纯文本不进缓存，后台高亮好了要能换掉
+                newEntries[key] = html
+            if key in oldHighlightKeys and key not in newHighlightKeys:
+                newHighlightKeys[key] = oldHighlightKeys[key]
+            blocks.append(RenderedBlock(key, startLine, endLine, html, pending, heading, blockLevel))
+
+        self.lastRenderedCount = renderedCount
+        cache.entries = newEntries
+        cache.highlightKeys = newHighlightKeys
+        cache.lines = lines
+        cache.blocks = blocks
+        cache.refDefs = refDefs
+        cache.refKey = refKey
+        return blocks
+
+    def splitBlocks(self, lines, cache):
+        # 返回[(起始行, 结束行, 可沿用的旧块或None)]、引用定义和新切出来的标题{起始行: (级别, 文字)}
+        # 只重新切改动附近的一段，直到某个旧块在新文本里原样出现（对齐）就停
+        oldLines, oldBlocks = cache.lines, cache.blocks
+        if oldLines is None or not oldBlocks:
+            spans, refDefs, headings = self.parseSpans(lines, 0, len(lines))
+            return [(start, end, None) for start, end in spans], refDefs, headings
 
-        # 处理最后的块
-        if current_block:
-            processed_lines.append(f'[BLOCKQUOTE level={current_level}]{"\n".join(current_block)}[/BLOCKQUOTE]')
+        n, m = len(lines), len(oldLines)
+        prefix = self.commonPrefixLines(lines, oldLines)
+        if prefix == n == m:
+            return [(b.startLine, b.endLine, b) for b in oldBlocks], cache.refDefs, {}
+        suffix = self.commonSuffixLines(lines, oldLines, min(n, m) - prefix)
+        delta = n - m
+        oldChangedEnd = m - suffix  # 旧文本[prefix, oldChangedEnd)被换成了新文本[prefix, n - suffix)
 
-        return '\n'.join(processed_lines)
+        # 改动可能让前一个块吞掉它（列表续行、setext标题之类），所以从再往前一个块开始重切
+        starts = [b.startLine for b in oldBlocks]
+        k = max(0, bisect_right(starts, prefix) - 2)
+        restart = min(oldBlocks[k].startLine, prefix)
+
+        j = max(k, bisect_left(starts, oldChangedEnd))
+        while j < len(oldBlocks):
+            anchor = oldBlocks[j]
+            anchorStart, anchorEnd = anchor.startLine + delta, anchor.endLine + delta
+            # 多带一行，块的结尾要看下一行才能确定（比如列表后面的空行）
+            spans, refDefs, headings = self.parseSpans(lines, restart, min(n, anchorEnd + 1))
+            if (anchorStart, anchorEnd) in spans:
+                spans = [span for span in spans if span[0] < anchorStart]
+                refDefs = [ref for ref in refDefs if ref[0] < anchorStart]
+                merged, mergedRefs = self.mergeSpans(cache, k, j, delta, restart, anchorStart, spans, refDefs)
+                return merged, mergedRefs, headings
+            # 没对齐就把窗口翻倍再试
+            j = max(j + 1, bisect_left(starts, anchor.endLine + (anchor.endLine - restart)))
+
+        spans, refDefs, headings = self.parseSpans(lines, restart, n)
+        merged, mergedRefs = self.mergeSpans(cache, k, len(oldBlocks), delta, restart, n, spans, refDefs)
+        return merged, mergedRefs, headings
+
+    @staticmethod
+    def mergeSpans(cache, k, j, delta, restart, resyncLine, spans, refDefs):
+        # 旧块[:k]原样保留，中间换成新切出来的，旧块[j:]整体平移delta行
+        oldBlocks = cache.blocks
+        merged = [(b.startLine, b.endLine, b) for b in oldBlocks[:k]]
+        merged.extend((start, end, None) for start, end in spans)
+        merged.extend((b.startLine + delta, b.endLine + delta, b) for b in oldBlocks[j:])
+
+        oldResync = resyncLine - delta
+        mergedRefs = [ref for ref in cache.refDefs if ref[0] < restart]
+        mergedRefs.extend(refDefs)
+        mergedRefs.extend((line + delta, label, href, title)
+                          for line, label, href, title in cache.refDefs if line >= oldResync)
+        return merged, mergedRefs
+
+    def parseSpans(self, lines, startLine, endLine):
+        # 只跑块级解析，拿顶层token的map(源码行号)，换算回整篇文档的行号
+        env = {}
+        tokens = self.blockSplitter.parse('\n'.join(lines[startLine:endLine]), env)
+        spans = [
+            (token.map[0] + startLine, token.map[1] + startLine)
+            for token in tokens
+            if token.level == 0 and token.nesting != -1 and token.map
+        ]
+        # 顶层标题：heading_open后面紧跟的inline token就是标题的源码文字，大纲用
+        headings = {
+            token.map[0] + startLine: (int(token.tag[1:]), tokens[i + 1].content)
+            for i, token in enumerate(tokens)
+            if token.type == 'heading_open' and token.level == 0 and token.map
+        }
+        refDefs = [
+            (ref['map'][0] + startLine, label, ref.get('href'), ref.get('title'))
+            for label, ref in (env.get('references') or {}).items()
+        ]
+        refDefs.extend(
+            (ref['map'][0] + startLine, ref['label'], ref.get('href'), ref.get('title'))
+            for ref in env.get('duplicate_refs') or ()
+        )
+        refDefs.sort(key=lambda ref: ref[0])
+        return spans, refDefs, headings
+
+    @staticmethod
+    def commonPrefixLines(lines, oldLines):
+        limit = min(len(lines), len(oldLines))
+        lo, hi = 0, limit  # 二分，比较交给C层的列表切片
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if lines[:mid] == oldLines[:mid]:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
 
     @staticmethod
-    def _flushBlockquote(output, block, level):
-        if not block:
+    def commonSuffixLines(lines, oldLines, limit):
+        lo, hi = 0, max(0, limit)
+        n, m = len(lines), len(oldLines)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if lines[n - mid:] == oldLines[m - mid:]:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    @staticmethod
+    def wantedLevel(level, startLine, endLine, visibleRanges):  # 屏幕外纯文本那一级，看得见的块还是按上一级渲染
+        if level < LEVEL_PLAIN_OFFSCREEN:
+            return level
+        for first, last in visibleRanges:
+            if startLine <= last and endLine > first:
+                return LEVEL_NO_HIGHLIGHT
+        return LEVEL_PLAIN_OFFSCREEN
+
+    @staticmethod
+    def blockKey(source, refKey='', level=LEVEL_FULL):
+        digest = hashlib.blake2b(source.encode('utf-8'), digest_size=16)
+        if refKey:
+            digest.update(refKey.encode('utf-8'))
+        if level:  # 降级渲染的结果单独存，完整的key和以前一样
+            digest.update(b'\0level%d' % level)
+        return digest.digest()
+
+    @staticmethod
+    def plainBlock(source):
+        return '<pre>' + escapeHtml(source.rstrip('\n')) + '</pre>\n'
+
+    def renderSource(self, source, references=None, level=LEVEL_FULL):
+        # 单独渲染一段源码（一个块），返回(html, 是否有待高亮的代码, 实际降了几级)
+        # 实际级别：降了级但这块里没有代码块，结果和完整的一样，就还算完整
+        env = {'references': dict(references)} if references else {}
+        if level:
+            env['degrade'] = level
+        with tracer.span("render.md", chars=len(source)):
+            html = self.md.render(source, env)
+        with tracer.span("render.postprocess"):
+            html = self.postprocessHtml(html)
+        effective = LEVEL_NO_HIGHLIGHT if env.get('highlightSkipped') else LEVEL_FULL
+        return html, env.get('pendingHighlight', False), effective
+
+    @staticmethod
+    def blockquoteLevels(state):
+        # 嵌套引用拍平成相邻的<blockquote class="level-N">，和以前的输出保持一致
+        # 只有在列表之类的容器里面出现的嵌套引用才保留真正的嵌套，不然HTML标签会交叉
+        tokens = state.tokens
+        if not any(token.type == 'blockquote_open' for token in tokens):
             return
 
-        content = '\n'.join(block)
-        output.append(f'[BLOCKQUOTE level={level}]{content}[/BLOCKQUOTE]')
+        def openToken(level):
+            token = Token('blockquote_open', 'blockquote', 1)
+            token.markup = '>'
+            token.block = True
+            token.attrSet('class', f'level-{level}')
+            return token
+
+        def closeToken():
+            token = Token('blockquote_close', 'blockquote', -1)
+            token.markup = '>'
+            token.block = True
+            return token
+
+        output = []
+        depth = 0  # 当前总的引用层数
+        frames = []  # 每个打开的引用是不是被拍平了
+        segmentLevel = 0  # 当前打开的拍平段的层级，0表示没打开
+        segmentDepth = 0  # 拍平段里面其他容器的嵌套深度
+        nestedCount = 0  # 当前处在几层真嵌套的引用里
+
+        for token in tokens:
+            if token.type == 'blockquote_open':
+                depth += 1
+                if nestedCount or segmentDepth:
+                    token.attrSet('class', f'level-{depth}')
+                    output.append(token)
+                    frames.append(False)
+                    nestedCount += 1
+                    segmentDepth += 1
+                else:
+                    if segmentLevel:
+                        output.append(closeToken())
+                        segmentLevel = 0
+                    frames.append(True)
+                continue
+
+            if token.type == 'blockquote_close':
+                depth -= 1
+                if frames.pop():
+                    if segmentLevel:
+                        output.append(closeToken())
+                        segmentLevel = 0
+                else:
+                    output.append(token)
+                    nestedCount -= 1
+                    segmentDepth -= 1
+                continue
+
+            if depth and not segmentLevel and not nestedCount:
+                output.append(openToken(depth))
+                segmentLevel = depth
+                segmentDepth = 0
+            if segmentLevel:
+                segmentDepth += token.nesting
+
+            # 确保标题等元素没有外边距
+            if depth and token.type == 'heading_open' and token.tag in ('h1', 'h2', 'h3'):
+                token.attrSet('style', 'margin:0;padding:0;')
+            output.append(token)
+
+        state.tokens = output
 
     def postprocessHtml(self, html):
         # 先处理代码块
@@ -139,30 +506,4 @@ class MarkdownRenderer:
             html
         )
 
-        # 确保所有BLOCKQUOTE标记都被处理
-        while re.search(r'\[BLOCKQUOTE level=\d+\].*?\[/BLOCKQUOTE\]', html, re.DOTALL):
-            html = re.sub(
-                r'\[BLOCKQUOTE level=(\d+)\](.*?)\[/BLOCKQUOTE\]',
-                self.wrapBlockquote,
-                html,
-                flags=re.DOTALL
-            )
-
         return html
-
-    def wrapBlockquote(self, match):
-        level = int(match.group(1))
-        content = match.group(2)
-
-        # 清理可能残留的标记
-        content = re.sub(r'\[/?BLOCKQUOTE[^\]]*\]', '', content)
-
-        # 对引用内容单独进行Markdown渲染
-        rendered_content = self.md.render(content)
-
-        # 确保标题等元素没有外边距
-        rendered_content = rendered_content.replace('<h1>', '<h1 style="margin:0;padding:0;">')
-        rendered_content = rendered_content.replace('<h2>', '<h2 style="margin:0;padding:0;">')
-        rendered_content = rendered_content.replace('<h3>', '<h3 style="margin:0;padding:0;">')
-
-        return f'<blockquote class="level-{level}">{rendered_content}</blockquote>'
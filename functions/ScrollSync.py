@@ -0,0 +1,104 @@
+# 编辑器和预览的滚动同步：两边都换算成"源码第几行（带小数）"再对上
+# 编辑器一行就是一个QTextBlock；预览靠SourceMap找到渲染块，在块的高度里按行数比例插值，块之间的空行也插值
+# 谁在被操作谁说了算：编辑器滚动、移动光标带动预览；预览只有鼠标在上面或有焦点时才反过来带动编辑器
+# 预览打补丁时恢复滚动位置、延迟排版改了滚动范围这些都不算用户滚动
+
+from PySide6.QtCore import QObject
+
+from functions.SourceMap import blockNumberAtY
+
+
+def ratio(part, whole):
+    if whole <= 0:
+        return 0.0
+    return min(1.0, max(0.0, part / whole))
+
+
+class ScrollSync(QObject):
+    def __init__(self, editor, preview, parent=None):
+        super().__init__(parent)
+        self.editor = editor
+        self.preview = preview
+        self.enabled = True
+        self.syncing = False  # 自己设的滚动条，不再反过来同步
+        editor.verticalScrollBar().valueChanged.connect(self.onEditorMoved)
+        editor.cursorPositionChanged.connect(self.onEditorMoved)
+        preview.verticalScrollBar().valueChanged.connect(self.onPreviewScrolled)
+        preview.patched.connect(self.onEditorMoved)  # 预览内容变了，按编辑器重新对齐
+
+    def onEditorMoved(self):
+        if self.enabled and not self.syncing:
+            self.syncPreview()
+
+    def onPreviewScrolled(self):
+        preview = self.preview
+        if not self.enabled or self.syncing or preview.patching:
+            return
+        if preview.underMouse() or preview.hasFocus() or preview.verticalScrollBar().isSliderDown():
+            self.syncEditor()
+
+    def editorAnchor(self):  # 光标在可见范围里就让光标那一行对齐，否则对齐顶上
+        top = self.editor.cursorRect().top()
+        if 0 <= top < self.editor.viewport().height():
+            return top
+        return 0
+
+    def syncPreview(self):
+        if not len(self.preview.sourceMap):
+            return
+        anchor = self.editorAnchor()
+        line = self.editorLineAt(self.editor.verticalScrollBar().value() + anchor)
+        self.setScroll(self.preview, self.previewYAt(line) - anchor)
+
+    def syncEditor(self):
+        if not len(self.preview.sourceMap):
+            return
+        line = self.previewLineAt(self.preview.verticalScrollBar().value())
+        self.setScroll(self.editor, self.editorYAt(line))
+
+    def setScroll(self, widget, value):
+        self.syncing = True
+        try:
+            widget.verticalScrollBar().setValue(round(value))
+        finally:
+            self.syncing = False
+
+    def editorLineAt(self, y):
+        document = self.editor.document()
+        number = blockNumberAtY(document, y, self.editor.textCursor().blockNumber())  # 从光标附近找，大文件不用整篇排版
+        rect = document.documentLayout().blockBoundingRect(document.findBlockByNumber(number))
+        return number + ratio(y - rect.top(), rect.height())
+
+    def editorYAt(self, line):
+        document = self.editor.document()
+        number = min(int(line), document.blockCount() - 1)
+        rect = document.documentLayout().blockBoundingRect(document.findBlockByNumber(number))
+        return rect.top() + min(1.0, line - number) * rect.height()
+
+    def blockExtent(self, index):  # 渲染块在预览文档里的上下沿
+        first, last = self.preview.sourceMap.numberRange(index)
+        document = self.preview.document()
+        layout = document.documentLayout()
+        top = layout.blockBoundingRect(document.findBlockByNumber(first)).top()
+        bottom = layout.blockBoundingRect(document.findBlockByNumber(last)).bottom()
+        return top, max(top, bottom)
+
+    def previewYAt(self, line):
+        sourceMap = self.preview.sourceMap
+        index = sourceMap.blockAtLine(int(line))
+        top, bottom = self.blockExtent(index)
+        start, end = sourceMap.startLines[index], sourceMap.endLines[index]
+        if line < end or index + 1 == len(sourceMap):
+            return top + ratio(line - start, end - start) * (bottom - top)
+        nextTop = self.blockExtent(index + 1)[0]
+        return bottom + ratio(line - end, sourceMap.startLines[index + 1] - end) * (nextTop - bottom)
+
+    def previewLineAt(self, y):
+        sourceMap = self.preview.sourceMap
+        index = sourceMap.blockAtNumber(blockNumberAtY(self.preview.document(), y))
+        top, bottom = self.blockExtent(index)
+        start, end = sourceMap.startLines[index], sourceMap.endLines[index]
+        if y < bottom or index + 1 == len(sourceMap):
+            return start + ratio(y - top, bottom - top) * (end - start)
+        nextTop = self.blockExtent(index + 1)[0]
+        return end + ratio(y - bottom, nextTop - bottom) * (sourceMap.startLines[index + 1] - end)
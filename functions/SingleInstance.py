@@ -0,0 +1,90 @@
+# 单实例模式：第二次启动不再开新进程，把要打开的文件通过本地套接字交给已经在跑的那个
+# 打开方式：命令行 --single-instance，或者环境变量 MPLUS_SINGLE_INSTANCE=1（文件关联里加上就行）
+# 协议就一行JSON：{"files": [绝对路径...]}，没带文件就只是把窗口提到前面
+
+import getpass
+import hashlib
+import json
+import os
+
+from PySide6.QtCore import QObject, Signal
+from PySide6.QtNetwork import QLocalServer, QLocalSocket
+
+CONNECT_TIMEOUT_MS = 500
+
+
+def serverName():  # 每个用户一个，Windows上是命名管道，其它平台是/tmp下的套接字文件
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = str(os.getuid()) if hasattr(os, 'getuid') else 'user'
+    return 'MPlus-' + hashlib.sha1(user.encode('utf-8')).hexdigest()[:12]
+
+
+def enabledFromEnvironment():
+    return os.environ.get('MPLUS_SINGLE_INSTANCE', '') not in ('', '0')
+
+
+def sendToRunningInstance(files, timeoutMs=CONNECT_TIMEOUT_MS):  # 交接成功返回True，调用方直接退出
+    socket = QLocalSocket()
+    socket.connectToServer(serverName())
+    if not socket.waitForConnected(timeoutMs):
+        return False
+    payload = json.dumps({'files': [os.path.abspath(f) for f in files]}, ensure_ascii=False) + '\n'
+    socket.write(payload.encode('utf-8'))
+    ok = socket.waitForBytesWritten(timeoutMs)
+    socket.disconnectFromServer()
+    if socket.state() != QLocalSocket.UnconnectedState:
+        socket.waitForDisconnected(timeoutMs)
+    return ok
+
+
+class InstanceServer(QObject):
+    fileRequested = Signal(str)
+    activateRequested = Signal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.server = QLocalServer(self)
+        self.server.setSocketOptions(QLocalServer.UserAccessOption)  # 只让自己这个用户连
+        self.server.newConnection.connect(self.onNewConnection)
+        self.buffers = {}
+
+    def listen(self):
+        name = serverName()
+        # 先探一下：设了访问权限的话Qt会直接把同名套接字顶掉，不能靠listen失败来判断
+        probe = QLocalSocket()
+        probe.connectToServer(name)
+        if probe.waitForConnected(CONNECT_TIMEOUT_MS):
+            probe.disconnectFromServer()
+            return False  # 真有另一个实例（两个同时启动的情况），这个就当普通窗口用
+        QLocalServer.removeServer(name)  # 上次崩了留下的套接字文件，连不上就说明没人在用
+        return self.server.listen(name)
+
+    def onNewConnection(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            self.buffers[socket] = b''
+            socket.readyRead.connect(lambda s=socket: self.onReadyRead(s))
+            socket.disconnected.connect(lambda s=socket: self.onDisconnected(s))
+
+    def onReadyRead(self, socket):
+        self.buffers[socket] = self.buffers.get(socket, b'') + bytes(socket.readAll())
+
+    def onDisconnected(self, socket):
+        data = self.buffers.pop(socket, b'') + bytes(socket.readAll())
+        socket.deleteLater()
+        if not data:  # 别的实例启动时的探测连接
+            return
+        try:
+            request = json.loads(data.decode('utf-8') or '{}')
+        except ValueError:
+            return
+        files = [f for f in request.get('files', []) if isinstance(f, str)]
+        for filePath in files:
+            self.fileRequested.emit(filePath)
+        if not files:
+            self.activateRequested.emit()
+
+    def close(self):
+        self.server.close()
@@ -0,0 +1,90 @@
+# 源码行 <-> 预览位置的索引，滚动同步用
+# 渲染块自带源码行范围（markdown-it顶层token的map），预览打补丁时再记下每块从第几个QTextBlock开始
+# 两边都是有序的，滚动时二分查一次就行，不用扫预览文档；补丁只重算改动那一段往后的偏移
+
+from bisect import bisect_right
+
+
+class SourceMap:
+    def __init__(self):
+        self.startLines = []  # 每个渲染块的起始行
+        self.endLines = []  # 结束行（不含）
+        self.spans = []  # 每块在预览文档里占几个QTextBlock
+        self.offsets = [0]  # 每块第一个QTextBlock的编号，末尾多一个总数
+
+    def __len__(self):
+        return len(self.spans)
+
+    def clear(self):
+        self.startLines = []
+        self.endLines = []
+        self.spans = []
+        self.offsets = [0]
+
+    def replace(self, start, end, blocks, spans):  # 块[start, end)换成blocks，它们各占spans个QTextBlock
+        self.startLines[start:end] = [block.startLine for block in blocks]
+        self.endLines[start:end] = [block.endLine for block in blocks]
+        self.spans[start:end] = spans
+        offsets = self.offsets
+        del offsets[start + 1:]
+        total = offsets[start]
+        for span in self.spans[start:]:
+            total += span
+            offsets.append(total)
+
+    def setLines(self, blocks):  # 块没变、只是前面插删了空行整体挪了位置
+        if len(blocks) == len(self.spans):
+            self.startLines = [block.startLine for block in blocks]
+            self.endLines = [block.endLine for block in blocks]
+
+    def blockAtLine(self, line):  # 起始行<=line的最后一块，没有块返回-1
+        if not self.spans:
+            return -1
+        return max(0, bisect_right(self.startLines, line) - 1)
+
+    def blockAtNumber(self, number):  # 第number个QTextBlock属于哪个渲染块
+        if not self.spans:
+            return -1
+        return min(len(self.spans) - 1, max(0, bisect_right(self.offsets, number) - 1))
+
+    def numberRange(self, index):  # 渲染块占的QTextBlock编号[first, last]
+        return self.offsets[index], self.offsets[index + 1] - 1
+
+
+def blockNumberAtY(document, y, hint=None):  # 文档坐标y处的QTextBlock编号，按块的上沿二分
+    # 给了hint（大概在哪一块附近）就先从那里往一边倍增夹出范围再二分，只碰附近的块；
+    # 编辑器是边显示边排版的，直接二分会先摸文档中间那块，逼着Qt把前半篇全排完，10MB要好几秒
+    layout = document.documentLayout()
+
+    def blockTop(number):
+        return layout.blockBoundingRect(document.findBlockByNumber(number)).top()
+
+    low, high = 0, document.blockCount() - 1
+    if hint is not None:
+        hint = min(max(hint, 0), high)
+        step = 1
+        if blockTop(hint) <= y:
+            low = hint
+            while low < high:
+                probe = min(high, low + step)
+                if blockTop(probe) > y:
+                    high = probe - 1
+                    break
+                low = probe
+                step *= 2
+        else:
+            high = max(low, hint - 1)
+            while low < high:
+                probe = max(low, high - step)
+                if blockTop(probe) <= y:
+                    low = probe
+                    break
+                high = probe - 1
+                step *= 2
+    while low < high:
+        middle = (low + high + 1) // 2
+        if blockTop(middle) <= y:
+            low = middle
+        else:
+            high = middle - 1
+    return low
@@ -0,0 +1,67 @@
+# 启动耗时分阶段统计，MarkPlus.py --profile-startup 时打印出来（--profile-startup=路径 写进文件）
+# 计时一直在记（就几次perf_counter），只有开了开关才输出；追踪打开时也会进trace文件（startup.*）
+# --startup-budget=毫秒 超了返回1，打包后的冷启动可以拿它在CI里卡住
+
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from functions.Tracer import tracer
+
+
+class StartupProfile:
+    def __init__(self):
+        self.origin = time.perf_counter()  # 本模块被导入的时间，差不多就是入口第一行
+        self.enabled = False
+        self.budgetMs = None
+        self.reportPath = None  # 没给就打到stderr
+        self.phases = []  # (名字, 开始, 耗时, 线程名)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, started, time.perf_counter() - started)
+
+    def mark(self, name):  # 某个时间点：从入口到现在
+        self.add(name, self.origin, time.perf_counter() - self.origin)
+
+    def add(self, name, started, duration):
+        thread = threading.current_thread()
+        threadName = "GUI" if thread is threading.main_thread() else thread.name
+        with self._lock:
+            self.phases.append((name, started, duration, threadName))
+        tracer.record("startup." + name, started, duration)
+
+    def elapsedMs(self):
+        return (time.perf_counter() - self.origin) * 1000
+
+    def overBudget(self, totalMs):
+        return self.budgetMs is not None and totalMs > self.budgetMs
+
+    def report(self, totalMs):
+        lines = ["MPlus 启动耗时（从入口开始算，单位ms）", f"  {'阶段':<26}{'开始':>7}{'耗时':>7}  线程"]
+        with self._lock:
+            phases = sorted(self.phases, key=lambda p: p[1] + p[2])
+        for name, started, duration, threadName in phases:
+            lines.append(f"  {name:<28}{(started - self.origin) * 1000:9.1f}{duration * 1000:9.1f}  {threadName}")
+        summary = f"总计 {totalMs:.1f} ms"
+        if self.budgetMs is not None:
+            summary += f"，预算 {self.budgetMs:.0f} ms：" + ("超出" if self.overBudget(totalMs) else "OK")
+        lines.append(summary)
+        return "\n".join(lines)
+
+    def writeReport(self, totalMs):
+        report = self.report(totalMs)
+        if self.reportPath:
+            with open(self.reportPath, "w", encoding="utf-8") as f:
+                f.write(report + "\n")
+        elif sys.stderr is not None:  # 打包版是console=False，没有控制台时stderr/stdout都是None
+            print(report, file=sys.stderr)
+
+
+startupProfile = StartupProfile()
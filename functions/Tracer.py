@@ -0,0 +1,127 @@
+# 渲染各阶段的计时，默认关闭
+# 打开方式：环境变量 MPLUS_TRACE=1，或者菜单 调试 -> 性能追踪
+# 可以导出成Chrome的trace-event JSON（chrome://tracing 或 ui.perfetto.dev 直接打开），方便贴到bug报告里
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class _NullSpan:  # 关闭时用的空span，进出都不做事
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        return False
+
+    def set(self, **_args):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "started")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *_exc):
+        self.tracer.record(self.name, self.started, time.perf_counter() - self.started, self.args)
+        return False
+
+    def set(self, **args):  # 结束前补充大小之类的参数
+        self.args.update(args)
+
+
+class Tracer:
+    def __init__(self, maxEvents=50_000, enabled=None):
+        if enabled is None:
+            enabled = os.environ.get("MPLUS_TRACE", "") not in ("", "0")
+        self.enabled = enabled
+        self._events = deque(maxlen=maxEvents)  # 只留最近的，开一整天也不会把内存吃光
+        self._threadNames = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._latest = {}  # 阶段名 -> 最近几次的耗时，给状态栏用
+        self.listeners = []  # record之后调用（可能在任意线程）
+
+    def setEnabled(self, enabled):
+        self.enabled = enabled
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, args)
+
+    def record(self, name, started, duration, args=None):
+        if not self.enabled:
+            return
+        thread = threading.current_thread()
+        tid = threading.get_ident()
+        with self._lock:
+            if tid not in self._threadNames:
+                self._threadNames[tid] = "GUI" if thread is threading.main_thread() else thread.name
+            self._events.append((name, started, duration, tid, args or None))
+            recent = self._latest.get(name)
+            if recent is None:
+                recent = self._latest[name] = deque(maxlen=30)
+            recent.append(duration)
+        for listener in list(self.listeners):
+            listener(name, duration)
+
+    def recent(self, name):  # (最近一次, 平均)，单位秒；没有记录返回None
+        with self._lock:
+            durations = self._latest.get(name)
+            if not durations:
+                return None
+            return durations[-1], sum(durations) / len(durations)
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self._latest.clear()
+
+    def traceEvents(self):
+        pid = os.getpid()
+        with self._lock:
+            events = list(self._events)
+            threadNames = dict(self._threadNames)
+        output = [
+            {"ph": "M", "name": "thread_name", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in threadNames.items()
+        ]
+        for name, started, duration, tid, args in events:
+            event = {
+                "name": name,
+                "cat": name.split(".", 1)[0],
+                "ph": "X",
+                "ts": round((started - self._origin) * 1e6, 1),
+                "dur": round(duration * 1e6, 1),
+                "pid": pid,
+                "tid": tid,
+            }
+            if args:
+                event["args"] = args
+            output.append(event)
+        return output
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": self.traceEvents(), "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+
+# 进程内共用一个
+tracer = Tracer()